@@ -0,0 +1,177 @@
+"""Хранилище результатов задач в памяти с выгрузкой на диск"""
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+from typing import Any, Optional
+import logging
+import os
+import pickle
+import sys
+
+from data import Data
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_size(value: Any) -> int:
+    """Оценка занимаемой значением памяти: для строк и байтов -
+    длина, для коллекций - размер коллекции и ее элементов
+    без дальнейшего спуска"""
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, memoryview):
+        return value.nbytes
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        value = [*value.keys(), *value.values()]
+    if isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+class ArtifactStore:
+    """Общее хранилище результатов задач по ключу (uid задачи).
+    Значения хранятся в памяти, значение больше spill_threshold
+    сразу выгружается на диск в spill_dir. Когда значения в памяти
+    превышают memory_limit, давно не использованные выгружаются.
+    Выгруженное значение читается с диска при каждом обращении.
+    Когда файлы выгрузки превышают disk_limit, давно
+    не использованные выгруженные значения удаляются совсем.
+    Значение, которое нельзя сериализовать, остается в памяти"""
+    def __init__(
+            self, spill_dir: str, memory_limit: int = 64 * 1024 * 1024,
+            spill_threshold: int = 1024 * 1024,
+            disk_limit: int = 1024 * 1024 * 1024):
+
+        self.spill_dir = spill_dir
+        self.memory_limit = memory_limit
+        self.spill_threshold = spill_threshold
+        self.disk_limit = disk_limit
+        self.__memory: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self.__spilled: OrderedDict[str, int] = OrderedDict()
+        self.__used = 0
+        self.__disk_used = 0
+        self.__lock = Lock()
+
+    def __path(self, key: str) -> str:
+        """Путь к файлу выгруженного значения"""
+        name = sha256(key.encode()).hexdigest()
+        return os.path.join(self.spill_dir, f'{name}.pickle')
+
+    def __spill(self, key: str, value: Any) -> bool:
+        """Запись значения на диск. Возвращает признак успеха.
+        Вызывается под блокировкой"""
+        path = self.__path(key)
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(f'{path}.tmp', 'wb') as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+                size = file.tell()
+            os.replace(f'{path}.tmp', path)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError):
+            logger.exception('can not spill artifact %s', key)
+            return False
+        self.__spilled[key] = size
+        self.__disk_used += size
+        self.__evict_spilled(keep=key)
+        return True
+
+    def __evict_spilled(self, keep: str):
+        """Удаление давно не использованных выгруженных значений,
+        пока файлы выгрузки превышают предел.
+        Вызывается под блокировкой"""
+        for key in list(self.__spilled):
+            if self.__disk_used <= self.disk_limit:
+                return
+            if key != keep:
+                logger.warning('artifact %s is evicted', key)
+                self.__discard(key)
+
+    def __discard(self, key: str):
+        """Удаление значения. Вызывается под блокировкой"""
+        item = self.__memory.pop(key, None)
+        if item is not None:
+            self.__used -= item[1]
+        if key in self.__spilled:
+            self.__disk_used -= self.__spilled.pop(key)
+            try:
+                os.remove(self.__path(key))
+            except OSError:
+                pass
+
+    def __evict(self, keep: str):
+        """Выгрузка давно не использованных значений, пока память
+        превышает предел. Вызывается под блокировкой"""
+        if self.__used <= self.memory_limit:
+            return
+        for key in list(self.__memory):
+            if self.__used <= self.memory_limit:
+                return
+            if key == keep:
+                continue
+            value, size = self.__memory[key]
+            if self.__spill(key, value):
+                del self.__memory[key]
+                self.__used -= size
+
+    def put(self, key: str, value: Any):
+        """Метод сохраняет значение, заменяя прежнее"""
+        size = estimate_size(value)
+        with self.__lock:
+            self.__discard(key)
+            if size > self.spill_threshold and self.__spill(key, value):
+                return
+            self.__memory[key] = (value, size)
+            self.__used += size
+            self.__evict(keep=key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Метод возвращает значение или default"""
+        with self.__lock:
+            item = self.__memory.get(key)
+            if item is not None:
+                self.__memory.move_to_end(key)
+                return item[0]
+            if key not in self.__spilled:
+                return default
+            self.__spilled.move_to_end(key)
+            try:
+                with open(self.__path(key), 'rb') as file:
+                    return pickle.load(file)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                logger.exception('can not load artifact %s', key)
+                return default
+
+    def __contains__(self, key: str) -> bool:
+        with self.__lock:
+            return key in self.__memory or key in self.__spilled
+
+    def delete(self, key: str):
+        """Метод удаляет значение из памяти и с диска"""
+        with self.__lock:
+            self.__discard(key)
+
+    def clear(self):
+        """Метод удаляет все значения"""
+        with self.__lock:
+            for key in list(self.__memory) + list(self.__spilled):
+                self.__discard(key)
+
+
+_default_store: Optional[ArtifactStore] = None
+_default_store_lock = Lock()
+
+
+def default_store() -> ArtifactStore:
+    """Общее хранилище с настройками из Data"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            data = Data()
+            _default_store = ArtifactStore(
+                data.artifact_dir,
+                memory_limit=data.artifact_memory_bytes,
+                spill_threshold=data.artifact_spill_bytes,
+                disk_limit=data.artifact_disk_bytes,
+            )
+        return _default_store
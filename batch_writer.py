@@ -0,0 +1,132 @@
+"""Фоновая пакетная запись записей в файл"""
+from queue import Queue, Empty
+from threading import Thread, Event
+from time import monotonic
+from typing import Any, Optional, TextIO
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BatchWriter:
+    """Класс, записывающий записи в файл из одного фонового потока.
+    Вызывающий поток только кладет запись в ограниченную очередь
+    (при переполнении очереди он ждет освобождения места).
+    Фоновый поток набирает пачку размером до batch_size записей
+    или за flush_interval секунд, форматирует её, записывает
+    одним вызовом и, если задан fsync, сбрасывает на диск
+    (групповая фиксация). Порядок записей сохраняется"""
+    def __init__(
+            self, path: str, mode: str = 'a', fsync: bool = False,
+            flush_interval: float = 0.05, batch_size: int = 1000,
+            buffer_size: int = 100000):
+
+        self.path = path
+        self.__mode = mode
+        self.__fsync = fsync
+        self.__flush_interval = flush_interval
+        self.__batch_size = batch_size
+        self.__queue: Queue = Queue(maxsize=buffer_size)
+        self.__thread: Optional[Thread] = None
+        self.__file: Optional[TextIO] = None
+
+    def start(self):
+        """Метод открывает файл и запускает фоновый поток"""
+        if self.__thread is not None:
+            return
+        self.__file = open(self.path, self.__mode)
+        self.__thread = Thread(
+            target=self.__loop,
+            name=f'{type(self).__name__}({self.path})',
+            daemon=True,
+        )
+        self.__thread.start()
+
+    def write(self, record: Any):
+        """Метод ставит запись в очередь на запись"""
+        self.__queue.put(record)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Метод ждет, пока все поставленные ранее записи
+        будут записаны. Возвращает False, если истек timeout"""
+        if self.__thread is None:
+            return True
+        done = Event()
+        self.__queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        """Метод дописывает очередь, останавливает
+        фоновый поток и закрывает файл"""
+        if self.__thread is None:
+            return
+        self.__queue.put(_STOP)
+        self.__thread.join()
+        self.__thread = None
+
+    def _format(self, record: Any) -> str:
+        """Форматирует запись в строку.
+        Выполняется в фоновом потоке"""
+        return f'{record}\n'
+
+    def _after_commit(self, file: TextIO):
+        """Вызывается в фоновом потоке после записи каждой пачки"""
+
+    def __collect(self, first: Any) -> tuple[list, list[Event], bool]:
+        """Метод набирает пачку записей, начиная с первой.
+        Возвращает записи, события ожидающих flush
+        и признак остановки"""
+        records: list = []
+        waiters: list[Event] = []
+        item = first
+        deadline = monotonic() + self.__flush_interval
+        while True:
+            if item is _STOP:
+                return records, waiters, True
+            if isinstance(item, Event):
+                waiters.append(item)
+                return records, waiters, False
+            records.append(item)
+            if len(records) >= self.__batch_size:
+                return records, waiters, False
+            try:
+                item = self.__queue.get_nowait()
+            except Empty:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return records, waiters, False
+                try:
+                    item = self.__queue.get(timeout=remaining)
+                except Empty:
+                    return records, waiters, False
+
+    def __commit(self, records: list):
+        """Метод записывает пачку одним вызовом
+        и фиксирует её на диске"""
+        file = self.__file
+        if file is None:
+            return
+        if records:
+            file.write(''.join(self._format(record) for record in records))
+            file.flush()
+            if self.__fsync:
+                os.fsync(file.fileno())
+        self._after_commit(file)
+
+    def __loop(self):
+        """Цикл фонового потока"""
+        is_stop = False
+        while not is_stop:
+            records, waiters, is_stop = self.__collect(self.__queue.get())
+            try:
+                self.__commit(records)
+            except (OSError, ValueError, TypeError):
+                logger.exception('%s failed to write batch', self)
+            for waiter in waiters:
+                waiter.set()
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
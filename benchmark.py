@@ -0,0 +1,421 @@
+"""Нагрузочные тесты планировщика на синтетических задачах.
+Запуск: python benchmark.py [нагрузки] --output result.json,
+сравнение с прошлой ревизией: python benchmark.py --compare base.json"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from threading import Thread
+from time import time
+from typing import Any, Callable, Iterator, Optional
+import argparse
+import inspect
+import json
+import os
+import platform
+import sys
+import tempfile
+
+from job import Job
+from job_types import JobWithFiles, JobWithFS, JobWithNet
+from scheduler import Scheduler
+from settings_store import clear_status_file, set_logging
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore
+
+# прогоны на одной машине расходятся на 10-20%
+DEFAULT_THRESHOLD = 0.2
+# изменения задержки меньше миллисекунды - шум
+LATENCY_NOISE = 0.001
+
+
+def _noop(_arg: Any) -> tuple[str, int]:
+    """Пустая задача"""
+    return ('success', 0)
+
+
+class Probe:
+    """Обертка целей задач, которая запоминает время начала
+    и окончания каждой задачи, и сведения о том, когда задача
+    становится готовой: время start_at и зависимости.
+    cleanups - действия после прогона нагрузки"""
+    def __init__(self):
+        self.cleanups: list[Callable[[], None]] = []
+        self.started: dict[int, float] = {}
+        self.ended: dict[int, float] = {}
+        self.not_before: dict[int, float] = {}
+        self.dependencies: dict[int, tuple[int, ...]] = {}
+        self.jobs: list[Job] = []
+
+    def job(
+            self, func: Callable, args: Any,
+            dependencies: tuple[int, ...] = (),
+            start_at: Optional[datetime] = None) -> int:
+        """Метод создает задачу с целью func и возвращает ее номер.
+        Категория задачи берется из класса цели"""
+        key = len(self.jobs)
+        self.dependencies[key] = dependencies
+        if start_at is not None:
+            self.not_before[key] = start_at.timestamp()
+        self.jobs.append(Job(
+            target=partial(self.call, key, func), args=args,
+            start_at=start_at or '',
+            dependencies=tuple(self.jobs[index] for index in dependencies),
+            category=getattr(
+                getattr(func, '__self__', None), 'category', None
+            ),
+        ))
+        return key
+
+    def call(self, key: int, func: Callable, *args: Any) -> Any:
+        """Вызов цели с записью времени начала и окончания.
+        Окончание генератора отмечается, когда он дочитан"""
+        self.started.setdefault(key, time())
+        output = func(*args)
+        if inspect.isgenerator(output):
+            return self.__track(key, output)
+        self.ended[key] = time()
+        return output
+
+    def __track(self, key: int, output: Iterator) -> Iterator:
+        """Генератор, отмечающий окончание задачи"""
+        result = yield from output
+        self.ended[key] = time()
+        return result
+
+    def ready_at(self, key: int, submitted_at: float) -> float:
+        """Момент, когда задача стала готовой: запуск планировщика,
+        start_at или окончание последней зависимости"""
+        return max(
+            submitted_at, self.not_before.get(key, 0.0),
+            *(self.ended.get(dep, 0.0) for dep in self.dependencies[key]),
+        )
+
+    def latencies(self, submitted_at: float) -> list[float]:
+        """Задержки выдачи задач: от готовности задачи
+        до начала ее цели. Включают ожидание свободного потока"""
+        return [
+            max(started - self.ready_at(key, submitted_at), 0.0)
+            for key, started in self.started.items()
+        ]
+
+    def active_seconds(self, submitted_at: float) -> float:
+        """Время от готовности первой задачи до окончания
+        последней: ожидание start_at в него не входит"""
+        if not self.ended:
+            return 0.0
+        first = min(self.ready_at(key, submitted_at) for key in self.started)
+        return max(self.ended.values()) - first
+
+
+def build_noop(probe: Probe, size: int, workdir: str):
+    """Независимые пустые задачи"""
+    for index in range(size):
+        probe.job(_noop, (index,))
+
+
+def build_wide(probe: Probe, size: int, workdir: str):
+    """Широкий граф: корень, size задач после него и сток,
+    ожидающий их всех"""
+    root = probe.job(_noop, (0,))
+    middle = tuple(
+        probe.job(_noop, (index,), dependencies=(root,))
+        for index in range(size)
+    )
+    probe.job(_noop, (0,), dependencies=middle)
+
+
+def build_deep(probe: Probe, size: int, workdir: str):
+    """Глубокий граф: цепочка из size задач"""
+    previous: tuple[int, ...] = ()
+    for index in range(size):
+        previous = (probe.job(_noop, (index,), dependencies=previous),)
+
+
+def build_storm(probe: Probe, size: int, workdir: str):
+    """Шторм start_at: size задач с одним временем запуска"""
+    start_at = datetime.now() + timedelta(seconds=0.5)
+    for index in range(size):
+        probe.job(_noop, (index,), start_at=start_at)
+
+
+def build_fs(probe: Probe, size: int, workdir: str):
+    """Смешанные задачи ФС и файлов: запись файла, чтение
+    после записи и удаление после чтения"""
+    files, fs = JobWithFiles(), JobWithFS()
+    for index in range(size // 3):
+        path = os.path.join(workdir, f'bench_{index}.txt')
+        written = probe.job(
+            files.write_file, ((path, 'line\n' * 100, 'w'),)
+        )
+        read = probe.job(files.read_file, (path,), dependencies=(written,))
+        probe.job(fs.delete, (path,), dependencies=(read,))
+
+
+class CityHandler(BaseHTTPRequestHandler):
+    """Локальная замена сервиса погоды: keep-alive сервер,
+    отдающий json города на любой путь"""
+    protocol_version = 'HTTP/1.1'
+    body = (
+        '{"geo_object": {"locality": {"name": "Benchcity"}, '
+        '"country": {"name": "Benchland"}}}'
+    ).encode()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def build_net(probe: Probe, size: int, workdir: str):
+    """Сетевые задачи против локального сервера.
+    Адреса различаются, чтобы ответы не брались из кэша"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CityHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    probe.cleanups += [server.shutdown, server.server_close]
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    net = JobWithNet()
+    for index in range(size):
+        probe.job(net.read_url, (f'{base_url}/city/{index}',))
+
+
+WORKLOADS: dict[str, tuple[Callable[[Probe, int, str], None], int]] = {
+    'noop': (build_noop, 2000),
+    'wide': (build_wide, 2000),
+    'deep': (build_deep, 500),
+    'storm': (build_storm, 1000),
+    'fs': (build_fs, 600),
+    'net': (build_net, 200),
+}
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Перцентиль по отсортированным значениям"""
+    if not values:
+        return 0.0
+    index = min(int(q * len(values)), len(values) - 1)
+    return values[index]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Пиковый объем памяти процесса в мегабайтах
+    (None, если система его не сообщает)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def measure(name: str, scale: float, pool_size: int, workdir: str) -> dict:
+    """Прогон нагрузки в текущем процессе.
+    Возвращает пропускную способность, задержки выдачи и память.
+    Пропускная способность считается по времени работы задач,
+    без ожидания start_at"""
+    build, size = WORKLOADS[name]
+    probe = Probe()
+    try:
+        build(probe, max(int(size * scale), 1), workdir)
+        scheduler = Scheduler(pool_size=pool_size)
+        for job in probe.jobs:
+            scheduler.schedule(job)
+        submitted_at = time()
+        scheduler.run()
+        scheduler.join()
+        elapsed = time() - submitted_at
+        scheduler.stop()
+    finally:
+        for cleanup in probe.cleanups:
+            cleanup()
+    latencies = sorted(probe.latencies(submitted_at))
+    active = probe.active_seconds(submitted_at)
+    return {
+        'jobs': len(probe.jobs),
+        'failed': sum(not job.is_successful for job in probe.jobs),
+        'seconds': elapsed,
+        'throughput': len(probe.jobs) / active if active > 0 else 0.0,
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p99': percentile(latencies, 0.99),
+        'latency_max': latencies[-1] if latencies else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def _measure_isolated(name: str, scale: float, pool_size: int) -> dict:
+    """Прогон нагрузки в отдельном процессе во временной директории,
+    чтобы пиковая память и файлы задач не смешивались"""
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        return measure(name, scale, pool_size, workdir)
+
+
+def run_workload(
+        name: str, scale: float, pool_size: int, repeat: int) -> dict:
+    """Прогон нагрузки repeat раз в отдельных процессах.
+    Возвращает прогон с медианной пропускной способностью"""
+    runs = []
+    for _ in range(repeat):
+        with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as pool:
+            runs.append(
+                pool.submit(_measure_isolated, name, scale, pool_size)
+                .result()
+            )
+    runs.sort(key=lambda run: run['throughput'])
+    return runs[len(runs) // 2]
+
+
+def _changes(baseline: dict, current: dict, threshold: float) -> Iterator[
+        tuple[str, str, float, float, float, bool]]:
+    """Изменения метрик нагрузок, которые есть в обоих результатах:
+    нагрузка, метрика, базовое и текущее значение, относительное
+    изменение и признак регрессии"""
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        for metric, worse in (
+                ('throughput', -1), ('latency_p99', 1), ('peak_rss_mb', 1)):
+            old, new = base.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            is_noise = metric == 'latency_p99' and new - old < LATENCY_NOISE
+            is_regression = change * worse > threshold and not is_noise
+            yield name, metric, old, new, change, is_regression
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    """Сравнение результатов с базовыми.
+    Регрессия - падение пропускной способности или рост задержки p99
+    и пиковой памяти больше чем на threshold.
+    Возвращает описания регрессий"""
+    return [
+        f'{name} {metric} {change:+.1%}'
+        for name, metric, _, _, change, is_regression
+        in _changes(baseline, current, threshold)
+        if is_regression
+    ]
+
+
+def comparison_table(
+        baseline: dict, current: dict, threshold: float) -> list[str]:
+    """Строки таблицы сравнения результатов с базовыми"""
+    lines = [f'{"workload":<8} {"metric":<12} {"base":>12} {"current":>12}']
+    for name, metric, old, new, change, _ in _changes(
+            baseline, current, threshold):
+        lines.append(
+            f'{name:<8} {metric:<12} {old:>12.4f} {new:>12.4f}'
+            f' {change:+.1%}'
+        )
+    return lines
+
+
+def format_result(name: str, result: dict) -> str:
+    """Строка итогов прогона нагрузки"""
+    return (
+        f'{name:<8} {result["jobs"]:>6} jobs'
+        f' {result["throughput"]:>10.1f} jobs/s'
+        f' p50 {result["latency_p50"] * 1000:>8.3f} ms'
+        f' p99 {result["latency_p99"] * 1000:>8.3f} ms'
+        f' rss {result["peak_rss_mb"] or 0:>7.1f} MB'
+        f' failed {result["failed"]}'
+    )
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    """Разбор аргументов командной строки"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'workloads', nargs='*',
+        help=f'нагрузки: {", ".join(WORKLOADS)} (по умолчанию все)',
+    )
+    parser.add_argument(
+        '--scale', type=float, default=1.0,
+        help='множитель числа задач нагрузок',
+    )
+    parser.add_argument('--pool-size', type=int, default=10)
+    parser.add_argument(
+        '--repeat', type=int, default=1,
+        help='число прогонов, в результат идет медианный',
+    )
+    parser.add_argument('--output', help='файл для результатов в json')
+    parser.add_argument(
+        '--compare', metavar='BASELINE',
+        help='json прошлой ревизии для сравнения',
+    )
+    parser.add_argument(
+        '--input',
+        help='сравнить готовые результаты вместо нового прогона',
+    )
+    parser.add_argument(
+        '--threshold', type=float, default=DEFAULT_THRESHOLD,
+        help='допустимое ухудшение метрик при сравнении',
+    )
+    args = parser.parse_args(argv)
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f'unknown workloads: {", ".join(sorted(unknown))}')
+    return args
+
+
+def run(args: argparse.Namespace) -> dict:
+    """Прогон выбранных нагрузок"""
+    results = {}
+    for name in args.workloads or WORKLOADS:
+        results[name] = run_workload(
+            name, args.scale, args.pool_size, args.repeat
+        )
+    return {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'scale': args.scale,
+            'pool_size': args.pool_size,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """Точка входа: прогон, сохранение и сравнение результатов.
+    Возвращает 1, если найдены регрессии"""
+    args = parse_args(argv)
+    if args.input:
+        with open(args.input) as file:
+            current = json.load(file)
+    else:
+        current = run(args)
+        for name, result in current['results'].items():
+            print(format_result(name, result))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(current, file, indent=1)
+    if not args.compare:
+        return 0
+    with open(args.compare) as file:
+        baseline = json.load(file)
+    for line in comparison_table(baseline, current, args.threshold):
+        print(line)
+    regressions = compare(baseline, current, args.threshold)
+    for regression in regressions:
+        print(f'REGRESSION: {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    set_logging()
+    clear_status_file()
+    sys.exit(main())
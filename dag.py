@@ -0,0 +1,76 @@
+"""Граф зависимостей задач для планировщика"""
+from collections import defaultdict
+from typing import Iterable
+
+from job import Job
+
+
+class CycleError(ValueError):
+    """Ошибка добавления задачи, замыкающей цикл зависимостей"""
+
+
+class JobGraph:
+    """Граф зависимостей задач.
+    Для каждой ожидающей задачи хранится число
+    незавершенных задач-зависимостей (полустепень захода),
+    для каждой зависимости - список зависящих от неё задач.
+    Задача отдается на выполнение, когда счетчик обнуляется,
+    поэтому ни один поток не ждет зависимости"""
+    def __init__(self):
+        self.__waiting: dict[Job, int] = {}
+        self.__dependents: defaultdict[Job, list[Job]] = defaultdict(list)
+        self.__nodes: set[Job] = set()
+
+    def __len__(self) -> int:
+        """Количество задач, ожидающих зависимости"""
+        return len(self.__waiting)
+
+    def __check_cycle(self, job: Job, dependencies: Iterable[Job]):
+        """Обход зависимостей в глубину в поисках самой задачи.
+        Путь продолжают только задачи, уже добавленные в граф
+        и не завершенные: цикл среди еще не добавленных задач
+        будет найден при добавлении последней из них"""
+        visited: set[Job] = set()
+        stack = list(dependencies)
+        while stack:
+            dependency = stack.pop()
+            if dependency is job:
+                raise CycleError(f'job {job} depends on itself')
+            if (dependency in visited or dependency.is_end
+                    or dependency not in self.__nodes):
+                continue
+            visited.add(dependency)
+            stack.extend(dependency.dependencies)
+
+    def add(self, job: Job) -> bool:
+        """Метод добавляет задачу в граф.
+        Цикл может замкнуться только через задачу, от которой
+        уже зависят другие, поэтому обход выполняется лишь для них.
+        Возвращает True, если задача может выполняться сразу"""
+        dependencies = {
+            dependency for dependency in job.dependencies
+            if not dependency.is_end
+        }
+        if job in self.__dependents or job in dependencies:
+            self.__check_cycle(job, dependencies)
+        self.__nodes.add(job)
+        if not dependencies:
+            return True
+
+        self.__waiting[job] = len(dependencies)
+        for dependency in dependencies:
+            self.__dependents[dependency].append(job)
+        return False
+
+    def complete(self, job: Job) -> list[Job]:
+        """Метод отмечает завершение задачи.
+        Возвращает задачи, у которых завершилась
+        последняя зависимость"""
+        self.__nodes.discard(job)
+        ready = []
+        for dependent in self.__dependents.pop(job, ()):
+            self.__waiting[dependent] -= 1
+            if not self.__waiting[dependent]:
+                del self.__waiting[dependent]
+                ready.append(dependent)
+        return ready
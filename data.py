@@ -1,18 +1,99 @@
 """Описание класса с данными"""
+from typing import Optional
+import os
+
 from pydantic import BaseModel
 
 
+def user_cache_dir(name: str) -> str:
+    """Директория кэша name в кэше пользователя
+    (XDG_CACHE_HOME, по умолчанию ~/.cache)"""
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache'
+    )
+    return os.path.join(root, 'job_scheduler', name, '')
+
+
 class Data(BaseModel):
     """Класс, хранящий констатные значания.
     Среди них:
     data_dir - директория для хранения данных json-анализатора,
     logging_file - файл для хранения логов,
+    logging_level, logging_levels - уровень логирования и уровни
+    отдельных модулей (имя модуля -> уровень),
+    log_sample_rate, log_sample_burst - частота (сообщений в секунду)
+    и допустимая серия однотипных сообщений по элементам и аргументам,
     statuses_file - файл для хранения статусов задач,
+    status_flush_interval, status_batch_size, status_buffer_size -
+    период и размер пачки фоновой записи статусов, размер очереди записи,
+    journal_file - журнал состояний задач планировщика (строки
+    событие, uid и json через табуляцию),
+    http_connect_timeout, http_read_timeout - таймауты HTTP-запросов,
+    http_max_in_flight - число одновременных запросов пакетной загрузки,
+    http_cache_dir, http_cache_ttl, http_cache_max_bytes - директория
+    (по умолчанию в кэше пользователя, создается при первой записи),
+    время свежести (секунды) и размер кэша HTTP-ответов,
+    file_chunk_size - размер части при двоичном чтении файлов,
+    file_buffer_size - размер буфера потоковой записи файлов,
+    artifact_dir, artifact_memory_bytes, artifact_spill_bytes,
+    artifact_disk_bytes - директория выгрузки результатов задач,
+    предельный объем результатов в памяти, размер результата,
+    который сразу выгружается на диск, и предельный объем
+    выгруженных результатов,
+    memo_file, memo_max_entries, memo_ttl - журнал, число записей
+    и время жизни (секунды, None - без ограничения) кэша
+    результатов задач с memoize,
+    metrics_interval - период выгрузки метрик в файл (секунды),
+    profile_dir - директория отчетов профилирования задач,
+    retry_base_delay, retry_max_delay - начальная и наибольшая
+    задержка повтора задачи (секунды),
+    retry_budget_ratio, retry_budget_tokens - пополнение бюджета
+    повторов категории за задачу и наибольший запас бюджета,
+    stop_deadline - сколько остановка планировщика с drain ждет
+    выполняемые задачи до их отмены (секунды),
+    stop_grace - сколько остановка ждет завершения отмененных задач
+    (секунды),
+    queue_dir - директория общей очереди задач в файлах,
+    queue_lease_ttl - срок аренды задачи из общей очереди без
+    продления (секунды),
     cities - набор данных для анализатора.
     """
     data_dir: str = 'cities_data_dir/'
     logging_file: str = 'app-log.log'
+    logging_level: str = 'INFO'
+    logging_levels: dict[str, str] = {}
+    log_sample_rate: float = 10.0
+    log_sample_burst: int = 100
     status_file: str = 'STATUSES.txt'
+    status_flush_interval: float = 0.1
+    status_batch_size: int = 1000
+    status_buffer_size: int = 100000
+    journal_file: str = 'JOURNAL.log'
+    http_connect_timeout: float = 5.0
+    http_read_timeout: float = 30.0
+    http_max_in_flight: int = 8
+    http_cache_dir: str = user_cache_dir('http')
+    http_cache_ttl: float = 60.0
+    http_cache_max_bytes: int = 100 * 1024 * 1024
+    file_chunk_size: int = 1024 * 1024
+    file_buffer_size: int = 1024 * 1024
+    artifact_dir: str = 'artifacts/'
+    artifact_memory_bytes: int = 64 * 1024 * 1024
+    artifact_spill_bytes: int = 1024 * 1024
+    artifact_disk_bytes: int = 1024 * 1024 * 1024
+    memo_file: str = 'MEMO.log'
+    memo_max_entries: int = 100000
+    memo_ttl: Optional[float] = None
+    metrics_interval: float = 10.0
+    profile_dir: str = 'profiles/'
+    retry_base_delay: float = 0.1
+    retry_max_delay: float = 30.0
+    retry_budget_ratio: float = 0.2
+    retry_budget_tokens: float = 10.0
+    stop_deadline: float = 10.0
+    stop_grace: float = 1.0
+    queue_dir: str = 'shared_queue/'
+    queue_lease_ttl: float = 10.0
     cities: dict = {
         "MOSCOW":
         "https://code.s3.yandex.net/async-module/moscow-response.json",
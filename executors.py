@@ -0,0 +1,132 @@
+"""Исполнители целей задач: в потоке планировщика
+и в пуле процессов"""
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor as PoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from threading import Lock
+from typing import Any, Callable, Optional
+import inspect
+import logging
+import os
+import pickle
+
+logger = logging.getLogger(__name__)
+
+INLINE = 'inline'
+PROCESS = 'process'
+
+
+class Executor(ABC):
+    """Исполнитель целей задач"""
+    name = ''
+
+    @abstractmethod
+    def wrap(self, func: Callable) -> Callable:
+        """Метод возвращает функцию, вызывающую func
+        через исполнителя"""
+
+
+class InlineExecutor(Executor):
+    """Исполнитель, вызывающий цель прямо в потоке планировщика"""
+    name = INLINE
+
+    def wrap(self, func: Callable) -> Callable:
+        return func
+
+
+class PoolBasedExecutor(Executor):
+    """Исполнитель на основе пула из concurrent.futures.
+    Пул создается при первом обращении и живет,
+    пока не будет вызван shutdown"""
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers
+        self.__pool: Optional[PoolExecutor] = None
+        self.__lock = Lock()
+
+    @abstractmethod
+    def _create_pool(self) -> PoolExecutor:
+        """Создание пула"""
+
+    @property
+    def pool(self) -> PoolExecutor:
+        """Пул исполнителя"""
+        if self.__pool is None:
+            with self.__lock:
+                if self.__pool is None:
+                    self.__pool = self._create_pool()
+        return self.__pool
+
+    def call(self, func: Callable, *args: Any) -> Any:
+        """Метод вызывает func(*args) в пуле и ждет результат"""
+        return self.pool.submit(func, *args).result()
+
+    def wrap(self, func: Callable) -> Callable:
+        return partial(self.call, func)
+
+    def shutdown(self):
+        """Метод останавливает пул"""
+        with self.__lock:
+            if self.__pool is not None:
+                self.__pool.shutdown()
+                self.__pool = None
+
+
+class ProcessExecutor(PoolBasedExecutor):
+    """Исполнитель в пуле процессов для задач, нагружающих процессор.
+    Процессы пула запускаются сразу при создании пула (прогрев),
+    аргументы и результаты передаются через pickle.
+    Функции-генераторы не передаются между процессами
+    и выполняются в потоке планировщика"""
+    name = PROCESS
+
+    def _create_pool(self) -> PoolExecutor:
+        max_workers = self.max_workers or os.cpu_count() or 1
+        pool = ProcessPoolExecutor(max_workers=max_workers)
+        list(pool.map(_warm_up, range(max_workers)))
+        return pool
+
+    def call(self, func: Callable, *args: Any) -> Any:
+        """Цель или аргументы, которые нельзя передать в процесс,
+        дают статус ошибки, и задача завершается фейлом"""
+        future = self.pool.submit(func, *args)
+        try:
+            return future.result()
+        except Exception as error:
+            if _is_picklable((func, args)):
+                raise
+            logger.error('%s can not be passed to process: %r', func, error)
+            return (f'ERROR: {func} is not picklable: {error!r}', 1)
+
+    def wrap(self, func: Callable) -> Callable:
+        if inspect.isgeneratorfunction(func):
+            return func
+        return super().wrap(func)
+
+
+def _is_picklable(value: Any) -> bool:
+    """Можно ли передать значение в другой процесс"""
+    try:
+        pickle.dumps(value)
+    except Exception:
+        return False
+    return True
+
+
+def _warm_up(_num: int):
+    """Пустая задача для запуска процессов пула"""
+
+
+_executors: dict[str, Executor] = {
+    INLINE: InlineExecutor(),
+    PROCESS: ProcessExecutor(),
+}
+
+
+def get_executor(name: Optional[str]) -> Executor:
+    """Функция возвращает общий исполнитель по имени.
+    Без имени используется исполнитель в потоке планировщика"""
+    try:
+        return _executors[name or INLINE]
+    except KeyError as error:
+        raise ValueError(f'unknown executor {name}') from error
@@ -0,0 +1,225 @@
+"""Операции с файловой системой внутри процесса
+без запуска терминальных команд"""
+from collections import OrderedDict
+from typing import Callable, Iterable, Iterator, Optional, Union
+import mmap
+import os
+import shutil
+import sys
+
+from timeouts import current_deadline
+
+MAX_REPORTED_ERRORS = 10
+DEADLINE_CHECK_EVERY = 256
+
+_DIR_FLAGS = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0)
+_FILE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL
+_HAS_DIR_FD = {os.open, os.mkdir, os.unlink, os.rmdir} <= os.supports_dir_fd
+# rmtree принимает dir_fd с Python 3.11 и только в защищенной
+# от атак через символические ссылки реализации
+_RMTREE_DIR_FD = (
+    sys.version_info >= (3, 11) and shutil.rmtree.avoids_symlink_attacks
+)
+
+TEXT = 'text'
+BINARY = 'binary'
+MMAP = 'mmap'
+
+Chunk = Union[str, bytes, bytearray, memoryview]
+
+
+class DirFdCache:
+    """Кэш открытых дескрипторов директорий.
+    Операции над путями в одной директории выполняются
+    относительно ее дескриптора, и ядро не разбирает путь
+    заново для каждого файла. Хранится не более max_size
+    дескрипторов, давно не использованные закрываются"""
+    def __init__(self, max_size: int = 64):
+        self.max_size = max_size
+        self.__fds: OrderedDict[str, int] = OrderedDict()
+
+    def split(self, path: str) -> tuple[Optional[int], str]:
+        """Метод возвращает дескриптор директории пути
+        и имя внутри нее. Без поддержки dir_fd возвращает
+        None и исходный путь"""
+        dirname, name = os.path.split(os.path.normpath(path))
+        if not _HAS_DIR_FD or not name:
+            return None, path
+        dirname = dirname or '.'
+        fd = self.__fds.get(dirname)
+        if fd is None:
+            fd = os.open(dirname, _DIR_FLAGS)
+            self.__fds[dirname] = fd
+            if len(self.__fds) > self.max_size:
+                _, old_fd = self.__fds.popitem(last=False)
+                os.close(old_fd)
+        else:
+            self.__fds.move_to_end(dirname)
+        return fd, name
+
+    def forget(self, path: str):
+        """Метод закрывает дескрипторы удаляемой директории
+        и вложенных в нее директорий"""
+        path = os.path.normpath(path)
+        prefix = os.path.join(path, '')
+        for dirname in list(self.__fds):
+            if dirname == path or dirname.startswith(prefix):
+                os.close(self.__fds.pop(dirname))
+
+    def close(self):
+        """Метод закрывает все дескрипторы"""
+        fds, self.__fds = self.__fds, OrderedDict()
+        for fd in fds.values():
+            os.close(fd)
+
+    def __enter__(self) -> 'DirFdCache':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _create_file(dirs: DirFdCache, path: str):
+    """Создание пустого файла, существующий файл - ошибка"""
+    fd, name = dirs.split(path)
+    os.close(os.open(name, _FILE_FLAGS, 0o666, dir_fd=fd))
+
+
+def _create_dir(dirs: DirFdCache, path: str):
+    """Создание директории"""
+    fd, name = dirs.split(path)
+    os.mkdir(name, dir_fd=fd)
+
+
+def _delete(dirs: DirFdCache, path: str):
+    """Удаление файла или директории со всем содержимым"""
+    dirs.forget(path)
+    fd, name = dirs.split(path)
+    try:
+        os.unlink(name, dir_fd=fd)
+    except IsADirectoryError:
+        _rmtree(fd, name, path)
+    except PermissionError:
+        # unlink директории на части систем возвращает EPERM
+        if not os.path.isdir(path):
+            raise
+        _rmtree(fd, name, path)
+
+
+def _rmtree(fd: Optional[int], name: str, path: str):
+    """Удаление директории со всем содержимым относительно
+    дескриптора родителя, если rmtree это поддерживает,
+    иначе - по полному пути"""
+    if fd is not None and _RMTREE_DIR_FD:
+        shutil.rmtree(name, dir_fd=fd)
+    else:
+        shutil.rmtree(path)
+
+
+def _describe(label: str, path: str, error: OSError) -> str:
+    """Текст ошибки в стиле задач ФС"""
+    if isinstance(error, FileExistsError):
+        return f'{label}: {path} is already exist'
+    if isinstance(error, FileNotFoundError):
+        return f'{label}: {path} is not exist'
+    return f'{label}: {path} {error.strerror or error}'
+
+
+def _apply(
+        label: str, operation: Callable[[DirFdCache, str], None],
+        paths: Iterable[str]) -> tuple[str, int]:
+    """Выполнение операции над всеми путями с общим кэшем
+    дескрипторов. Ошибки по отдельным путям не прерывают
+    обработку остальных, по истечении срока задачи
+    или ее отмене обработка прекращается. Возвращает статус и код"""
+    deadline = current_deadline()
+    errors = []
+    with DirFdCache() as dirs:
+        for count, path in enumerate(paths):
+            if deadline is not None and count % DEADLINE_CHECK_EVERY == 0 \
+                    and deadline.is_expired:
+                return (
+                    f'{deadline.reason}: {label} stopped after {count} paths',
+                    1,
+                )
+            try:
+                operation(dirs, path)
+            except OSError as error:
+                errors.append(_describe(label, path, error))
+    if not errors:
+        return 'success', 0
+    output = '\n'.join(errors[:MAX_REPORTED_ERRORS])
+    if len(errors) > MAX_REPORTED_ERRORS:
+        output += f'\n{label}: and {len(errors) - MAX_REPORTED_ERRORS} more'
+    return output, 1
+
+
+def create_files(paths: Iterable[str]) -> tuple[str, int]:
+    """Функция создает пустые файлы по списку путей"""
+    return _apply('CREATE FILE', _create_file, paths)
+
+
+def create_dirs(paths: Iterable[str]) -> tuple[str, int]:
+    """Функция создает директории по списку путей"""
+    return _apply('CREATE DIR', _create_dir, paths)
+
+
+def delete_paths(paths: Iterable[str]) -> tuple[str, int]:
+    """Функция удаляет файлы и директории по списку путей"""
+    return _apply('DELETE', _delete, paths)
+
+
+def iter_lines(filename: str, chunk_size: int) -> Iterator[str]:
+    """Чтение текстового файла по строкам"""
+    with open(filename) as file:
+        yield from file
+
+
+def iter_chunks(filename: str, chunk_size: int) -> Iterator[bytes]:
+    """Чтение файла частями bytes по chunk_size без
+    промежуточного буфера: каждая часть - один системный вызов"""
+    with open(filename, 'rb', buffering=0) as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def iter_mapped(filename: str, chunk_size: int) -> Iterator[memoryview]:
+    """Чтение файла, отображенного в память, срезами memoryview
+    без копирования. Срез действителен до получения следующего
+    и не должен сохраняться потребителем"""
+    with open(filename, 'rb') as file:
+        if not os.fstat(file.fileno()).st_size:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapped) as view:
+                for start in range(0, len(view), chunk_size):
+                    with view[start:start + chunk_size] as chunk:
+                        yield chunk
+
+
+READERS: dict[str, Callable[[str, int], Iterator[Chunk]]] = {
+    TEXT: iter_lines,
+    BINARY: iter_chunks,
+    MMAP: iter_mapped,
+}
+
+
+def write_chunks(
+        filename: str, data: Union[Chunk, Iterable[Chunk]], mode: str,
+        buffer_size: int) -> int:
+    """Запись в файл строки, байтов или итерируемого набора частей
+    через буфер размера buffer_size. Части не собираются в памяти,
+    части больше буфера пишутся напрямую. Возвращает число
+    записанных символов или байтов"""
+    if isinstance(data, (str, bytes, bytearray, memoryview)):
+        data = (data,)
+    written = 0
+    with open(filename, mode, buffering=buffer_size) as file:
+        for chunk in data:
+            written += file.write(chunk)
+    return written
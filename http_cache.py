@@ -0,0 +1,267 @@
+"""Дисковый кэш HTTP-ответов с условной перепроверкой"""
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from hashlib import sha256
+from threading import Lock
+from time import time
+from typing import IO, Any, Callable, ContextManager, Iterator, Optional
+import json
+import os
+import tempfile
+
+from http_pool import StreamResult
+
+NOT_MODIFIED = 304
+
+
+class _TeeStream:
+    """Тело ответа из сети, которое по мере чтения
+    копируется во временный файл записи кэша"""
+    def __init__(self, stream: Any, file: IO):
+        self.__stream = stream
+        self.__file = file
+        self.size = 0
+        self.is_complete = False
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        """Чтение из сети с копированием в файл.
+        Тело прочитано до конца, когда поток исчерпан"""
+        if size is None or size < 0:
+            chunk = self.__stream.read()
+            self.is_complete = True
+        else:
+            chunk = self.__stream.read(size)
+            is_closed = getattr(self.__stream, 'isclosed', None)
+            self.is_complete = (
+                not chunk or is_closed is not None and is_closed()
+            )
+        self.__file.write(chunk)
+        self.size += len(chunk)
+        return chunk
+
+    def close(self):
+        """Закрытие файла копии"""
+        self.__file.close()
+
+
+class ResponseCache:
+    """Кэш тел ответов по URL вместе с ETag и Last-Modified.
+    Пока запись свежее ttl секунд, она отдается без сети,
+    иначе отправляется условный GET и ответ 304 продлевает запись.
+    Когда общий размер тел превышает max_bytes, удаляются
+    давно не использованные записи. Порядок использования
+    сохраняется во времени изменения файлов тел"""
+    def __init__(
+            self, cache_dir: str, ttl: float = 60.0,
+            max_bytes: int = 100 * 1024 * 1024):
+
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.__entries: Optional[OrderedDict[str, dict]] = None
+        self.__size = 0
+        self.__lock = Lock()
+
+    def __path(self, key: str, suffix: str) -> str:
+        """Путь к файлу записи"""
+        return os.path.join(self.cache_dir, f'{key}.{suffix}')
+
+    def __load(self) -> OrderedDict[str, dict]:
+        """Метод при первом обращении читает записи с диска
+        в порядке использования. Вызывается под блокировкой"""
+        if self.__entries is not None:
+            return self.__entries
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.json'):
+                    continue
+                key = name[:-len('.json')]
+                try:
+                    with open(self.__path(key, 'json')) as file:
+                        meta = json.load(file)
+                    used_at = os.path.getmtime(self.__path(key, 'body'))
+                except (OSError, ValueError):
+                    continue
+                entries.append((used_at, key, meta))
+        entries.sort(key=lambda entry: entry[0])
+        self.__entries = OrderedDict(
+            (key, meta) for _, key, meta in entries
+        )
+        self.__size = sum(meta['size'] for meta in self.__entries.values())
+        return self.__entries
+
+    def __lookup(self, key: str) -> Optional[dict]:
+        """Поиск записи с отметкой об использовании"""
+        with self.__lock:
+            entries = self.__load()
+            meta = entries.get(key)
+            if meta is not None:
+                entries.move_to_end(key)
+        if meta is not None:
+            try:
+                os.utime(self.__path(key, 'body'))
+            except OSError:
+                return None
+        return meta
+
+    def __open(
+            self, key: str, meta: dict, state: str,
+            stack: ExitStack) -> Optional[StreamResult]:
+        """Ответ из кэша, тело отдается открытым файлом"""
+        try:
+            file = stack.enter_context(open(self.__path(key, 'body'), 'rb'))
+        except OSError:
+            return None
+        headers = {'X-Cache': state}
+        for name in ('ETag', 'Last-Modified'):
+            if meta.get(name):
+                headers[name] = meta[name]
+        return StreamResult(200, headers, file)
+
+    def __temp_file(self, key: str, mode: str) -> tuple[str, IO]:
+        """Временный файл записи с уникальным именем:
+        одновременные промахи по одному URL пишут каждый свой файл,
+        а на место записи встает тот, что переименован последним"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=f'{key}.', suffix='.tmp', dir=self.cache_dir
+        )
+        return tmp_path, os.fdopen(fd, mode)
+
+    def __write_meta(self, key: str, meta: dict):
+        """Атомарная запись метаданных"""
+        tmp_path, file = self.__temp_file(key, 'w')
+        with file:
+            json.dump(meta, file)
+        os.replace(tmp_path, self.__path(key, 'json'))
+
+    def __store(
+            self, key: str, url: str, headers: dict,
+            tmp_path: str, size: int):
+        """Сохранение прочитанного тела ответа из временного файла
+        и вытеснение давно не использованных записей"""
+        os.replace(tmp_path, self.__path(key, 'body'))
+        meta = {
+            'url': url,
+            'ETag': headers.get('ETag'),
+            'Last-Modified': headers.get('Last-Modified'),
+            'stored_at': time(),
+            'size': size,
+        }
+        self.__write_meta(key, meta)
+        with self.__lock:
+            entries = self.__load()
+            previous = entries.pop(key, None)
+            if previous is not None:
+                self.__size -= previous['size']
+            entries[key] = meta
+            self.__size += meta['size']
+            evicted = []
+            while self.__size > self.max_bytes and len(entries) > 1:
+                old_key, old_meta = entries.popitem(last=False)
+                self.__size -= old_meta['size']
+                evicted.append(old_key)
+        for old_key in evicted:
+            for suffix in ('json', 'body'):
+                try:
+                    os.remove(self.__path(old_key, suffix))
+                except OSError:
+                    pass
+
+    def __refresh(self, key: str, meta: dict, result: StreamResult):
+        """Продление записи после ответа 304"""
+        meta = dict(meta, stored_at=time())
+        for name in ('ETag', 'Last-Modified'):
+            if result.headers.get(name):
+                meta[name] = result.headers[name]
+        with self.__lock:
+            self.__load()[key] = meta
+        self.__write_meta(key, meta)
+
+    @staticmethod
+    def __conditional_headers(meta: Optional[dict]) -> dict:
+        """Заголовки условного GET по сохраненным валидаторам"""
+        headers = {}
+        if meta is not None:
+            if meta.get('ETag'):
+                headers['If-None-Match'] = meta['ETag']
+            if meta.get('Last-Modified'):
+                headers['If-Modified-Since'] = meta['Last-Modified']
+        return headers
+
+    @contextmanager
+    def open(
+            self, url: str,
+            open_response: Callable[[dict], ContextManager[StreamResult]]
+    ) -> Iterator[StreamResult]:
+        """Контекст GET-запроса через кэш. open_response открывает
+        запрос с дополнительными заголовками. Тело нового ответа 200
+        читается из сети и по мере чтения копируется в кэш; запись
+        сохраняется, только если тело прочитано до конца"""
+        key = sha256(url.encode()).hexdigest()
+        meta = self.__lookup(key)
+        with ExitStack() as stack:
+            cached = None
+            if meta is not None and time() - meta['stored_at'] < self.ttl:
+                cached = self.__open(key, meta, 'HIT', stack)
+            if cached is None:
+                cached = self.__from_network(
+                    key, url, meta, open_response, stack
+                )
+            yield cached
+
+    def __from_network(
+            self, key: str, url: str, meta: Optional[dict],
+            open_response: Callable[[dict], ContextManager[StreamResult]],
+            stack: ExitStack) -> StreamResult:
+        """Условный запрос: ответ 304 продлевает запись,
+        ответ 200 копируется в кэш при чтении,
+        остальные отдаются как есть"""
+        result = stack.enter_context(
+            open_response(self.__conditional_headers(meta))
+        )
+        if result.status == NOT_MODIFIED and meta is not None:
+            result.stream.read()
+            cached = self.__open(key, meta, 'REVALIDATED', stack)
+            if cached is not None:
+                self.__refresh(key, meta, result)
+                return cached
+            result = stack.enter_context(open_response({}))
+        if result.status != 200:
+            return result
+        tmp_path, file = self.__temp_file(key, 'wb')
+        tee = _TeeStream(result.stream, file)
+        stack.push(partial(
+            self.__finish_miss, key, url, result.headers, tmp_path, tee
+        ))
+        headers = dict(result.headers, **{'X-Cache': 'MISS'})
+        return StreamResult(200, headers, tee)
+
+    def __finish_miss(
+            self, key: str, url: str, headers: dict, tmp_path: str,
+            tee: _TeeStream, exc_type: Any, *_exc_info: Any):
+        """Выход из контекста промаха: тело, прочитанное до конца
+        без ошибок, сохраняется, недочитанная копия удаляется"""
+        tee.close()
+        if exc_type is None and tee.is_complete:
+            self.__store(key, url, headers, tmp_path, tee.size)
+            return
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+    def invalidate(self, url: str):
+        """Удаление записи из кэша"""
+        key = sha256(url.encode()).hexdigest()
+        with self.__lock:
+            meta = self.__load().pop(key, None)
+            if meta is not None:
+                self.__size -= meta['size']
+        for suffix in ('json', 'body'):
+            try:
+                os.remove(self.__path(key, suffix))
+            except OSError:
+                pass
@@ -0,0 +1,305 @@
+"""Пул keep-alive HTTP-соединений на основе http.client"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from http.client import (
+    HTTPConnection,
+    HTTPException,
+    HTTPResponse,
+    HTTPSConnection,
+)
+from threading import Lock
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional
+from urllib.parse import urljoin, urlsplit
+import logging
+import socket
+
+from settings_store import LogSampler
+from timeouts import Deadline, current_deadline
+
+logger = logging.getLogger(__name__)
+# ошибки отдельных URL пакетной загрузки
+_fetch_sampler = LogSampler()
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+HostKey = tuple[str, str, Optional[int]]
+
+
+class HTTPResult(NamedTuple):
+    """Результат запроса: код ответа, заголовки и тело"""
+    status: int
+    headers: dict
+    body: bytes
+
+
+class StreamResult(NamedTuple):
+    """Ответ, тело которого читается по частям методом stream.read"""
+    status: int
+    headers: dict
+    stream: Any
+
+
+class TooManyRedirects(OSError):
+    """Превышено число перенаправлений"""
+
+
+def read_result(result: StreamResult) -> HTTPResult:
+    """Чтение всего тела ответа"""
+    return HTTPResult(result.status, result.headers, result.stream.read())
+
+
+def _abort(sockets: list[socket.socket]):
+    """Прерывание запроса: закрытие сокета на уровне ОС
+    будит поток, заблокированный на чтении.
+    Сокеты запоминаются при отправке запроса: после ответа
+    без keep-alive http.client убирает сокет из соединения,
+    а тело ответа все еще читается из него"""
+    for sock in sockets:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class ConnectionPool:
+    """Пул соединений: для каждого хоста хранится до max_per_host
+    свободных соединений, которые переиспользуются между запросами
+    без повторного TCP- и TLS-рукопожатия.
+    connect_timeout ограничивает установку соединения,
+    read_timeout - ожидание каждого чтения из сокета.
+    Если у текущей задачи есть срок, таймауты не превышают
+    оставшегося времени, а по истечении срока или отмене задачи
+    сокет закрывается.
+    Если задан cache (ResponseCache), запросы request и fetch_many
+    идут через него.
+    Недочитанный остаток тела ответа до max_drain байт
+    дочитывается, чтобы вернуть соединение в пул"""
+    def __init__(
+            self, connect_timeout: float = 5.0, read_timeout: float = 30.0,
+            max_per_host: int = 10, max_redirects: int = 5,
+            cache: Optional[Any] = None, max_drain: int = 64 * 1024):
+
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_per_host = max_per_host
+        self.max_redirects = max_redirects
+        self.cache = cache
+        self.max_drain = max_drain
+        self.__idle: dict[HostKey, list[HTTPConnection]] = {}
+        self.__lock = Lock()
+
+    @staticmethod
+    def __key(url: str) -> HostKey:
+        """Ключ хоста: схема, хост и порт"""
+        parts = urlsplit(url)
+        return parts.scheme, parts.hostname or '', parts.port
+
+    def __acquire(self, key: HostKey) -> tuple[HTTPConnection, bool]:
+        """Метод выдает свободное соединение или создает новое.
+        Возвращает соединение и признак переиспользования"""
+        with self.__lock:
+            idle = self.__idle.get(key)
+            if idle:
+                return idle.pop(), True
+        scheme, host, port = key
+        connection_class: type[HTTPConnection] = (
+            HTTPSConnection if scheme == 'https' else HTTPConnection
+        )
+        connection = connection_class(
+            host, port, timeout=self.connect_timeout
+        )
+        return connection, False
+
+    def __release(self, key: HostKey, connection: HTTPConnection):
+        """Метод возвращает соединение в пул или закрывает его"""
+        with self.__lock:
+            idle = self.__idle.setdefault(key, [])
+            if len(idle) < self.max_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """Метод закрывает все свободные соединения"""
+        with self.__lock:
+            idle, self.__idle = self.__idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def __timeout(self, timeout: float, deadline: Optional[Deadline]) -> float:
+        """Таймаут с учетом срока задачи"""
+        if deadline is None:
+            return timeout
+        return min(timeout, deadline.time_left())
+
+    def __send(
+            self, connection: HTTPConnection, url: str, headers: dict,
+            deadline: Optional[Deadline],
+            sockets: list[socket.socket]) -> HTTPResponse:
+        """Отправка запроса и чтение заголовков ответа.
+        Сокет соединения добавляется в sockets"""
+        if connection.sock is None:
+            connection.timeout = self.__timeout(
+                self.connect_timeout, deadline
+            )
+            connection.connect()
+        sockets.append(connection.sock)
+        connection.sock.settimeout(self.__timeout(self.read_timeout, deadline))
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path = f'{path}?{parts.query}'
+        connection.request('GET', path, headers=headers)
+        return connection.getresponse()
+
+    def __get(
+            self, connection: HTTPConnection, is_reused: bool, url: str,
+            headers: dict, deadline: Optional[Deadline],
+            sockets: list[socket.socket]) -> HTTPResponse:
+        """Запрос с одной повторной попыткой, если переиспользованное
+        соединение уже закрыто сервером"""
+        try:
+            return self.__send(connection, url, headers, deadline, sockets)
+        except ConnectionError:
+            if not is_reused:
+                raise
+            logger.debug('stale connection for %s, reconnect', url)
+            connection.close()
+            return self.__send(connection, url, headers, deadline, sockets)
+
+    @contextmanager
+    def open(
+            self, url: str, headers: Optional[dict] = None,
+            deadline: Optional[Deadline] = None) -> Iterator[HTTPResponse]:
+        """Контекст GET-запроса с переходом по перенаправлениям.
+        Отдает ответ, тело которого можно читать по частям.
+        Если тело прочитано полностью или его остаток небольшой,
+        соединение возвращается в пул, иначе закрывается"""
+        deadline = deadline or current_deadline()
+        headers = dict(headers or {})
+        for _ in range(self.max_redirects + 1):
+            if deadline is not None and deadline.is_expired:
+                raise TimeoutError(f'{deadline.reason}: {url}')
+            key = self.__key(url)
+            connection, is_reused = self.__acquire(key)
+            sockets: list[socket.socket] = []
+            abort = partial(_abort, sockets)
+            if deadline is not None:
+                deadline.register(abort)
+            try:
+                response = self.__get(
+                    connection, is_reused, url, headers, deadline, sockets
+                )
+            except BaseException:
+                connection.close()
+                if deadline is not None:
+                    deadline.unregister(abort)
+                raise
+
+            location = response.getheader('Location')
+            is_done = False
+            try:
+                if response.status in REDIRECT_STATUSES and location:
+                    response.read()
+                    url = urljoin(url, location)
+                    is_done = True
+                    continue
+                yield response
+                is_done = True
+                return
+            finally:
+                self.__finish(key, connection, response, is_done)
+                if deadline is not None:
+                    deadline.unregister(abort)
+        raise TooManyRedirects(f'too many redirects for {url}')
+
+    def __finish(
+            self, key: HostKey, connection: HTTPConnection,
+            response: HTTPResponse, is_done: bool):
+        """Возврат соединения в пул после ответа.
+        Если работа с ответом закончилась без ошибки,
+        небольшой недочитанный остаток тела дочитывается"""
+        if is_done and not response.will_close:
+            self.__drain(response)
+        if response.isclosed() and not response.will_close:
+            self.__release(key, connection)
+        else:
+            connection.close()
+
+    def __drain(self, response: HTTPResponse):
+        """Дочитывание остатка тела ответа не больше max_drain байт"""
+        if response.length is not None and response.length > self.max_drain:
+            return
+        drained = 0
+        try:
+            while not response.isclosed() and drained <= self.max_drain:
+                drained += len(response.read(self.max_drain + 1 - drained))
+        except (OSError, HTTPException):
+            pass
+
+    @contextmanager
+    def stream(
+            self, url: str, headers: Optional[dict] = None,
+            deadline: Optional[Deadline] = None) -> Iterator[StreamResult]:
+        """Контекст GET-запроса через кэш, если он задан.
+        Тело ответа не читается целиком: его можно разбирать
+        по частям и бросить, не дочитав"""
+        if self.cache is None:
+            with self.__open_result(url, headers, deadline) as result:
+                yield result
+            return
+        with self.cache.open(
+            url,
+            lambda extra: self.__open_result(
+                url, dict(headers or {}, **extra), deadline
+            ),
+        ) as result:
+            yield result
+
+    @contextmanager
+    def __open_result(
+            self, url: str, headers: Optional[dict],
+            deadline: Optional[Deadline]) -> Iterator[StreamResult]:
+        """Контекст GET-запроса без кэша"""
+        with self.open(url, headers, deadline) as response:
+            yield StreamResult(
+                response.status, dict(response.getheaders()), response
+            )
+
+    def request(
+            self, url: str, headers: Optional[dict] = None,
+            deadline: Optional[Deadline] = None) -> HTTPResult:
+        """GET-запрос с чтением всего тела ответа"""
+        with self.stream(url, headers, deadline) as result:
+            return read_result(result)
+
+    def fetch_many(
+            self, urls: Iterable[str], max_in_flight: int = 8,
+            headers: Optional[dict] = None,
+            handle: Optional[Callable[[StreamResult], Any]] = None
+    ) -> list[Any]:
+        """Параллельные GET-запросы, одновременно выполняется
+        не более max_in_flight запросов. Срок текущей задачи
+        распространяется на все запросы. handle обрабатывает
+        поток ответа, по умолчанию тело читается целиком.
+        Для каждого URL возвращается результат или исключение,
+        порядок совпадает с urls"""
+        deadline = current_deadline()
+        handle = handle or read_result
+
+        def fetch(url: str) -> Any:
+            try:
+                with self.stream(url, headers, deadline) as result:
+                    return handle(result)
+            except (OSError, HTTPException, ValueError) as error:
+                _fetch_sampler.log(
+                    logger, logging.ERROR, 'fetch %s failed: %r', url, error
+                )
+                return error
+
+        with ThreadPoolExecutor(
+                max_workers=max_in_flight,
+                thread_name_prefix='http-fetch') as pool:
+            return list(pool.map(fetch, urls))
@@ -1,21 +1,175 @@
 """Описание класса Job и вспомогательные функции"""
-from typing import Callable, Any
-from time import sleep, monotonic
+from typing import Callable, Any, Union, Optional
+from time import sleep, monotonic, time
 from datetime import datetime
+from functools import partial
+import inspect
 import types
-from threading import current_thread
+from threading import Condition, current_thread, Event, Lock, local
+from uuid import uuid4
 import logging
 
-from settings_store import save_status
+from artifacts import ArtifactStore, default_store
+from data import Data
+from executors import INLINE, PROCESS, get_executor
+from job_future import JobFuture
+from memo_cache import (
+    MemoCache,
+    MemoEntry,
+    default_memo_cache,
+    fingerprint,
+    value_hash,
+)
+import metrics
+import profiling
+from retries import backoff_delay
+from settings_store import LogSampler, save_status
+from timeouts import (
+    CancelToken,
+    Deadline,
+    current_deadline,
+    job_deadline,
+    run_killable,
+    shared_deadline,
+)
 
+logger = logging.getLogger(__name__)
+# сообщения по элементам генераторов и аргументам map-задач
+_item_sampler = LogSampler()
+_arg_sampler = LogSampler()
+# отметка потоков планировщика
+_worker = local()
 
-def catch_arg(func: Callable):
+DEFAULT_CATEGORY = 'default'
+
+
+def mark_scheduler_worker():
+    """Функция отмечает текущий поток как поток планировщика:
+    в нем повторы задач и ожидание перезапущенных зависимостей
+    передаются планировщику, а поток не ждет их сам"""
+    _worker.is_scheduler = True
+
+
+def in_scheduler_worker() -> bool:
+    """Выполняется ли текущий поток планировщиком"""
+    return getattr(_worker, 'is_scheduler', False)
+
+
+def _describe_item(item: Any) -> Any:
+    """Описание элемента генератора для лога:
+    двоичные части описываются только размером"""
+    if isinstance(item, (bytes, bytearray, memoryview)):
+        return f'<{len(item)} bytes>'
+    return item
+
+
+def _drain(output: types.GeneratorType, arg: Any) -> bool:
+    """Функция дочитывает генератор задачи. Элементы пишутся
+    в лог на уровне DEBUG с ограничением частоты,
+    итог - одной строкой на уровне INFO.
+    Генератор выполняется в потоке задачи, и сторожевой поток
+    не может его прервать: срок попытки, который истекает и при
+    отмене задачи, проверяется между элементами, по его истечении
+    генератор закрывается.
+    Возвращает False для пустого или прерванного генератора"""
+    deadline = current_deadline()
+    count = 0
+    for item in output:
+        if deadline is not None and deadline.is_expired:
+            output.close()
+            save_status('read %s', deadline.reason)
+            logger.error('%s: read of %s is stopped', deadline.reason, arg)
+            return False
+        count += 1
+        if logger.isEnabledFor(logging.DEBUG):
+            _item_sampler.log(
+                logger, logging.DEBUG, 'READ RESULT: %s',
+                _describe_item(item),
+            )
+    if not count:
+        save_status('read fail')
+        logger.error('READ FAIL %s', arg)
+        return False
+    logger.info('READ SUCCESS %s: %s items', arg, count)
+    save_status('read success')
+    return True
+
+
+def _call_arg(func: Callable, arg: Any) -> tuple[str, int]:
+    """Вызов функции с одним аргументом map-задачи.
+    Исключение и пустой генератор считаются фейлом аргумента,
+    исключения пишутся в лог с ограничением частоты.
+    Возвращает статус и код завершения"""
+    try:
+        output = func(*arg) if isinstance(arg, tuple) else func(arg)
+        if isinstance(output, types.GeneratorType):
+            return ('success', 0) if _drain(output, arg) else ('fail', 1)
+    except Exception as error:
+        _arg_sampler.log(
+            logger, logging.ERROR, 'FAIL: %s with %s', func, arg,
+            exc_info=True,
+        )
+        return (f'ERROR: {error!r}', 1)
+    return output
+
+
+class _ChunkFeed:
+    """Общий источник частей аргументов map-задачи.
+    Части разбирают задача и ее помощники в других потоках,
+    задача ждет, пока не закончатся взятые помощниками части"""
+    def __init__(self, args: list, chunk_size: int):
+        self.chunks = [
+            (start, args[start:start + chunk_size])
+            for start in range(0, len(args), chunk_size)
+        ]
+        self.__next = 0
+        self.__in_flight = 0
+        self.__condition = Condition()
+
+    def take(self) -> Optional[tuple[int, list]]:
+        """Метод выдает следующую часть или None"""
+        with self.__condition:
+            if self.__next >= len(self.chunks):
+                return None
+            chunk = self.chunks[self.__next]
+            self.__next += 1
+            self.__in_flight += 1
+            return chunk
+
+    def done(self):
+        """Метод отмечает обработку взятой части"""
+        with self.__condition:
+            self.__in_flight -= 1
+            if not self.__in_flight:
+                self.__condition.notify_all()
+
+    def close(self):
+        """Метод запрещает выдачу оставшихся частей"""
+        with self.__condition:
+            self.__next = len(self.chunks)
+
+    def wait_idle(self):
+        """Метод ждет окончания обработки всех взятых частей"""
+        with self.__condition:
+            self.__condition.wait_for(lambda: not self.__in_flight)
+
+
+def _value_of(output: Any) -> Any:
+    """Результат вызова цели: третий элемент кортежа
+    (статус, код завершения, результат) или None"""
+    if isinstance(output, tuple) and len(output) > 2:
+        return output[2]
+    return None
+
+
+def catch_arg(func: Callable, values: Optional[list] = None):
     """Функция-корутина, принимает функцию, которая будет вызвана.
     Оператор yield отлавливает аргументы функции в виде значения
     либо кортежа в зависимости от количества параметров func.
-    output является либо кортежем из статуса и кода завершения,
+    output является либо кортежем из статуса и кода завершения
+    (и, возможно, результата, который добавляется в values),
     либо генератором.
-    В случае генератора проверяем его на непустоту попыткой next.
+    Генератор дочитывается функцией _drain, пустой генератор - фейл.
     В случае с кортежем проверяем код завершения"""
     while True:
         arg = yield
@@ -25,23 +179,15 @@ def catch_arg(func: Callable):
             output = func(arg)
 
         if isinstance(output, types.GeneratorType):
-            try:
-                check_is_empty = next(output)
-                logging.info(f'READ RESULT: {check_is_empty}')
-            except StopIteration:
-                save_status('read fail')
-                logging.error(f'READ FAIL {arg}')
+            if not _drain(output, arg):
                 break
-            logging.info(f'READ SUCCESS {arg}')
-            save_status('read success')
-
-            for line in output:
-                logging.info(f'READ RESULT: {line}')
         else:
             save_status(output[0])
+        if values is not None:
+            values.append(_value_of(output))
 
         if not isinstance(output, types.GeneratorType) and output[1] != 0:
-            logging.error(f'FAIL: {func}')
+            logger.error('FAIL: %s', func)
             save_status('fail')
             break
 
@@ -52,45 +198,252 @@ class Job:
     аргументы функции (можно задать пул аргументов
     для последовательного выполнения target с каждым аргументом),
     время запуска, таймаут работы, количество попыток запуска,
-    зависимости от других задач.
+    зависимости от других задач, исполнитель цели
+    (inline, process; по умолчанию - исполнитель планировщика,
+    вне планировщика - inline), приоритет (меньшее значение -
+    более высокий приоритет) и категория для квот планировщика
+    (по умолчанию - категория класса цели: fs, files, net, иначе default).
+    Таймаут проверяется между аргументами; цели fs, files и net
+    сами прерываются по сроку. Остальные цели прерываются по сроку
+    только с исполнителем process: каждый вызов идет в отдельном
+    процессе, который убивается по сроку, поэтому, как и в пуле
+    процессов, изменения, сделанные целью в памяти процесса,
+    в задачу не возвращаются. С исполнителем inline цель
+    выполняется в потоке планировщика и не прерывается.
+    Map-режим включается chunk_size > 0 или batched: аргументы делятся
+    на части по chunk_size, и в планировщике части параллельно
+    обрабатывают помощники задачи на свободных потоках.
+    batched - цель получает часть целиком списком аргументов и
+    возвращает общий статус или список статусов по аргументам.
+    Цель может вернуть кортеж (статус, код, результат): результат
+    успешной задачи публикуется в хранилище store (по умолчанию
+    общее хранилище artifacts) и доступен как job.result.
+    receive_results - цель получает результаты зависимостей
+    дополнительными позиционными аргументами после своих.
+    memoize - успешный результат запоминается в memo_cache
+    (по умолчанию общий кэш) по отпечатку цели, аргументов
+    и результатов зависимостей; при совпадении отпечатка задача
+    не выполняется, а результат берется из кэша.
+    profile - профилировать попытки задачи (True - всегда,
+    False - никогда, None - по настройкам включенного профилировщика:
+    категории и доле выборки), см. модуль profiling.
     Дополнительные поля, описывающие состояние задачи:
     is_pause - на паузе,
-    is_stop - принудительная остановка,
+    cancel_token - токен отмены: stop и остановка планировщика
+    отменяют его, и выполняемая работа прерывается
+    (процесс убивается, сокет закрывается, пакет путей
+    обрабатывается не до конца),
     is_end - задача завершена,
-    is_successful - задача завершилась успешно."""
+    is_successful - задача завершилась успешно,
+    arg_results - статусы и коды по аргументам map-задачи,
+    future - описатель текущего или последнего выполнения задачи,
+    spawn - функция планировщика для запуска помощников,
+    retry - функция планировщика для отложенного повтора,
+    defer - функция планировщика, откладывающая задачу
+    до завершения перезапущенных зависимостей,
+    on_end - функция, вызываемая с задачей по завершении
+    (так общая очередь в файлах отмечает выполнение),
+    ready_at - когда планировщик поставил задачу с выполненными
+    зависимостями в очередь (время time()), от него и от start_at
+    считается опоздание запуска,
+    metrics - набор метрик времени задачи (по умолчанию общий,
+    в планировщике - набор планировщика),
+    uid - уникальный идентификатор задачи."""
     def __init__(
             self,
             target: Callable, args: Any = None,
-            start_at="", max_working_time: int = -1,
-            tries: int = 1, dependencies=()):
+            start_at: Union[str, datetime] = "",
+            max_working_time: int = -1,
+            tries: int = 1, dependencies=(),
+            uid: Optional[str] = None, executor: Optional[str] = None,
+            priority: int = 0, category: Optional[str] = None,
+            chunk_size: int = 0, batched: bool = False,
+            receive_results: bool = False,
+            store: Optional[ArtifactStore] = None,
+            memoize: bool = False, memo_cache: Optional[MemoCache] = None,
+            profile: Optional[bool] = None):
 
+        self.uid = uid or uuid4().hex
         self.__args = args or ()
         self.__func = target
         self.__is_pause = False
-        self.__is_stop = False
-        try:
-            self.__start_at = datetime.strptime(
-                start_at,
-                "%Y-%m-%d %H:%M:%S"
-            )
-        except (ValueError, TypeError):
-            self.__start_at = datetime.now()
+        self.cancel_token = CancelToken()
+        if isinstance(start_at, datetime):
+            self.__start_at = start_at
+        else:
+            try:
+                self.__start_at = datetime.strptime(
+                    start_at,
+                    "%Y-%m-%d %H:%M:%S"
+                )
+            except (ValueError, TypeError):
+                self.__start_at = datetime.now()
         self.__max_working_time = max_working_time
         self.__tries = tries
+        self.executor = executor and get_executor(executor).name
+        self.priority = priority
+        self.category = category or getattr(
+            getattr(target, '__self__', None), 'category', DEFAULT_CATEGORY
+        )
 
         self.__dependencies: tuple[Job] = dependencies
+        self.chunk_size = chunk_size
+        self.batched = batched
+        self.receive_results = receive_results
+        self.store = store
+        self.memoize = memoize
+        self.memo_cache = memo_cache
+        self.profile = profile
+        self.__result_hash: Optional[str] = None
+        self.arg_results: list[Optional[tuple[str, int]]] = []
+        self.spawn: Optional[Callable[[Callable[[], Job], int], None]] = None
+        self.retry: Optional[Callable[[Job, int], bool]] = None
+        self.defer: Optional[Callable[[Job, list[JobFuture]], None]] = None
+        self.on_end: Optional[Callable[[Job], None]] = None
+        self.ready_at: Optional[float] = None
+        self.__attempts = 0
+        self.metrics = metrics.registry
 
         self.is_successful = False
         self.is_end = False
+        self.__end_event = Event()
+        self.__future: Optional[JobFuture] = None
+        self.__is_running = False
+        self.__is_deps_rerun = False
+        self.__run_lock = Lock()
         save_status(
-            f'\n[NEW JOB: {self}]\n'
-            f'agrs = {self.__args}\n'
-            f'start at {self.__start_at}\n'
-            f'max working time = {self.__max_working_time}\n'
-            f'tries = {self.__tries}\n'
-            f'dependencies: {self.__dependencies}'
+            '\n[NEW JOB: %s]\n'
+            'agrs = %s\n'
+            'start at %s\n'
+            'max working time = %s\n'
+            'tries = %s\n'
+            'dependencies: %s',
+            self, self.__args, self.__start_at,
+            self.__max_working_time, self.__tries, self.__dependencies,
+        )
+
+    @property
+    def target(self) -> Callable:
+        """Функция для выполнения"""
+        return self.__func
+
+    @property
+    def args(self) -> Any:
+        """Аргументы функции"""
+        return self.__args
+
+    @property
+    def max_working_time(self) -> float:
+        """Таймаут работы"""
+        return self.__max_working_time
+
+    @property
+    def tries(self) -> int:
+        """Количество попыток запуска"""
+        return self.__tries
+
+    @property
+    def start_at(self) -> datetime:
+        """Время запуска задачи"""
+        return self.__start_at
+
+    @property
+    def dependencies(self) -> tuple['Job', ...]:
+        """Задачи-зависимости"""
+        return self.__dependencies
+
+    @property
+    def result(self) -> Any:
+        """Опубликованный результат задачи или None"""
+        return (self.store or default_store()).get(self.uid)
+
+    @property
+    def result_hash(self) -> str:
+        """Хэш результата задачи для отпечатков зависимых задач"""
+        if self.__result_hash is None:
+            self.__result_hash = value_hash(self.result)
+        return self.__result_hash
+
+    def __publish(self, values: list):
+        """Метод публикует результат задачи: значение единственного
+        аргумента или список значений по аргументам"""
+        if all(value is None for value in values):
+            self.__put_result(None)
+        else:
+            self.__put_result(values[0] if len(values) == 1 else values)
+
+    def __put_result(self, value: Any, result_hash: Optional[str] = None):
+        """Метод сохраняет результат в хранилище"""
+        store = self.store or default_store()
+        if value is None:
+            store.delete(self.uid)
+        else:
+            store.put(self.uid, value)
+        self.__result_hash = result_hash
+
+    def __metrics(self) -> metrics.JobMetrics:
+        """Метрики категории задачи"""
+        return self.metrics.for_category(self.category)
+
+    def __memo(self) -> MemoCache:
+        """Кэш результатов задачи"""
+        if self.memo_cache is None:
+            return default_memo_cache()
+        return self.memo_cache
+
+    def __memo_key(self) -> str:
+        """Отпечаток задачи для кэша результатов"""
+        return fingerprint(
+            self.__func, self.__args,
+            (job.result_hash for job in self.__dependencies),
+            extra=repr((self.receive_results, self.batched)),
         )
 
+    def __reuse(self, key: str) -> bool:
+        """Метод берет результат из кэша.
+        Возвращает False, если записи нет"""
+        entry = self.__memo().get(key)
+        if entry is None:
+            return False
+        self.__put_result(entry.value, entry.value_hash)
+        self.is_successful = True
+        save_status('job %s result is taken from memo cache', self)
+        return True
+
+    def __remember(self, key: str):
+        """Метод запоминает результат успешной задачи"""
+        value = self.result
+        entry = MemoEntry(value, value_hash(value))
+        self.__result_hash = entry.value_hash
+        self.__memo().put(key, entry)
+
+    def __call_args(self) -> Any:
+        """Аргументы вызовов цели. Задача без аргументов,
+        получающая результаты зависимостей, вызывается один раз"""
+        if not self.__args and self.receive_results:
+            return ((),)
+        return self.__args
+
+    def __with_inputs(self, func: Callable) -> Callable:
+        """Цель, получающая результаты зависимостей
+        после своих аргументов"""
+        inputs = tuple(job.result for job in self.__dependencies)
+
+        def call(*args):
+            return func(*args, *inputs)
+        return call
+
+    @property
+    def future(self) -> Optional[JobFuture]:
+        """Описатель текущего или последнего выполнения задачи
+        или None, если задача не запускалась"""
+        return self.__future
+
+    def wait_end(self, timeout: Optional[float] = None) -> bool:
+        """Метод блокируется до завершения задачи.
+        Возвращает False, если истек timeout"""
+        return self.__end_event.wait(timeout)
+
     def check_deps(self):
         """Метод, вовзращающий статус задач-зависимостей:
         успешны и завершены"""
@@ -103,34 +456,71 @@ class Job:
         return is_dependencies_successful, is_dependencies_end
 
     def wait_start_time(self):
-        """Метод для ожидания время запуска"""
-        while datetime.now() < self.__start_at:
-            sleep(0.01)
+        """Метод для ожидания время запуска.
+        Поток засыпает один раз до нужного момента.
+        Планировщик отдает задачу потоку уже в момент запуска,
+        поэтому там ожидания не происходит"""
+        delay = (self.__start_at - datetime.now()).total_seconds()
+        if delay > 0:
+            sleep(delay)
 
-    def wait_dependencies(self):
+    def wait_dependencies(self) -> Optional[bool]:
         """Метод для ожидания выполенния задач-зависимостей.
-        В случае фейла зависимостей перезапускает их.
-        Возвращает статус успешности задач-зависимостей"""
+        Ожидание построено на событиях завершения, а не на опросе.
+        В планировщике задача запускается уже после завершения
+        зависимостей, поэтому там ожидания не происходит.
+        В случае фейла зависимостей перезапускает их один раз
+        за выполнение задачи: зависимость, которую уже перезапустила
+        другая задача, не запускается повторно, а ожидается.
+        Время ожидания попадает в метрику dependency_wait.
+        Возвращает статус успешности задач-зависимостей или None,
+        если планировщик отложил задачу до их завершения"""
         is_dependencies_successful, is_dependencies_end = self.check_deps()
         save_status(
-            f'is dependencies successful = {is_dependencies_successful}\n'
-            f'is dependencies ended = {is_dependencies_end}'
+            'is dependencies successful = %s\n'
+            'is dependencies ended = %s',
+            is_dependencies_successful, is_dependencies_end,
         )
-        while not is_dependencies_end:
-            sleep(0.1)
-            is_dependencies_successful, is_dependencies_end = self.check_deps()
-
-        if not is_dependencies_successful:
-            save_status(f'{self.__dependencies} restart')
+        if not is_dependencies_end:
+            waited_at = monotonic()
             for job in self.__dependencies:
-                job.run()
+                job.wait_end()
+            self.__metrics().dependency_wait.observe(monotonic() - waited_at)
+        is_dependencies_successful, _ = self.check_deps()
 
-        is_dependencies_successful, is_dependencies_end = self.check_deps()
-        while not is_dependencies_end:
-            sleep(0.1)
-            is_dependencies_successful, is_dependencies_end = self.check_deps()
+        if not is_dependencies_successful and not self.__is_deps_rerun:
+            self.__is_deps_rerun = True
+            if not self.__rerun_dependencies():
+                return None
+
+        is_dependencies_successful, _ = self.check_deps()
         return is_dependencies_successful
 
+    def __rerun_dependencies(self) -> bool:
+        """Метод перезапускает неуспешные зависимости.
+        В потоке планировщика задача не ждет зависимость,
+        которая выполняется в другом потоке или повтор которой
+        отложен в кучу таймеров, а откладывается через defer.
+        Без defer зависимости повторяются и ожидаются в этом потоке.
+        Возвращает False, если задача отложена"""
+        save_status('%s restart', self.__dependencies)
+        is_worker = in_scheduler_worker()
+        defer = self.defer if is_worker else None
+        _worker.is_scheduler = defer is not None
+        try:
+            futures = [
+                job.rerun(job.future, wait=defer is None)
+                for job in self.__dependencies
+                if not job.is_successful and job.future is not None
+            ]
+        finally:
+            _worker.is_scheduler = is_worker
+        pending = [future for future in futures if not future.done()]
+        if defer is None or not pending:
+            return True
+        defer(self, pending)
+        return False
+
     def check_timout(self, start_time):
         """Метод, проверяющий выход за заданную границу времени"""
         if self.__max_working_time != -1:
@@ -146,68 +536,352 @@ class Job:
         is_time_end = is_have_timeout and (spend_time > limit)
         return is_time_end
 
-    def do_job(self):
+    def __get_target(self) -> Callable:
+        """Метод возвращает функцию для выполнения аргументов
+        через исполнитель задачи. С исполнителем process задача
+        с таймаутом, цель которой не умеет сама прерываться
+        по сроку, выполняется в убиваемом процессе.
+        Функции-генераторы выполняются в потоке"""
+        func = self.__func
+        if inspect.isgeneratorfunction(func):
+            return func
+        executor = get_executor(self.executor)
+        owner = getattr(func, '__self__', None)
+        if (executor.name == PROCESS and self.__max_working_time != -1
+                and not getattr(owner, 'preemptible', False)):
+            return partial(run_killable, func)
+        return executor.wrap(func)
+
+    def __do_try(self, func: Callable) -> list:
+        """Метод выполняет одну попытку: отправляет
+        в корутину аргументы до первого фейла, стопа или таймаута.
+        Возвращает результаты вызовов"""
+        values: list = []
+        coroutine = catch_arg(func, values)
+        start_time = monotonic()
+        coroutine.send(None)
+
+        self.is_successful = True
+        save_status('job is successful = %s', self.is_successful)
+
+        for arg in self.__call_args():
+            while self.__is_pause:
+                save_status('job %s on pause', self)
+                sleep(0.01)
+
+            is_time_end = self.check_timout(start_time)
+            if self.cancel_token.is_cancelled or is_time_end:
+                self.is_successful = False
+                save_status('job %s is stop', self)
+                break
+
+            try:
+                coroutine.send(arg)
+                self.is_successful &= True
+            except StopIteration:
+                self.is_successful &= False
+                save_status('job %s is fail', self)
+                logger.error('FAIL: %s', self)
+        return values
+
+    def do_job(self) -> bool:
         """Метод с учетом количества попыток выполняет основную задачу.
         В корутину отправлятся аргументы для выполения.
-        В случае таймаута задача завершается.
-        Сохраняется статус завершения и выполенности задачи"""
-        num_of_tries = 0
-        while num_of_tries < self.__tries and not self.is_successful:
-            coroutine = catch_arg(self.__func)
-            start_time = monotonic()
-            coroutine.send(None)
+        Таймаут жесткий: по истечении срока или отмене задачи
+        выполняемая работа прерывается (процесс убивается,
+        сокет закрывается), и задача завершается.
+        Повтор после неудачной попытки идет с экспоненциально растущей
+        задержкой: в потоке планировщика задача (в том числе
+        перезапущенная зависимость) возвращается в кучу таймеров
+        через retry, и поток свободен до повтора (если планировщик
+        отказал в повторе, задача завершается фейлом),
+        вне планировщика поток ждет задержку сам.
+        Сохраняется статус завершения и выполенности задачи,
+        результат успешной задачи публикуется.
+        Время попыток и число повторов попадают в метрики.
+        Выбранные профилировщиком задачи выполняются под профилем.
+        Возвращает False, если повтор поставлен в планировщик"""
+        func = self.__get_target()
+        if self.receive_results:
+            func = self.__with_inputs(func)
+        values: list = []
+        job_metrics = self.__metrics()
+        profiler = profiling.select(self.profile, self.category)
+        while (self.__attempts < self.__tries and not self.is_successful
+               and not self.cancel_token.is_cancelled):
             cur_thread = current_thread()
 
-            num_of_tries += 1
-            logging.info(
-                f'{cur_thread} tries to get {self}: try {num_of_tries}.'
+            self.__attempts += 1
+            logger.info(
+                '%s tries to get %s: try %s.',
+                cur_thread, self, self.__attempts,
             )
+            if self.__attempts > 1:
+                job_metrics.retries.inc()
+            started_at = monotonic()
+            with job_deadline(self.__max_working_time, self.cancel_token):
+                if profiler is None:
+                    values = self.__do_attempt(func)
+                else:
+                    with profiler.profile(profiling.target_name(self.__func)):
+                        values = self.__do_attempt(func)
+            job_metrics.try_seconds.observe(monotonic() - started_at)
+            if not self.__wait_retry():
+                return False
+        if self.is_successful:
+            self.__publish(values)
+        return True
 
-            self.is_successful = True
-            save_status(f'job is successful = {self.is_successful}')
+    def __wait_retry(self) -> bool:
+        """Метод ждет задержку перед повтором неудачной попытки
+        или передает повтор планировщику, если задачу выполняет
+        его поток.
+        Возвращает False, если повтор поставлен в планировщик"""
+        if (self.is_successful or self.__attempts >= self.__tries
+                or self.cancel_token.is_cancelled):
+            return True
+        if self.retry is not None and in_scheduler_worker():
+            if self.retry(self, self.__attempts):
+                save_status('job %s retry is scheduled', self)
+                return False
+            self.__attempts = self.__tries
+            return True
+        data = Data()
+        sleep(backoff_delay(
+            self.__attempts, data.retry_base_delay, data.retry_max_delay
+        ))
+        return True
 
-            for arg in self.__args:
-                while self.__is_pause:
-                    save_status(f'job {self} on pause')
-                    sleep(0.01)
+    def __do_attempt(self, func: Callable) -> list:
+        """Метод выполняет одну попытку обычной или map-задачи"""
+        if self.is_map:
+            return self.__do_map(func)
+        return self.__do_try(func)
+
+    @property
+    def is_map(self) -> bool:
+        """Задача выполняется в map-режиме"""
+        return self.chunk_size > 0 or self.batched
+
+    def __do_map(self, func: Callable) -> list:
+        """Метод выполняет попытку map-задачи: делит аргументы на части
+        и обрабатывает их вместе с помощниками, если задача запущена
+        планировщиком. Итог - успех, если успешны все аргументы.
+        Возвращает результаты по аргументам"""
+        args = list(self.__call_args())
+        feed = _ChunkFeed(args, self.chunk_size or len(args) or 1)
+        results: list[Optional[tuple[str, int]]] = [None] * len(args)
+        work = (func, feed, results, current_deadline())
+        if self.spawn is not None and len(feed.chunks) > 1:
+            self.spawn(
+                lambda: Job(
+                    target=self.__map_worker, args=(work,),
+                    executor=INLINE, priority=self.priority,
+                    category=self.category,
+                ),
+                len(feed.chunks) - 1,
+            )
+        self.__map_worker(*work)
+        feed.wait_idle()
 
-                is_time_end = self.check_timout(start_time)
-                if self.__is_stop or is_time_end:
-                    save_status(f'job {self} is stop')
-                    break
+        self.arg_results = results
+        failed = [
+            index for index, result in enumerate(results)
+            if result is None or result[1] != 0
+        ]
+        self.is_successful = not failed
+        save_status(
+            'map job %s: %s of %s args failed %s',
+            self, len(failed), len(args), failed[:10],
+        )
+        return [_value_of(result) for result in results]
 
+    def __map_worker(
+            self, func: Callable, feed: _ChunkFeed,
+            results: list, deadline: Optional[Deadline]):
+        """Метод разбирает части аргументов, пока они есть.
+        Выполняется задачей и ее помощниками под сроком задачи"""
+        with shared_deadline(deadline):
+            while True:
+                if self.cancel_token.is_cancelled or (
+                        deadline and deadline.is_expired):
+                    feed.close()
+                chunk = feed.take()
+                if chunk is None:
+                    return ('success', 0)
                 try:
-                    coroutine.send(arg)
-                    self.is_successful &= True
-                except StopIteration:
-                    self.is_successful &= False
-                    save_status(f'job {self} is fail')
-                    logging.error(f'FAIL: {self}')
-
-    def run(self):
-        """Метод для запуска задачи.
-        Ожидает время до запуска и успешное завершение задач зависимостей.
-        В случае успеха-задач зависмостей запускает основную задачу"""
+                    self.__run_chunk(func, *chunk, results)
+                finally:
+                    feed.done()
+
+    def __run_chunk(
+            self, func: Callable, start: int, chunk: list, results: list):
+        """Метод выполняет часть аргументов и записывает статусы"""
+        while self.__is_pause:
+            sleep(0.01)
+        if not self.batched:
+            for offset, arg in enumerate(chunk):
+                results[start + offset] = _call_arg(func, arg)
+            return
+        output = _call_arg(func, (chunk,))
+        if isinstance(output, list) and len(output) == len(chunk):
+            results[start:start + len(chunk)] = output
+        else:
+            results[start:start + len(chunk)] = [output] * len(chunk)
+
+    def __execute(
+            self,
+            job_metrics: metrics.JobMetrics) -> Optional[metrics.Counter]:
+        """Метод выполняет задачу или берет результат из кэша.
+        Возвращает счетчик итога задачи или None,
+        если повтор поставлен в планировщик"""
+        key = self.__memo_key() if self.memoize else None
+        if key is not None and not self.__attempts and self.__reuse(key):
+            return job_metrics.memo_hits
+        if not self.do_job():
+            return None
+        if key is not None and self.is_successful:
+            self.__remember(key)
+        if self.is_successful:
+            return job_metrics.succeeded
+        return job_metrics.failed
+
+    def __start(
+            self,
+            job_metrics: metrics.JobMetrics) -> Optional[metrics.Counter]:
+        """Метод ожидает время до запуска и успешное завершение
+        задач зависимостей и в случае успеха выполняет задачу.
+        Возвращает счетчик итога задачи или None,
+        если повтор или ожидание зависимостей передано планировщику"""
+        ready_at = time() if self.ready_at is None else self.ready_at
         self.wait_start_time()
+        if not self.__is_deps_rerun:
+            # у задачи, отложенной до перезапущенных зависимостей,
+            # опоздание запуска уже учтено
+            job_metrics.start_delay.observe(max(
+                time() - max(self.__start_at.timestamp(), ready_at), 0.0
+            ))
         is_dependencies_successful = self.wait_dependencies()
+        if is_dependencies_successful is None:
+            return None
 
         if not is_dependencies_successful:
             self.is_successful = False
-            save_status(f'job {self} is fail')
-            logging.error(f'FAIL: {self}')
+            save_status('job %s is fail', self)
+            logger.error('FAIL: %s', self)
+            return job_metrics.failed
+        save_status(
+            'is dependencies successful = %s', is_dependencies_successful
+        )
+        return self.__execute(job_metrics)
+
+    def run(self) -> JobFuture:
+        """Метод для запуска задачи.
+        Ожидает время до запуска и успешное завершение задач зависимостей.
+        Опоздание запуска и итог задачи попадают в метрики.
+        В случае успеха-задач зависмостей запускает основную задачу.
+        Повтор, поставленный в планировщик, продолжает задачу
+        сразу с выполнения: время запуска и зависимости уже дождались.
+        Пока повтор ждет, задача не завершена.
+        Запуск задачи, которая уже выполняется в другом потоке,
+        не выполняет ее еще раз, а дожидается текущего выполнения.
+        Возвращает описатель выполнения"""
+        return self.__run(None, True)
+
+    def rerun(self, failed: JobFuture, wait: bool = True) -> JobFuture:
+        """Метод перезапускает задачу после неудачного выполнения
+        failed. Если задачу уже перезапустили, новое выполнение
+        не начинается, а дожидается уже начатого
+        (wait=False - описатель возвращается без ожидания).
+        Возвращает описатель выполнения"""
+        return self.__run(failed, wait)
+
+    def __run(self, stale: Optional[JobFuture], wait: bool) -> JobFuture:
+        """Выполнение задачи текущим потоком или ожидание
+        выполнения, начатого другим"""
+        future, is_owner = self.__claim(stale)
+        if not is_owner:
+            if wait:
+                future.wait()
+            return future
+        is_pending = False
+        exception = None
+        try:
+            is_pending = not self.__run_attempts()
+        except BaseException as error:
+            exception = error
+            raise
+        finally:
+            self.__release(future, is_pending, exception)
+        return future
+
+    def __claim(self, stale: Optional[JobFuture]) -> tuple[JobFuture, bool]:
+        """Метод выбирает, выполнять ли задачу текущему потоку.
+        Незавершенное выполнение продолжает текущий поток,
+        только если им не занят другой (повтор или отложенная
+        задача из планировщика), перезапуск его не продолжает.
+        Новое выполнение начинается, если прошлое завершено
+        и (для перезапуска) совпадает с неудачным stale,
+        и выполняет попытки заново, даже если прошлое было успешным.
+        Возвращает описатель и признак, что выполняет текущий поток"""
+        with self.__run_lock:
+            future = self.__future
+            if future is not None and not future.done():
+                if self.__is_running or stale is not None:
+                    return future, False
+                self.__is_running = True
+                return future, True
+            if stale is not None and future is not stale:
+                return future, False
+            self.__future = JobFuture(str(self), lambda: self.result)
+            self.__is_running = True
+            self.__is_deps_rerun = False
+            self.is_successful = False
+            self.is_end = False
+            self.__end_event.clear()
+            return self.__future, True
+
+    def __run_attempts(self) -> bool:
+        """Ожидание запуска и попытки задачи.
+        Возвращает False, если повтор поставлен в планировщик"""
+        job_metrics = self.__metrics()
+        if self.__attempts:
+            outcome = self.__execute(job_metrics)
         else:
-            save_status(
-                f'is dependencies successful = {is_dependencies_successful}'
-            )
-            self.do_job()
-        self.is_end = True
-        logging.info(f'END: {self}')
-        save_status(f'END JOB: {self}')
+            outcome = self.__start(job_metrics)
+        if outcome is None:
+            return False
+        outcome.inc()
+        self.__attempts = 0
+        return True
+
+    def __release(
+            self, future: JobFuture, is_pending: bool,
+            exception: Optional[BaseException]):
+        """Метод освобождает выполнение. Завершенное выполнение
+        (в том числе прерванное исключением, оно завершает
+        задачу фейлом) отмечается в задаче и описателе"""
+        with self.__run_lock:
+            self.__is_running = False
+            if is_pending:
+                return
+            if exception is not None:
+                self.is_successful = False
+            self.__attempts = 0
+            self.is_end = True
+            self.__end_event.set()
+        logger.info('END: %s', self)
+        save_status('END JOB: %s', self)
+        future.finish(self.is_successful, exception)
+        if self.on_end is not None:
+            self.on_end(self)
 
     def pause(self, is_pause=True):
         """Метод, определяющий статус пауза"""
         self.__is_pause = is_pause
 
     def stop(self):
-        """Метод, определяющий статус стоп"""
-        self.__is_stop = True
+        """Метод отменяет задачу: выполняемая работа прерывается,
+        новые аргументы и попытки не начинаются,
+        задача завершается фейлом"""
+        self.cancel_token.cancel()
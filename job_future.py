@@ -0,0 +1,100 @@
+"""Описатель выполнения задачи: ожидание, результат
+и обратные вызовы по завершении"""
+from threading import Condition
+from typing import Any, Callable, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class JobFailed(RuntimeError):
+    """Ошибка получения результата задачи, завершившейся фейлом"""
+
+
+class JobFuture:
+    """Выполнение задачи. Все, кто запрашивает запуск задачи,
+    пока она выполняется, получают один и тот же описатель
+    и ждут его, а не запускают задачу повторно.
+    load_result - функция, возвращающая опубликованный
+    результат успешной задачи"""
+    def __init__(self, name: str, load_result: Callable[[], Any]):
+        self.name = name
+        self.__load_result = load_result
+        self.__condition = Condition()
+        self.__is_done = False
+        self.__is_successful = False
+        self.__exception: Optional[BaseException] = None
+        self.__callbacks: list[Callable[['JobFuture'], None]] = []
+
+    def __repr__(self) -> str:
+        state = 'done' if self.__is_done else 'pending'
+        return f'JobFuture({self.name}, {state})'
+
+    def done(self) -> bool:
+        """Завершено ли выполнение"""
+        return self.__is_done
+
+    def successful(self) -> bool:
+        """Завершилось ли выполнение успехом"""
+        return self.__is_done and self.__is_successful
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Метод блокируется до завершения выполнения.
+        Возвращает False, если истек timeout"""
+        with self.__condition:
+            return self.__condition.wait_for(lambda: self.__is_done, timeout)
+
+    def exception(
+            self, timeout: Optional[float] = None) -> Optional[BaseException]:
+        """Исключение, прервавшее выполнение, или None.
+        Бросает TimeoutError, если выполнение не завершилось
+        за timeout"""
+        if not self.wait(timeout):
+            raise TimeoutError(f'{self.name} is not done')
+        return self.__exception
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        """Результат успешного выполнения.
+        Бросает исключение, прервавшее выполнение, JobFailed,
+        если задача завершилась фейлом, и TimeoutError,
+        если выполнение не завершилось за timeout"""
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        if not self.__is_successful:
+            raise JobFailed(f'{self.name} is fail')
+        return self.__load_result()
+
+    def add_done_callback(self, callback: Callable[['JobFuture'], None]):
+        """Метод добавляет функцию, вызываемую с описателем
+        по завершении. Для завершенного выполнения функция
+        вызывается сразу в текущем потоке"""
+        with self.__condition:
+            if not self.__is_done:
+                self.__callbacks.append(callback)
+                return
+        self.__call(callback)
+
+    def finish(
+            self, is_successful: bool,
+            exception: Optional[BaseException] = None):
+        """Метод завершает выполнение, будит ожидающих
+        и вызывает функции завершения в текущем потоке"""
+        with self.__condition:
+            if self.__is_done:
+                return
+            self.__is_done = True
+            self.__is_successful = is_successful and exception is None
+            self.__exception = exception
+            callbacks, self.__callbacks = self.__callbacks, []
+            self.__condition.notify_all()
+        for callback in callbacks:
+            self.__call(callback)
+
+    def __call(self, callback: Callable[['JobFuture'], None]):
+        """Вызов функции завершения: ошибка функции
+        не мешает остальным"""
+        try:
+            callback(self)
+        except Exception:
+            logger.exception('done callback of %s failed', self)
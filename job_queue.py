@@ -0,0 +1,385 @@
+"""Общая очередь задач в файлах для нескольких процессов
+планировщика на одной машине или на машинах с общей файловой системой"""
+from datetime import datetime
+from multiprocessing import get_context
+from threading import Condition
+from time import time
+from typing import Optional
+from uuid import uuid4
+import json
+import logging
+import os
+import random
+import socket
+
+from data import Data
+from job import Job
+from job_spec import SpecError, job_from_spec, job_to_spec
+from scheduler import Scheduler
+from settings_store import set_logging
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+TMP = 'tmp'
+SPEC_FILE = 'job.json'
+LEASE_FILE = 'lease.lock'
+RESULT_FILE = 'result.json'
+
+
+class FileJobQueue:
+    """Очередь задач в директории root. У каждой задачи своя
+    директория с описанием job.json, положение директории -
+    состояние задачи:
+    pending/<uid> - задача ждет,
+    claimed/<uid>.<owner> - задачу выполняет процесс owner,
+    done/<uid> - задача завершена, итог в result.json.
+    Все переходы - атомарные переименования директорий: взять
+    задачу из pending удается ровно одному процессу.
+    Взявший задачу процесс держит аренду - файл lease.lock,
+    время изменения которого продлевает heartbeat. Аренду,
+    не продленную lease_ttl секунд, любой процесс возвращает
+    в pending (reclaim), и задачу берет другой процесс.
+    Задача берется, когда наступило ее время и завершились
+    зависимости; задача с неудачной зависимостью завершается
+    фейлом без выполнения, зависимость, которой нет в очереди
+    ни в каком состоянии, считается выполненной, как и при
+    восстановлении задачи из описания. На общей файловой системе часы
+    машин должны быть синхронизированы"""
+    def __init__(
+            self, root: Optional[str] = None,
+            lease_ttl: Optional[float] = None,
+            owner: Optional[str] = None):
+
+        data = Data()
+        self.root = root or data.queue_dir
+        self.lease_ttl = (
+            data.queue_lease_ttl if lease_ttl is None else lease_ttl
+        )
+        self.owner = owner or (
+            f'{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}'
+        )
+        self.__candidates: list[str] = []
+        for state in (PENDING, CLAIMED, DONE, TMP):
+            os.makedirs(self.__dir(state), exist_ok=True)
+
+    def __dir(self, state: str, name: str = '') -> str:
+        """Путь директории состояния или задачи в нем"""
+        return os.path.join(self.root, state, name)
+
+    def __claimed(self, uid: str) -> str:
+        """Директория задачи, взятой этим процессом"""
+        return self.__dir(CLAIMED, f'{uid}.{self.owner}')
+
+    def put(self, job: Job):
+        """Метод добавляет задачу в очередь. Описание и файл аренды
+        пишутся во временную директорию, и задача появляется
+        в pending целиком. Бросает SpecError, если задачу
+        нельзя описать"""
+        spec = job_to_spec(job)
+        tmp_dir = self.__dir(TMP, f'{job.uid}.{uuid4().hex}')
+        os.makedirs(tmp_dir)
+        with open(os.path.join(tmp_dir, SPEC_FILE), 'w') as file:
+            json.dump(spec, file)
+        open(os.path.join(tmp_dir, LEASE_FILE), 'w').close()
+        os.replace(tmp_dir, self.__dir(PENDING, job.uid))
+
+    def result(self, uid: str) -> Optional[bool]:
+        """Итог завершенной задачи или None, если задача
+        не завершена"""
+        try:
+            with open(self.__dir(DONE, os.path.join(uid, RESULT_FILE))) \
+                    as file:
+                return json.load(file)['is_successful']
+        except FileNotFoundError:
+            return None
+
+    def counts(self) -> dict[str, int]:
+        """Число задач в каждом состоянии"""
+        return {
+            state: len(os.listdir(self.__dir(state)))
+            for state in (PENDING, CLAIMED, DONE)
+        }
+
+    def is_empty(self) -> bool:
+        """Нет ни ждущих, ни выполняемых задач"""
+        return not (
+            os.listdir(self.__dir(PENDING)) or os.listdir(self.__dir(CLAIMED))
+        )
+
+    def __is_queued(self, uid: str) -> bool:
+        """Ждет ли задача в pending или выполняется в claimed.
+        pending проверяется и после claimed: так не теряется
+        задача, которую между проверками вернули из claimed"""
+        if os.path.exists(self.__dir(PENDING, uid)):
+            return True
+        prefix = f'{uid}.'
+        if any(
+            name.startswith(prefix)
+            for name in os.listdir(self.__dir(CLAIMED))
+        ):
+            return True
+        return os.path.exists(self.__dir(PENDING, uid))
+
+    def __readiness(self, spec: dict) -> Optional[bool]:
+        """Готовность задачи: None - время или зависимости
+        еще не наступили, False - зависимость завершилась фейлом"""
+        if datetime.fromisoformat(spec['start_at']).timestamp() > time():
+            return None
+        for uid in spec['dependencies']:
+            is_successful = self.result(uid)
+            if is_successful is None and not self.__is_queued(uid):
+                # зависимость могла завершиться между проверками
+                is_successful = self.result(uid)
+                if is_successful is None:
+                    logger.warning(
+                        'dependency %s of %s is not in queue',
+                        uid, spec['uid'],
+                    )
+                    continue
+            if not is_successful:
+                return is_successful
+        return True
+
+    def claim(self, limit: int) -> list[Job]:
+        """Метод берет до limit готовых задач.
+        Список pending читается, только когда кончились кандидаты
+        прошлого чтения, и перемешивается, чтобы процессы реже
+        соперничали за одни и те же задачи"""
+        if not self.__candidates:
+            self.__candidates = os.listdir(self.__dir(PENDING))
+            random.shuffle(self.__candidates)
+        jobs: list[Job] = []
+        while self.__candidates and len(jobs) < limit:
+            job = self.__claim_one(self.__candidates.pop())
+            if job is not None:
+                jobs.append(job)
+        return jobs
+
+    def __claim_one(self, uid: str) -> Optional[Job]:
+        """Попытка взять одну задачу. Возвращает задачу
+        или None, если она не готова или ее взял другой процесс"""
+        try:
+            with open(self.__dir(PENDING, os.path.join(uid, SPEC_FILE))) \
+                    as file:
+                spec = json.load(file)
+        except FileNotFoundError:
+            return None
+        readiness = self.__readiness(spec)
+        if readiness is None:
+            return None
+        try:
+            os.rename(self.__dir(PENDING, uid), self.__claimed(uid))
+            os.utime(os.path.join(self.__claimed(uid), LEASE_FILE))
+        except OSError:
+            return None
+        try:
+            job = job_from_spec(spec)
+        except SpecError:
+            logger.exception('job %s can not be restored', uid)
+            self.__finish(uid, False)
+            return None
+        if not readiness:
+            logger.error('dependencies of %s failed', uid)
+            self.__finish(uid, False)
+            return None
+        return job
+
+    def heartbeat(self, uids: list[str]) -> list[str]:
+        """Метод продлевает аренды задач.
+        Возвращает uid задач, аренду которых процесс потерял"""
+        lost = []
+        for uid in uids:
+            try:
+                os.utime(os.path.join(self.__claimed(uid), LEASE_FILE))
+            except FileNotFoundError:
+                lost.append(uid)
+        return lost
+
+    def reclaim(self) -> int:
+        """Метод возвращает в pending задачи с истекшей арендой.
+        Возвращает число возвращенных задач"""
+        reclaimed = 0
+        now = time()
+        for name in os.listdir(self.__dir(CLAIMED)):
+            path = self.__dir(CLAIMED, name)
+            try:
+                leased_at = self.__leased_at(path)
+            except FileNotFoundError:
+                continue
+            if now - leased_at < self.lease_ttl:
+                continue
+            uid = name.split('.', 1)[0]
+            try:
+                os.rename(path, self.__dir(PENDING, uid))
+            except OSError:
+                continue
+            logger.warning('lease of %s is expired', name)
+            reclaimed += 1
+        return reclaimed
+
+    @staticmethod
+    def __leased_at(path: str) -> float:
+        """Время последнего продления аренды. До первого
+        продления - время переименования директории"""
+        stat = os.stat(path)
+        return max(
+            os.stat(os.path.join(path, LEASE_FILE)).st_mtime, stat.st_ctime
+        )
+
+    def complete(self, job: Job) -> bool:
+        """Метод отмечает завершение взятой задачи.
+        Возвращает False, если аренда потеряна: задачу вернули
+        в очередь, и ее итог определит другой процесс"""
+        return self.__finish(job.uid, job.is_successful)
+
+    def __finish(self, uid: str, is_successful: bool) -> bool:
+        """Запись итога и перенос задачи в done"""
+        path = self.__claimed(uid)
+        try:
+            with open(os.path.join(path, RESULT_FILE), 'w') as file:
+                json.dump({'is_successful': is_successful}, file)
+            os.rename(path, self.__dir(DONE, uid))
+        except OSError:
+            logger.warning('lease of %s is lost', uid)
+            return False
+        return True
+
+    def release(self, uid: str) -> bool:
+        """Метод возвращает взятую задачу в pending без выполнения.
+        Возвращает False, если аренда уже потеряна"""
+        try:
+            os.rename(self.__claimed(uid), self.__dir(PENDING, uid))
+        except OSError:
+            return False
+        return True
+
+
+class QueueWorker:
+    """Исполнитель общей очереди в одном процессе: берет задачи
+    в свой планировщик, держит не больше prefetch взятых задач,
+    продлевает их аренды, возвращает в очередь задачи с истекшей
+    арендой и отмечает завершение выполненных. Задача, аренду
+    которой процесс потерял, отменяется.
+    Результаты задач публикуются в хранилище процесса,
+    поэтому receive_results между задачами очереди не работает"""
+    def __init__(
+            self, queue: FileJobQueue,
+            scheduler: Optional[Scheduler] = None, prefetch: int = 10):
+
+        self.queue = queue
+        self.scheduler = scheduler or Scheduler(pool_size=prefetch)
+        self.prefetch = prefetch
+        self.completed = 0
+        self.__in_flight: dict[str, Job] = {}
+        self.__condition = Condition()
+        self.__is_stop = False
+
+    def __on_end(self, job: Job):
+        """Завершение задачи: отмененная при остановке задача
+        возвращается в очередь, остальные отмечаются выполненными"""
+        if self.__is_stop and job.cancel_token.is_cancelled:
+            is_completed = False
+            self.queue.release(job.uid)
+        else:
+            is_completed = self.queue.complete(job)
+        with self.__condition:
+            self.__in_flight.pop(job.uid, None)
+            if is_completed:
+                self.completed += 1
+            self.__condition.notify_all()
+
+    def __maintain(self):
+        """Продление аренд и возврат истекших"""
+        with self.__condition:
+            uids = list(self.__in_flight)
+        for uid in self.queue.heartbeat(uids):
+            with self.__condition:
+                job = self.__in_flight.get(uid)
+            if job is not None:
+                logger.warning('cancel %s: lease is lost', job)
+                job.stop()
+        self.queue.reclaim()
+
+    def __fill(self) -> int:
+        """Взятие задач до prefetch. Возвращает число взятых"""
+        with self.__condition:
+            free = self.prefetch - len(self.__in_flight)
+        if free <= 0:
+            return 0
+        jobs = self.queue.claim(free)
+        for job in jobs:
+            job.on_end = self.__on_end
+            with self.__condition:
+                self.__in_flight[job.uid] = job
+            self.scheduler.schedule(job)
+        return len(jobs)
+
+    def run(self, until_empty: bool = False, poll_interval: float = 0.05):
+        """Цикл исполнителя в текущем потоке, пока не вызван stop
+        или, если until_empty, пока очередь не опустеет.
+        Аренды продлеваются трижды за lease_ttl, новые задачи
+        ищутся при освобождении места и раз в poll_interval"""
+        self.scheduler.run()
+        heartbeat_interval = self.queue.lease_ttl / 3
+        heartbeat_at = 0.0
+        while not self.__is_stop:
+            if time() >= heartbeat_at:
+                self.__maintain()
+                heartbeat_at = time() + heartbeat_interval
+            is_claimed = self.__fill()
+            with self.__condition:
+                if until_empty and not self.__in_flight \
+                        and self.queue.is_empty():
+                    break
+                if not is_claimed:
+                    self.__condition.wait(
+                        min(poll_interval, heartbeat_at - time())
+                    )
+
+    def stop(self, drain: bool = True, deadline: Optional[float] = None):
+        """Метод останавливает исполнителя и его планировщик.
+        Задачи, которые не успели выполниться, возвращаются
+        в очередь для других процессов"""
+        with self.__condition:
+            self.__is_stop = True
+            self.__condition.notify_all()
+        self.scheduler.stop(drain=drain, deadline=deadline)
+        with self.__condition:
+            left = [
+                uid for uid, job in self.__in_flight.items()
+                if not job.is_end
+            ]
+            self.__in_flight.clear()
+        for uid in left:
+            self.queue.release(uid)
+
+
+def work(
+        root: str, prefetch: int = 10,
+        lease_ttl: Optional[float] = None) -> int:
+    """Процесс-исполнитель: выполняет задачи очереди root,
+    пока она не опустеет. Лог и статусы дописываются в файлы
+    запустившего процесса. Возвращает число выполненных задач"""
+    set_logging(append=True)
+    worker = QueueWorker(FileJobQueue(root, lease_ttl), prefetch=prefetch)
+    try:
+        worker.run(until_empty=True)
+    finally:
+        worker.stop()
+    return worker.completed
+
+
+def run_workers(
+        root: str, processes: int, prefetch: int = 10,
+        lease_ttl: Optional[float] = None) -> list[int]:
+    """Запуск processes процессов-исполнителей очереди root
+    и ожидание, пока они ее опустошат.
+    Возвращает число задач, выполненных каждым процессом"""
+    context = get_context('spawn')
+    with context.Pool(processes) as pool:
+        return pool.starmap(
+            work, [(root, prefetch, lease_ttl)] * processes
+        )
@@ -0,0 +1,116 @@
+"""Сериализация задач в словари и восстановление задач из них"""
+from ast import literal_eval
+from datetime import datetime
+from typing import Any, Callable, Optional
+import importlib
+import types
+
+from executors import get_executor
+from job import Job
+
+
+class SpecError(ValueError):
+    """Ошибка сериализации или восстановления задачи"""
+
+
+def target_to_spec(target: Callable) -> dict:
+    """Функция описывает цель задачи путем импорта.
+    Для метода объекта сохраняется класс объекта и имя метода:
+    при восстановлении создается новый объект класса без аргументов"""
+    owner = getattr(target, '__self__', None)
+    if owner is not None and not isinstance(owner, types.ModuleType):
+        owner_type = type(owner)
+        spec = {
+            'module': owner_type.__module__,
+            'cls': owner_type.__qualname__,
+            'name': target.__name__,
+        }
+    else:
+        spec = {
+            'module': target.__module__,
+            'name': target.__qualname__,
+        }
+    if '<' in spec.get('cls', '') + spec['name']:
+        raise SpecError(f'{target} can not be imported')
+    return spec
+
+
+def _resolve(module: str, qualname: str) -> Any:
+    """Получение объекта модуля по квалифицированному имени"""
+    obj: Any = importlib.import_module(module)
+    for part in qualname.split('.'):
+        obj = getattr(obj, part)
+    return obj
+
+
+def target_from_spec(spec: dict) -> Callable:
+    """Функция восстанавливает цель задачи по описанию"""
+    try:
+        if 'cls' in spec:
+            owner = _resolve(spec['module'], spec['cls'])()
+            return getattr(owner, spec['name'])
+        return _resolve(spec['module'], spec['name'])
+    except (ImportError, AttributeError, TypeError) as error:
+        raise SpecError(f'can not import target {spec}') from error
+
+
+def job_to_spec(job: Job) -> dict:
+    """Функция описывает задачу словарем, пригодным для json.
+    Аргументы сохраняются в виде repr и должны быть литералами Python"""
+    return {
+        'uid': job.uid,
+        'target': target_to_spec(job.target),
+        'args': repr(job.args),
+        'start_at': job.start_at.isoformat(),
+        'max_working_time': job.max_working_time,
+        'tries': job.tries,
+        'dependencies': [dependency.uid for dependency in job.dependencies],
+        'executor': job.executor,
+        'priority': job.priority,
+        'category': job.category,
+        'chunk_size': job.chunk_size,
+        'batched': job.batched,
+        'receive_results': job.receive_results,
+        'memoize': job.memoize,
+        'profile': job.profile,
+    }
+
+
+def job_from_spec(spec: dict, known_jobs: Optional[dict] = None) -> Job:
+    """Функция восстанавливает задачу по описанию.
+    Зависимости ищутся по uid среди known_jobs,
+    отсутствующие зависимости считаются выполненными.
+    Бросает SpecError для неизвестного исполнителя"""
+    known_jobs = known_jobs or {}
+    try:
+        args = literal_eval(spec['args'])
+    except (ValueError, SyntaxError) as error:
+        raise SpecError(
+            f'args of job {spec["uid"]} are not literal'
+        ) from error
+    try:
+        get_executor(spec.get('executor'))
+    except ValueError as error:
+        raise SpecError(
+            f'executor of job {spec["uid"]} is unknown'
+        ) from error
+    return Job(
+        target=target_from_spec(spec['target']),
+        args=args,
+        start_at=datetime.fromisoformat(spec['start_at']),
+        max_working_time=spec['max_working_time'],
+        tries=spec['tries'],
+        dependencies=tuple(
+            known_jobs[uid] for uid in spec['dependencies']
+            if uid in known_jobs
+        ),
+        uid=spec['uid'],
+        executor=spec.get('executor'),
+        priority=spec.get('priority', 0),
+        category=spec.get('category'),
+        chunk_size=spec.get('chunk_size', 0),
+        batched=spec.get('batched', False),
+        receive_results=spec.get('receive_results', False),
+        memoize=spec.get('memoize', False),
+        profile=spec.get('profile'),
+    )
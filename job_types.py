@@ -2,229 +2,317 @@
 Методы классов возвращают коретж из статуса и кода завершения"""
 import os.path
 import os
+import shlex
 import subprocess
 from http import HTTPStatus
-from urllib.request import urlopen
-from urllib.error import URLError
+from http.client import HTTPException
+from typing import Optional, Union
 import logging
-import json
 import ssl
 
 from settings_store import save_status
 from data import Data
+import fs_backend
+from http_pool import ConnectionPool, StreamResult
+from http_cache import ResponseCache
+from json_stream import extract_from_dict, extract_from_stream
+from timeouts import current_deadline
+
+logger = logging.getLogger(__name__)
 
 
 ssl._create_default_https_context = ssl._create_unverified_context
 
+CITY_SPEC = {
+    'city': 'geo_object.locality.name',
+    'country': 'geo_object.country.name',
+}
+
+connection_pool = ConnectionPool(
+    connect_timeout=Data().http_connect_timeout,
+    read_timeout=Data().http_read_timeout,
+    cache=ResponseCache(
+        Data().http_cache_dir,
+        ttl=Data().http_cache_ttl,
+        max_bytes=Data().http_cache_max_bytes,
+    ),
+)
 
-def run_command(command: str):
+
+def run_command(command: str, cwd: Optional[str] = None):
     """Запуск терминальных команд
-    с помощью модуля subprocess"""
-    command_list = command.split()
+    с помощью модуля subprocess.
+    cwd - рабочая директория команды"""
+    command_list = shlex.split(command)
     with subprocess.Popen(
         command_list,
+        cwd=cwd,
         stdout=subprocess.PIPE,
         universal_newlines=True,
     ) as process:
-        output, _ = process.communicate()
+        output, _ = communicate_until_deadline(process)
         ret_code = process.returncode
+    if is_deadline_expired():
+        output = f'{current_deadline().reason}: {command}'
     return output, ret_code
 
 
+def communicate_until_deadline(process: subprocess.Popen):
+    """Ожидание завершения процесса.
+    Если у задачи есть срок, по его истечении или отмене задачи
+    процесс убивается"""
+    deadline = current_deadline()
+    if deadline is None:
+        return process.communicate()
+    deadline.register(process.kill)
+    try:
+        return process.communicate()
+    finally:
+        deadline.unregister(process.kill)
+
+
+def is_deadline_expired() -> bool:
+    """Проверка, истек ли срок текущей задачи
+    или задача отменена"""
+    deadline = current_deadline()
+    return deadline is not None and deadline.is_expired
+
+
 def analyze_json(resp_body: dict):
     """Функция, возвращающая название города и страны,
     извлеченные из json-файла"""
+    output = extract_from_dict(resp_body, CITY_SPEC)
+    return output['city'], output['country']
+
+
+def extract_city(result: StreamResult) -> Optional[dict]:
+    """Функция извлекает город и страну из тела ответа,
+    читая его по частям до нахождения обоих путей.
+    Возвращает None при ошибке"""
+    if result.status != HTTPStatus.OK:
+        logger.error('error during execute request: %s', result.status)
+        return None
     try:
-        city_name = resp_body['geo_object']['locality']['name']
-    except KeyError:
-        city_name = None
-    try:
-        country_name = resp_body['geo_object']['country']['name']
-    except KeyError:
-        country_name = None
-    return city_name, country_name
+        return extract_from_stream(result.stream, CITY_SPEC)
+    except (UnicodeDecodeError, ValueError):
+        return None
 
 
 class JobPrototype:
-    """Прототип типитизированной задачи,
-    хранящий статус и код"""
-    def __init__(self):
-        self.output = 'success'
-        self.ret_code = 0
+    """Прототип типитизированной задачи.
+    Методы не хранят статус и код в экземпляре, а возвращают их:
+    map-задача вызывает один метод из нескольких потоков.
+    preemptible - методы сами прерывают работу по сроку задачи,
+    иначе задача с таймаутом прерывается по сроку только
+    с исполнителем process,
+    category - категория задач для квот планировщика"""
+    preemptible = False
+    category = 'default'
 
 
 class JobWithFS(JobPrototype):
     """Описание класса для задач
     с файловой системой"""
+    preemptible = True
+    category = 'fs'
+
     def create_file(self, filename: str):
-        """Функция создания файла с помощью терминальной
-        команды touch.
+        """Функция создания пустого файла.
         Обрабатывает ситуацию уже существующего
         объекта с таким именем"""
         save_status('create file job is started')
-        logging.info('create file')
-        if os.path.exists(filename):
-            self.output = f'CREATE FILE: {filename} is already exist'
-            self.ret_code = 1
-        else:
-            self.output, self.ret_code = run_command(f'touch {filename}')
-            super().__init__()
-        return (self.output, self.ret_code)
+        logger.info('create file')
+        return fs_backend.create_files((filename,))
 
     def create_dir(self, dirname: str):
-        """Функция создания директории с помощью
-        терминальной команды mkdir.
+        """Функция создания директории.
         Обрабатывает ситуацию уже существующего
         объекта с таким именем"""
         save_status('create dir job is started')
-        logging.info('create dir')
-        if os.path.exists(dirname):
-            self.output = f'CREATE DIR: {dirname} is already exist'
-            self.ret_code = 1
-        else:
-            self.output, self.ret_code = run_command(f'mkdir {dirname}')
-            super().__init__()
-        return (self.output, self.ret_code)
+        logger.info('create dir')
+        return fs_backend.create_dirs((dirname,))
 
     def delete(self, name: str):
         """Функция удаления как файла, так и директории
-        с помощью терминальной команды rm -rf.
+        со всем содержимым.
         Обрабатывает ситуация отсутствия объекта
         с таким именем"""
         save_status('delete job is started')
-        logging.info('delete file or dir')
-        if os.path.exists(name):
-            self.output, self.ret_code = run_command(f'rm -rf {name}')
-            super().__init__()
-        else:
-            self.output = f'DELETE: {name} is not exist'
-            self.ret_code = 1
-        return (self.output, self.ret_code)
+        logger.info('delete file or dir')
+        return fs_backend.delete_paths((name,))
+
+    def create_files(self, filenames: list):
+        """Функция пакетного создания файлов по списку путей.
+        Ошибка по одному пути не прерывает создание остальных"""
+        save_status('create files job is started: %s paths', len(filenames))
+        logger.info('create %s files', len(filenames))
+        return fs_backend.create_files(filenames)
+
+    def create_dirs(self, dirnames: list):
+        """Функция пакетного создания директорий по списку путей.
+        Родительские директории должны идти в списке раньше вложенных"""
+        save_status('create dirs job is started: %s paths', len(dirnames))
+        logger.info('create %s dirs', len(dirnames))
+        return fs_backend.create_dirs(dirnames)
+
+    def delete_many(self, names: list):
+        """Функция пакетного удаления файлов и директорий"""
+        save_status('delete many job is started: %s paths', len(names))
+        logger.info('delete %s paths', len(names))
+        return fs_backend.delete_paths(names)
 
     def change_dir(self, dir_name: str, command: str):
         """Функция изменения директории и выполнения
-        в ней указанной команды.
+        в ней указанной команды без участия оболочки.
         Обрабатывает ситуацию отсутствия директории
         с таким именем"""
         save_status('change dir job is started')
-        logging.info('change dir')
-        command_list = command.split()
+        logger.info('change dir')
         if os.path.isdir(dir_name):
-            with subprocess.Popen(
-                command_list,
-                cwd=dir_name,
-                shell=True
-            ) as process:
-                self.output, _ = process.communicate()
-                self.ret_code = process.returncode
-            super().__init__()
-
-        else:
-            self.output = f'CHANGE: {dir_name} is not exist'
-            self.ret_code = 1
-        return (self.output, self.ret_code)
+            return run_command(command, cwd=dir_name)
+        return (f'CHANGE: {dir_name} is not exist', 1)
 
 
 class JobWithFiles(JobPrototype):
     """Описание класса для задач с файлами"""
+    category = 'files'
+
     def create_file(self, filename: str):
         """Функция создания файла с помощью инструментов Python.
         Обрабатывает ситуацию уже существующего
         объекта с таким именем"""
         save_status('create file job is started')
-        logging.info('create file')
+        logger.info('create file')
         if os.path.exists(filename):
-            self.output = 'CREATE: file is already exist'
-            self.ret_code = 1
-        else:
-            with open(filename, 'w') as _:
-                logging.info(f'CREATE: {filename} is done')
-            super().__init__()
-        return (self.output, self.ret_code)
+            return ('CREATE: file is already exist', 1)
+        with open(filename, 'w') as _:
+            logger.info('CREATE: %s is done', filename)
+        return ('success', 0)
 
     def delete_file(self, filename: str):
         """Функция удаления файла с помощью инструментов Python.
         Обрабатывает ситуацию отстутствия
         файла с таким именем"""
         save_status('delete file job is started')
-        logging.info('delete file')
-        if os.path.isfile(filename):
-            os.remove(filename)
-            super().__init__()
-        else:
-            self.output = 'DELETE: file is not exist'
-            self.ret_code = 1
-        return (self.output, self.ret_code)
-
-    def read_file(self, filename: str):
+        logger.info('delete file')
+        if not os.path.isfile(filename):
+            return ('DELETE: file is not exist', 1)
+        os.remove(filename)
+        return ('success', 0)
+
+    def read_file(
+            self, filename: str, mode: str = fs_backend.TEXT,
+            chunk_size: int = 0):
         """Функция-генератор чтения файла.
-        Обрабатывает ситуацию отсутствия файла
-        с таким имененем читаемого формата"""
+        mode: 'text' - по строкам, 'binary' - частями bytes
+        по chunk_size, 'mmap' - срезами memoryview файла,
+        отображенного в память, без копирования; срез действителен
+        до получения следующего. По умолчанию chunk_size
+        берется из настроек. Обрабатывает ситуацию отсутствия
+        файла с таким имененем читаемого формата"""
         save_status('read file job is started')
-        logging.info('read file')
-        super().__init__()
-        if os.path.isfile(filename):
-
-            try:
-                with open(filename) as file:
-                    for row in file:
-                        yield row
-            except UnicodeDecodeError:
-                self.output = 'READ: format file error'
-                self.ret_code = 1
-        else:
-            self.output = 'READ: file is not exist'
-            self.ret_code = 1
-        return (self.output, self.ret_code)
-
-    def write_file(self, filename: str, data: str, mode: str):
-        """Функция записи в файл. Обрабатывает ошибку
-        попытки записи в директорию"""
+        logger.info('read file')
+        reader = fs_backend.READERS.get(mode)
+        if reader is None:
+            return (f'READ: unknown mode {mode}', 1)
+        if not os.path.isfile(filename):
+            return ('READ: file is not exist', 1)
+        try:
+            yield from reader(filename, chunk_size or Data().file_chunk_size)
+        except UnicodeDecodeError:
+            return ('READ: format file error', 1)
+        return ('success', 0)
+
+    def write_file(
+            self, filename: str, data, mode: str, buffer_size: int = 0):
+        """Функция записи в файл. data - строка, байты
+        или итерируемый набор частей, которые пишутся потоково
+        через буфер buffer_size (по умолчанию из настроек).
+        Обрабатывает ошибку попытки записи в директорию
+        и несовпадение типа частей с режимом"""
         save_status('write file job is started')
-        logging.info('write file')
-        super().__init__()
+        logger.info('write file')
         try:
-            with open(filename, mode) as file:
-                file.write(data)
-        except IsADirectoryError:
-            self.output = 'WRITE: error'
-            self.ret_code = 1
-        return (self.output, self.ret_code)
+            fs_backend.write_chunks(
+                filename, data, mode, buffer_size or Data().file_buffer_size
+            )
+        except (IsADirectoryError, TypeError):
+            return ('WRITE: error', 1)
+        return ('success', 0)
 
 
 class JobWithNet(JobPrototype):
-    """Описание класса для задач с сетью"""
-    def read_url(self, url: str):
-        """Функция для получения данных по URL.
-        В качестве примера анализатора данных
-        используется фунция analyze_json.
-        Обработанные данные записываются в файл"""
-        save_status('read url job is started')
-        data = Data()
-        data_dir = data.data_dir
+    """Описание класса для задач с сетью.
+    Запросы идут через общий пул keep-alive соединений
+    и дисковый кэш ответов. Извлеченные данные записываются
+    в файлы и публикуются результатом задачи"""
+    preemptible = True
+    category = 'net'
 
+    def __save_result(self, output: Union[dict, Exception, None]) -> bool:
+        """Функция записывает извлеченные город и страну в файл.
+        Возвращает признак успеха"""
+        data_dir = Data().data_dir
         if not os.path.exists(data_dir):
             data_dir = ''
+        if not isinstance(output, dict):
+            return False
+        try:
+            city = output['city'].upper()
+            with open(f'{data_dir}{city}_data.txt', 'w') as output_file:
+                output_file.write(f'{output["country"]}\n')
+        except (OSError, AttributeError):
+            return False
+        return True
 
-        logging.info(f'read url {url}')
-        super().__init__()
+    def read_url(self, url: str):
+        """Функция для получения данных по URL.
+        Ответ разбирается потоково по путям CITY_SPEC.
+        Обработанные данные записываются в файл и возвращаются
+        результатом: словарем city и country"""
+        save_status('read url job is started')
+        logger.info('read url %s', url)
+        status, ret_code = 'success', 0
 
+        output: Union[dict, Exception, None]
         try:
-            with urlopen(url) as response:
-                resp_body = response.read().decode('utf-8')
-            resp_body_json = json.loads(resp_body)
+            with connection_pool.stream(url) as result:
+                output = extract_city(result)
+        except (OSError, HTTPException, ValueError) as error:
+            output = error
+        if not self.__save_result(output):
+            status, ret_code = 'error', 1
+        if is_deadline_expired():
+            status, ret_code = f'{current_deadline().reason}: {url}', 1
+        if not isinstance(output, dict):
+            output = None
+        return (status, ret_code, output)
 
-            if response.status != HTTPStatus.OK:
-                self.output = f'error during execute request. ' \
-                    f'{resp_body.status}: {resp_body.reason}'
-                self.ret_code = 1
+    def read_urls(self, urls: list):
+        """Функция для пакетного получения данных по списку URL.
+        Запросы выполняются параллельно, одновременно - не более
+        http_max_in_flight запросов. Каждый ответ обрабатывается
+        как в read_url, результат - список словарей по urls
+        (None для неудачных)"""
+        save_status('read urls job is started')
+        logger.info('read %s urls', len(urls))
+        status, ret_code = 'success', 0
 
-            output = analyze_json(resp_body_json)
-            city = output[0].upper()
-            with open(f'{data_dir}{city}_data.txt', 'w') as output_file:
-                output_file.write(f'{output[1]}\n')
-        except (URLError, TypeError,
-                json.decoder.JSONDecodeError, AttributeError):
-            self.output = 'error'
-            self.ret_code = 1
-        return (self.output, self.ret_code)
+        results = connection_pool.fetch_many(
+            urls, max_in_flight=Data().http_max_in_flight,
+            handle=extract_city,
+        )
+        failed = [
+            url for url, result in zip(urls, results)
+            if not self.__save_result(result)
+        ]
+        if failed:
+            status, ret_code = f'READ URLS: failed {failed}', 1
+        if is_deadline_expired():
+            reason = current_deadline().reason
+            status, ret_code = f'{reason}: {len(failed)} urls failed', 1
+        outputs = [
+            result if isinstance(result, dict) else None
+            for result in results
+        ]
+        return (status, ret_code, outputs)
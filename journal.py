@@ -0,0 +1,156 @@
+"""Журнал упреждающей записи переходов состояний задач"""
+from typing import Any, Optional, TextIO
+import json
+import logging
+import os
+
+from batch_writer import BatchWriter
+from data import Data
+from job import Job
+from job_spec import SpecError, job_to_spec, job_from_spec
+
+logger = logging.getLogger(__name__)
+
+
+class Journal(BatchWriter):
+    """Журнал задач планировщика: строки с событиями
+    add (задача добавлена, с описанием задачи в json), start и end.
+    Записи пишутся фоновым потоком пачками с одним fsync на пачку.
+    Каждые snapshot_every записей состояние незавершенных задач
+    сохраняется в снимок, а журнал обрезается.
+    При восстановлении читается снимок и поверх него журнал"""
+    def __init__(
+            self, path: Optional[str] = None,
+            snapshot_path: Optional[str] = None,
+            snapshot_every: int = 100000, fsync: bool = True,
+            flush_interval: float = 0.01, batch_size: int = 10000):
+
+        path = path or Data().journal_file
+        super().__init__(
+            path, fsync=fsync,
+            flush_interval=flush_interval, batch_size=batch_size,
+        )
+        self.snapshot_path = snapshot_path or f'{path}.snapshot'
+        self.__snapshot_every = snapshot_every
+        self.__since_snapshot = 0
+        self.__live: dict[str, dict] = {}
+
+    def record_add(self, job: Job):
+        """Запись о добавлении задачи"""
+        self.write(('add', job, None))
+
+    def record_start(self, job: Job):
+        """Запись о начале выполнения задачи"""
+        self.write(('start', job, None))
+
+    def record_end(self, job: Job):
+        """Запись о завершении задачи"""
+        self.write(('end', job, job.is_successful))
+
+    def _format(self, record: Any) -> str:
+        """Строка журнала: событие, uid и данные через табуляцию.
+        Описание задачи строится в фоновом потоке,
+        там же обновляется состояние для снимка"""
+        event, job, is_successful = record
+        payload = ''
+        if event == 'add':
+            try:
+                spec = job_to_spec(job)
+                payload = json.dumps(spec)
+                self.__live[job.uid] = {'spec': spec, 'state': 'pending'}
+            except SpecError:
+                logger.warning('job %s can not be journaled', job)
+        elif event == 'start':
+            if job.uid in self.__live:
+                self.__live[job.uid]['state'] = 'running'
+        else:
+            payload = str(int(is_successful))
+            self.__live.pop(job.uid, None)
+        self.__since_snapshot += 1
+        return f'{event}\t{job.uid}\t{payload}\n'
+
+    def _after_commit(self, file: TextIO):
+        """Сжатие журнала: запись снимка и обрезка журнала"""
+        if self.__since_snapshot < self.__snapshot_every:
+            return
+        self.write_snapshot(self.__live)
+        file.seek(0)
+        file.truncate()
+        self.__since_snapshot = 0
+
+    def write_snapshot(self, live: dict[str, dict]):
+        """Атомарная запись снимка через временный файл"""
+        tmp_path = f'{self.snapshot_path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'jobs': list(live.values())}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+    def __load_snapshot(self) -> dict[str, dict]:
+        """Чтение снимка состояния задач"""
+        if not os.path.isfile(self.snapshot_path):
+            return {}
+        with open(self.snapshot_path) as file:
+            return {
+                item['spec']['uid']: item for item in json.load(file)['jobs']
+            }
+
+    def load(self) -> dict[str, dict]:
+        """Метод читает снимок и журнал.
+        Возвращает состояние незавершенных задач по uid.
+        Описания задач разбираются только для незавершенных задач.
+        Оборванная последняя строка журнала пропускается"""
+        live = self.__load_snapshot()
+        if not os.path.isfile(self.path):
+            return live
+
+        raw_specs: dict[str, str] = {}
+        with open(self.path) as file:
+            for line in file:
+                if not line.endswith('\n'):
+                    logger.warning('journal %s has torn tail', self.path)
+                    break
+                event, uid, payload = line[:-1].split('\t', 2)
+                if event == 'add':
+                    if payload:
+                        raw_specs[uid] = payload
+                        live[uid] = {'spec': None, 'state': 'pending'}
+                elif event == 'start':
+                    if uid in live:
+                        live[uid]['state'] = 'running'
+                else:
+                    live.pop(uid, None)
+                    raw_specs.pop(uid, None)
+        for uid, payload in raw_specs.items():
+            live[uid]['spec'] = json.loads(payload)
+        return live
+
+    def recover(self) -> list[Job]:
+        """Метод восстанавливает незавершенные задачи.
+        Задачи создаются после своих зависимостей,
+        завершенные зависимости считаются выполненными"""
+        live = self.load()
+        jobs: dict[str, Job] = {}
+        skipped: set[str] = set()
+        for root in live:
+            stack = [(root, False)]
+            while stack:
+                uid, is_deps_ready = stack.pop()
+                if uid in jobs or uid in skipped or uid not in live:
+                    continue
+                spec = live[uid]['spec']
+                if not is_deps_ready:
+                    stack.append((uid, True))
+                    stack.extend(
+                        (dependency, False)
+                        for dependency in spec['dependencies']
+                    )
+                    continue
+                try:
+                    jobs[uid] = job_from_spec(spec, jobs)
+                except SpecError:
+                    skipped.add(uid)
+                    logger.exception('job %s can not be recovered', uid)
+        logger.info('recovered %s jobs from %s', len(jobs), self.path)
+        return list(jobs.values())
@@ -0,0 +1,216 @@
+"""Потоковое извлечение значений из json по путям"""
+from codecs import getincrementaldecoder
+from typing import Any, Iterable, Optional
+import json
+import re
+
+_STRING_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+_LITERAL_RE = re.compile(r'[^\s{}\[\]:,"]+')
+_SPACE_RE = re.compile(r'\s*')
+_OPEN = '{['
+_CLOSE = '}]'
+CHUNK_SIZE = 64 * 1024
+
+
+class JsonPathExtractor:
+    """Извлечение значений из json, поступающего частями.
+    spec задает имена результатов и пути к значениям через точку,
+    индексы массивов записываются числами: 'geo_object.country.name',
+    'forecasts.0.date'. Разбор идет по лексемам, в памяти хранится
+    только необработанный хвост данных и стек вложенности.
+    Поддеревья вне путей пропускаются, найденные поддеревья
+    собираются и разбираются json.loads. Разбор прекращается,
+    как только найдены все пути"""
+    def __init__(self, spec: dict[str, str]):
+        self.__names = {
+            tuple(path.split('.')) if path else (): name
+            for name, path in spec.items()
+        }
+        self.__prefixes = {
+            path[:i] for path in self.__names for i in range(len(path))
+        }
+        self.result: dict[str, Any] = {name: None for name in spec}
+        self.__found: set[str] = set()
+        self.__decoder = getincrementaldecoder('utf-8')()
+        self.__buffer = ''
+        self.__pos = 0
+        # кадр стека: [вид контейнера, ключ или индекс, состояние]
+        self.__stack: list[list] = []
+        self.__depth = 0
+        self.__capture: Optional[list[str]] = None
+        self.__capture_name = ''
+        self.__is_done = False
+
+    @property
+    def is_done(self) -> bool:
+        """Все пути найдены или json закончился"""
+        return self.__is_done or len(self.__found) == len(self.__names)
+
+    def feed(self, chunk: bytes, is_final: bool = False) -> bool:
+        """Метод разбирает очередную часть данных.
+        Возвращает True, когда разбор можно прекратить"""
+        if self.is_done:
+            return True
+        self.__buffer = (
+            self.__buffer[self.__pos:]
+            + self.__decoder.decode(chunk, final=is_final)
+        )
+        self.__pos = 0
+        while not self.is_done:
+            token = self.__next_token(is_final)
+            if token is None:
+                break
+            self.__on_token(token)
+        return self.is_done
+
+    def close(self) -> dict[str, Any]:
+        """Метод завершает разбор и возвращает найденные значения.
+        Не найденные пути имеют значение None"""
+        self.feed(b'', is_final=True)
+        return self.result
+
+    def __next_token(self, is_final: bool) -> Optional[str]:
+        """Следующая лексема или None, если данных пока не хватает"""
+        buffer = self.__buffer
+        pos = _SPACE_RE.match(buffer, self.__pos).end()
+        self.__pos = pos
+        if pos >= len(buffer):
+            return None
+        char = buffer[pos]
+        if char in '{}[]:,':
+            self.__pos = pos + 1
+            return char
+        if char == '"':
+            match = _STRING_RE.match(buffer, pos)
+        else:
+            match = _LITERAL_RE.match(buffer, pos)
+            if match is not None and match.end() == len(buffer) \
+                    and not is_final:
+                return None
+        if match is None:
+            if is_final:
+                raise ValueError(f'bad json near {buffer[pos:pos + 20]!r}')
+            return None
+        self.__pos = match.end()
+        return match.group()
+
+    def __path(self) -> tuple:
+        """Путь к текущему значению"""
+        return tuple(str(frame[1]) for frame in self.__stack)
+
+    def __on_token(self, token: str):
+        """Обработка лексемы в зависимости от состояния"""
+        if self.__depth:
+            self.__on_nested_token(token)
+            return
+        if not self.__stack:
+            self.__on_value(token)
+            return
+        frame = self.__stack[-1]
+        kind, _, state = frame
+        if token in _CLOSE:
+            self.__stack.pop()
+            self.__value_done()
+        elif state == 'key':
+            frame[1] = json.loads(token)
+            frame[2] = 'colon'
+        elif state == 'colon':
+            frame[2] = 'value'
+        elif state == 'comma':
+            if kind == 'arr':
+                frame[1] += 1
+                frame[2] = 'value'
+            else:
+                frame[2] = 'key'
+        else:
+            self.__on_value(token)
+
+    def __on_nested_token(self, token: str):
+        """Лексема внутри пропускаемого или собираемого поддерева"""
+        if self.__capture is not None:
+            self.__capture.append(token)
+        if token in _OPEN:
+            self.__depth += 1
+        elif token in _CLOSE:
+            self.__depth -= 1
+            if not self.__depth:
+                if self.__capture is not None:
+                    self.__store(self.__capture_name, ''.join(self.__capture))
+                    self.__capture = None
+                self.__value_done()
+
+    def __on_value(self, token: str):
+        """Начало значения: сбор, спуск внутрь или пропуск"""
+        path = self.__path()
+        name = self.__names.get(path)
+        if token in _OPEN:
+            if name is not None and name not in self.__found:
+                self.__capture = [token]
+                self.__capture_name = name
+                self.__depth = 1
+            elif path in self.__prefixes:
+                kind = 'obj' if token == '{' else 'arr'
+                self.__stack.append(
+                    [kind, 0, 'key' if kind == 'obj' else 'value']
+                )
+            else:
+                self.__depth = 1
+            return
+        if name is not None and name not in self.__found:
+            self.__store(name, token)
+        self.__value_done()
+
+    def __store(self, name: str, text: str):
+        """Сохранение найденного значения"""
+        self.result[name] = json.loads(text)
+        self.__found.add(name)
+
+    def __value_done(self):
+        """Значение закончилось: ждем запятую или конец контейнера"""
+        if self.__stack:
+            self.__stack[-1][2] = 'comma'
+        else:
+            self.__is_done = True
+
+
+def extract_paths(
+        chunks: Iterable[bytes], spec: dict[str, str]) -> dict[str, Any]:
+    """Функция извлекает значения по путям из частей json.
+    Части перестают читаться, как только найдены все пути"""
+    extractor = JsonPathExtractor(spec)
+    for chunk in chunks:
+        if extractor.feed(chunk):
+            return extractor.result
+    return extractor.close()
+
+
+def read_chunks(stream: Any, chunk_size: int = CHUNK_SIZE) -> Iterable[bytes]:
+    """Генератор частей потока с методом read"""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def extract_from_stream(
+        stream: Any, spec: dict[str, str],
+        chunk_size: int = CHUNK_SIZE) -> dict[str, Any]:
+    """Функция извлекает значения по путям, читая поток частями"""
+    return extract_paths(read_chunks(stream, chunk_size), spec)
+
+
+def extract_from_dict(data: Any, spec: dict[str, str]) -> dict[str, Any]:
+    """Функция извлекает значения по тем же путям
+    из уже разобранного json"""
+    result = {}
+    for name, path in spec.items():
+        value = data
+        try:
+            for key in path.split('.') if path else ():
+                value = value[int(key)] if isinstance(value, list) \
+                    else value[key]
+        except (KeyError, IndexError, ValueError, TypeError):
+            value = None
+        result[name] = value
+    return result
@@ -0,0 +1,268 @@
+"""Кэш результатов задач по отпечатку цели, аргументов
+и результатов зависимостей"""
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import sha256
+from threading import Lock
+from time import time
+from typing import Any, Callable, Iterable, NamedTuple, Optional, TextIO
+import logging
+import os
+import pickle
+import types
+
+from batch_writer import BatchWriter
+from data import Data
+
+logger = logging.getLogger(__name__)
+
+NO_VALUE_HASH = sha256(b'no value').hexdigest()
+
+
+class MemoEntry(NamedTuple):
+    """Запись кэша: результат успешной задачи и его хэш"""
+    value: Any
+    value_hash: str
+
+
+def _code_digest(code: types.CodeType, digest: Any):
+    """Добавление в хэш байткода, имен и констант функции
+    вместе с вложенными функциями"""
+    digest.update(code.co_code)
+    digest.update(repr((code.co_names, code.co_varnames)).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _code_digest(const, digest)
+        else:
+            digest.update(repr(const).encode())
+
+
+def target_id(target: Callable) -> str:
+    """Идентификатор цели: модуль, класс владельца, имя
+    и хэш кода. Изменение кода цели меняет идентификатор"""
+    owner = getattr(target, '__self__', None)
+    owner_type = None
+    if owner is not None and not isinstance(owner, types.ModuleType):
+        owner_type = type(owner)
+    return _function_id(getattr(target, '__func__', target), owner_type)
+
+
+@lru_cache(maxsize=1024)
+def _function_id(func: Callable, owner_type: Optional[type]) -> str:
+    """Идентификатор функции, вычисляется один раз на функцию"""
+    name = getattr(func, '__qualname__', repr(func))
+    if owner_type is not None:
+        name = f'{owner_type.__qualname__}.{getattr(func, "__name__", name)}'
+    digest = sha256(f'{getattr(func, "__module__", "")}:{name}'.encode())
+    code = getattr(func, '__code__', None)
+    if code is not None:
+        _code_digest(code, digest)
+    return digest.hexdigest()[:16]
+
+
+def value_hash(value: Any) -> str:
+    """Хэш результата задачи. Значение, которое нельзя
+    сериализовать, хэшируется по repr"""
+    if value is None:
+        return NO_VALUE_HASH
+    try:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        data = repr(value).encode()
+    return sha256(data).hexdigest()
+
+
+def fingerprint(
+        target: Callable, args: Any, dependency_hashes: Iterable[str],
+        extra: str = '') -> str:
+    """Отпечаток задачи: идентификатор цели, repr аргументов
+    и хэши результатов зависимостей. Ключ записи начинается
+    с идентификатора цели, чтобы записи цели можно было сбросить"""
+    digest = sha256(repr(args).encode())
+    for dependency_hash in dependency_hashes:
+        digest.update(dependency_hash.encode())
+    digest.update(extra.encode())
+    return f'{target_id(target)}-{digest.hexdigest()}'
+
+
+class MemoCache(BatchWriter):
+    """Кэш результатов успешных задач. Записи хранятся в памяти,
+    на диск изменения пишутся журналом (строки put и del)
+    фоновым потоком пачками, как в журнале планировщика.
+    Когда журнал разрастается, живые записи сохраняются в снимок,
+    а журнал обрезается. При первом обращении читается снимок
+    и поверх него журнал, дальше поиск идет только в памяти.
+    Записей не больше max_entries, давно не использованные
+    вытесняются; записи старше ttl секунд не используются
+    (ttl=None - без ограничения)"""
+    def __init__(
+            self, path: Optional[str] = None, max_entries: int = 100000,
+            ttl: Optional[float] = None, flush_interval: float = 0.05,
+            batch_size: int = 10000):
+
+        path = path or Data().memo_file
+        super().__init__(
+            path, flush_interval=flush_interval, batch_size=batch_size
+        )
+        self.snapshot_path = f'{path}.snapshot'
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.__entries: Optional[OrderedDict[str, tuple[float, str]]] = None
+        self.__since_snapshot = 0
+        self.__lock = Lock()
+
+    def __read(self, path: str, entries: OrderedDict[str, tuple[float, str]]):
+        """Чтение снимка или журнала в записи.
+        Оборванная последняя строка пропускается"""
+        if not os.path.isfile(path):
+            return
+        with open(path) as file:
+            for line in file:
+                if not line.endswith('\n'):
+                    logger.warning('memo cache %s has torn tail', path)
+                    break
+                event, key, *payload = line[:-1].split('\t')
+                entries.pop(key, None)
+                if event == 'put':
+                    entries[key] = (float(payload[0]), payload[1])
+
+    def __load(self) -> OrderedDict[str, tuple[float, str]]:
+        """Метод при первом обращении читает записи с диска
+        и запускает фоновую запись. Вызывается под блокировкой"""
+        if self.__entries is not None:
+            return self.__entries
+        entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self.__read(self.snapshot_path, entries)
+        self.__read(self.path, entries)
+        self.__entries = entries
+        self.__since_snapshot = len(entries)
+        self.start()
+        return entries
+
+    def get(self, key: str) -> Optional[MemoEntry]:
+        """Метод возвращает запись или None"""
+        with self.__lock:
+            entries = self.__load()
+            item = entries.get(key)
+            if item is None:
+                return None
+            stored_at, payload = item
+            is_expired = (
+                self.ttl is not None and time() - stored_at > self.ttl
+            )
+            if is_expired:
+                del entries[key]
+            else:
+                entries.move_to_end(key)
+        if is_expired:
+            self.write(('del', key))
+            return None
+        try:
+            return MemoEntry(*pickle.loads(b64decode(payload)))
+        except (pickle.UnpicklingError, EOFError, ValueError, TypeError):
+            logger.exception('can not load memo entry %s', key)
+            self.invalidate(key)
+            return None
+
+    def put(self, key: str, entry: MemoEntry):
+        """Метод сохраняет запись и вытесняет давно не использованные.
+        Запись, которую нельзя сериализовать, не сохраняется"""
+        try:
+            payload = b64encode(pickle.dumps(
+                tuple(entry), protocol=pickle.HIGHEST_PROTOCOL
+            )).decode()
+        except (pickle.PicklingError, TypeError, AttributeError):
+            logger.exception('can not memoize %s', key)
+            return
+        item = (time(), payload)
+        records: list[tuple] = [('put', key, item)]
+        with self.__lock:
+            entries = self.__load()
+            entries.pop(key, None)
+            entries[key] = item
+            while len(entries) > self.max_entries:
+                records.append(('del', entries.popitem(last=False)[0]))
+        self.__write_all(records)
+
+    def __write_all(self, records: list[tuple]):
+        """Запись изменений в журнал. Вызывается без блокировки:
+        фоновый поток берет ее при сжатии журнала"""
+        for record in records:
+            self.write(record)
+
+    def invalidate(self, key: str):
+        """Метод удаляет запись"""
+        with self.__lock:
+            is_found = self.__load().pop(key, None) is not None
+        if is_found:
+            self.write(('del', key))
+
+    def invalidate_target(self, target: Callable) -> int:
+        """Метод удаляет все записи цели.
+        Возвращает число удаленных записей"""
+        prefix = f'{target_id(target)}-'
+        with self.__lock:
+            entries = self.__load()
+            keys = [key for key in entries if key.startswith(prefix)]
+            for key in keys:
+                del entries[key]
+        self.__write_all([('del', key) for key in keys])
+        return len(keys)
+
+    def clear(self):
+        """Метод удаляет все записи"""
+        with self.__lock:
+            entries = self.__load()
+            keys = list(entries)
+            entries.clear()
+        self.__write_all([('del', key) for key in keys])
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return len(self.__load())
+
+    def _format(self, record: tuple) -> str:
+        """Строка журнала: событие, ключ и для put - время и данные"""
+        self.__since_snapshot += 1
+        if record[0] == 'put':
+            _, key, (stored_at, payload) = record
+            return f'put\t{key}\t{stored_at}\t{payload}\n'
+        return f'del\t{record[1]}\n'
+
+    def _after_commit(self, file: TextIO):
+        """Сжатие журнала, когда в нем вдвое больше строк,
+        чем живых записей: запись снимка и обрезка журнала"""
+        with self.__lock:
+            entries = self.__entries or OrderedDict()
+            if self.__since_snapshot < max(2 * len(entries), 1000):
+                return
+            lines = [
+                f'put\t{key}\t{stored_at}\t{payload}\n'
+                for key, (stored_at, payload) in entries.items()
+            ]
+            self.__since_snapshot = len(lines)
+        tmp_path = f'{self.snapshot_path}.tmp'
+        with open(tmp_path, 'w') as snapshot:
+            snapshot.write(''.join(lines))
+        os.replace(tmp_path, self.snapshot_path)
+        file.seek(0)
+        file.truncate()
+
+
+_default_cache: Optional[MemoCache] = None
+_default_cache_lock = Lock()
+
+
+def default_memo_cache() -> MemoCache:
+    """Общий кэш с настройками из Data"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            data = Data()
+            _default_cache = MemoCache(
+                data.memo_file,
+                max_entries=data.memo_max_entries,
+                ttl=data.memo_ttl,
+            )
+        return _default_cache
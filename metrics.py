@@ -0,0 +1,334 @@
+"""Счетчики и гистограммы времени задач с выгрузкой
+в текстовый формат Prometheus или json"""
+from bisect import bisect_left
+from threading import Event, Lock, Thread, current_thread, local
+from typing import Optional
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# границы корзин гистограмм в секундах: от 10 мкс до 5 минут
+DEFAULT_BUCKETS = (
+    0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05,
+    0.1, 0.5, 1.0, 5.0, 10.0, 60.0, 300.0,
+)
+
+Labels = tuple[tuple[str, ...], ...]
+
+
+class _Sharded:
+    """Значения метрики, разложенные по потокам.
+    Каждый поток пишет только в свою часть без блокировки,
+    блокировка берется только при появлении нового потока
+    и при чтении. Части завершившихся потоков складываются
+    в общую, чтобы эластичный пул не копил их бесконечно"""
+    def __init__(self, size: int):
+        self.__size = size
+        self.__base = [0] * size
+        self.__shards: list[tuple[Thread, list]] = []
+        self.__local = local()
+        self.__lock = Lock()
+
+    def _shard(self) -> list:
+        """Часть текущего потока"""
+        try:
+            return self.__local.shard
+        except AttributeError:
+            return self.__new_shard()
+
+    def __new_shard(self) -> list:
+        """Создание части для нового потока"""
+        shard = [0] * self.__size
+        with self.__lock:
+            self.__fold(lambda thread: not thread.is_alive())
+            self.__shards.append((current_thread(), shard))
+        self.__local.shard = shard
+        return shard
+
+    def __fold(self, is_done):
+        """Перенос частей завершившихся потоков в общую.
+        Вызывается под блокировкой"""
+        alive = []
+        for thread, shard in self.__shards:
+            if is_done(thread):
+                for index, value in enumerate(shard):
+                    self.__base[index] += value
+            else:
+                alive.append((thread, shard))
+        self.__shards = alive
+
+    def _total(self) -> list:
+        """Сумма частей всех потоков"""
+        with self.__lock:
+            self.__fold(lambda thread: not thread.is_alive())
+            total = list(self.__base)
+            for _, shard in self.__shards:
+                for index, value in enumerate(shard):
+                    total[index] += value
+        return total
+
+
+class Counter(_Sharded):
+    """Монотонный счетчик"""
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount: int = 1):
+        """Метод увеличивает счетчик"""
+        self._shard()[0] += amount
+
+    @property
+    def value(self) -> int:
+        """Значение счетчика"""
+        return self._total()[0]
+
+
+class Histogram(_Sharded):
+    """Гистограмма с фиксированными границами корзин.
+    Наблюдение - поиск корзины делением пополам и увеличение
+    счетчика корзины и суммы в части текущего потока"""
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        # счетчики корзин, последняя - больше всех границ, и сумма
+        super().__init__(len(buckets) + 2)
+        self.buckets = buckets
+
+    def observe(self, value: float):
+        """Метод добавляет наблюдение"""
+        shard = self._shard()
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def snapshot(self) -> dict:
+        """Снимок: число и сумма наблюдений
+        и накопленные счетчики по верхним границам корзин"""
+        *counts, total = self._total()
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip((*self.buckets, 'inf'), counts):
+            running += bucket_count
+            cumulative.append((bound, running))
+        return {'count': running, 'sum': total, 'buckets': cumulative}
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля верхней границей корзины,
+        None - если наблюдений нет"""
+        snapshot = self.snapshot()
+        if not snapshot['count']:
+            return None
+        rank = q * snapshot['count']
+        for bound, running in snapshot['buckets']:
+            if running >= rank:
+                return float(bound)
+        return float('inf')
+
+
+class JobMetrics:
+    """Метрики задач одной категории. Объекты метрик
+    берутся из набора один раз, событие - одно обращение к ним:
+    queue_wait - ожидание в очереди готовых задач планировщика,
+    start_delay - опоздание запуска относительно start_at
+    или, если задача стала готовой позже, относительно постановки
+    в очередь планировщика,
+    dependency_wait - ожидание завершения зависимостей,
+    try_seconds - время одной попытки,
+    retries - повторные попытки,
+    retries_denied - повторы, на которые не хватило бюджета,
+    succeeded, failed, memo_hits - итоги задач"""
+    def __init__(self, registry: 'MetricsRegistry', category: str):
+        self.queue_wait = registry.histogram(
+            'scheduler_queue_wait_seconds', category=category
+        )
+        self.start_delay = registry.histogram(
+            'job_start_delay_seconds', category=category
+        )
+        self.dependency_wait = registry.histogram(
+            'job_dependency_wait_seconds', category=category
+        )
+        self.try_seconds = registry.histogram(
+            'job_try_seconds', category=category
+        )
+        self.retries = registry.counter(
+            'job_retries_total', category=category
+        )
+        self.retries_denied = registry.counter(
+            'job_retries_denied_total', category=category
+        )
+        self.succeeded = registry.counter(
+            'job_results_total', category=category, result='success'
+        )
+        self.failed = registry.counter(
+            'job_results_total', category=category, result='fail'
+        )
+        self.memo_hits = registry.counter(
+            'job_results_total', category=category, result='memo'
+        )
+
+
+class MetricsRegistry:
+    """Набор метрик по имени и меткам.
+    Метрика создается при первом обращении. Задачи и планировщик
+    берут метрики категории через for_category"""
+    def __init__(self):
+        self.__counters: dict[tuple[str, Labels], Counter] = {}
+        self.__histograms: dict[tuple[str, Labels], Histogram] = {}
+        self.__categories: dict[str, JobMetrics] = {}
+        self.__lock = Lock()
+
+    def counter(self, name: str, **labels: str) -> Counter:
+        """Счетчик с именем и метками"""
+        key = (name, tuple(labels.items()))
+        metric = self.__counters.get(key)
+        if metric is None:
+            with self.__lock:
+                metric = self.__counters.setdefault(key, Counter())
+        return metric
+
+    def histogram(self, name: str, **labels: str) -> Histogram:
+        """Гистограмма с именем и метками"""
+        key = (name, tuple(labels.items()))
+        metric = self.__histograms.get(key)
+        if metric is None:
+            with self.__lock:
+                metric = self.__histograms.setdefault(key, Histogram())
+        return metric
+
+    def for_category(self, category: str) -> JobMetrics:
+        """Метрики задач категории"""
+        metrics = self.__categories.get(category)
+        if metrics is None:
+            metrics = JobMetrics(self, category)
+            with self.__lock:
+                metrics = self.__categories.setdefault(category, metrics)
+        return metrics
+
+    def __items(self) -> tuple[list, list]:
+        """Копия набора метрик"""
+        with self.__lock:
+            return (
+                sorted(self.__counters.items()),
+                sorted(self.__histograms.items()),
+            )
+
+    def snapshot(self) -> dict:
+        """Все метрики в виде словаря для json:
+        имя -> список значений с метками"""
+        counters, histograms = self.__items()
+        result: dict[str, list] = {}
+        for (name, labels), counter in counters:
+            result.setdefault(name, []).append(
+                {'labels': dict(labels), 'value': counter.value}
+            )
+        for (name, labels), histogram in histograms:
+            item = histogram.snapshot()
+            item['labels'] = dict(labels)
+            item['buckets'] = [
+                [str(bound), running] for bound, running in item['buckets']
+            ]
+            result.setdefault(name, []).append(item)
+        return result
+
+    def to_json(self) -> str:
+        """Выгрузка в json"""
+        return json.dumps(self.snapshot(), indent=1)
+
+    def to_prometheus(self) -> str:
+        """Выгрузка в текстовый формат Prometheus"""
+        counters, histograms = self.__items()
+        lines = []
+        typed: set[str] = set()
+        for (name, labels), counter in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{_format_labels(labels)} {counter.value}')
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            snapshot = histogram.snapshot()
+            for bound, running in snapshot['buckets']:
+                le = '+Inf' if bound == 'inf' else repr(bound)
+                bucket_labels = _format_labels((*labels, ('le', le)))
+                lines.append(f'{name}_bucket{bucket_labels} {running}')
+            suffix = _format_labels(labels)
+            lines.append(f'{name}_sum{suffix} {snapshot["sum"]}')
+            lines.append(f'{name}_count{suffix} {snapshot["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        """Атомарная запись метрик в файл: json для путей
+        с расширением .json, иначе формат Prometheus"""
+        if path.endswith('.json'):
+            text = self.to_json()
+        else:
+            text = self.to_prometheus()
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(text)
+        os.replace(tmp_path, path)
+
+
+def _format_labels(labels: Labels) -> str:
+    """Метки в формате Prometheus"""
+    if not labels:
+        return ''
+    pairs = ','.join(
+        f'{key}="{_escape(str(value))}"' for key, value in labels
+    )
+    return f'{{{pairs}}}'
+
+
+def _escape(value: str) -> str:
+    """Экранирование значения метки"""
+    return (
+        value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    )
+
+
+class MetricsExporter:
+    """Фоновый поток, периодически записывающий метрики в файл"""
+    def __init__(
+            self, registry: MetricsRegistry, path: str,
+            interval: float = 10.0):
+
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.__stop = Event()
+        self.__thread: Optional[Thread] = None
+
+    def start(self):
+        """Метод запускает фоновую выгрузку"""
+        if self.__thread is not None:
+            return
+        self.__stop.clear()
+        self.__thread = Thread(
+            target=self.__loop, name=f'MetricsExporter({self.path})',
+            daemon=True,
+        )
+        self.__thread.start()
+
+    def stop(self):
+        """Метод останавливает выгрузку, записав метрики
+        последний раз"""
+        if self.__thread is None:
+            return
+        self.__stop.set()
+        self.__thread.join()
+        self.__thread = None
+
+    def __loop(self):
+        """Цикл фонового потока"""
+        while True:
+            is_stop = self.__stop.wait(self.interval)
+            try:
+                self.registry.write(self.path)
+            except OSError:
+                logger.exception('can not write metrics to %s', self.path)
+            if is_stop:
+                return
+
+
+registry = MetricsRegistry()
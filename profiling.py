@@ -0,0 +1,288 @@
+"""Профилирование задач: время (cProfile) и память (tracemalloc)
+со сводными отчетами по целям задач"""
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Callable, Iterable, Iterator, Optional
+import cProfile
+import io
+import os
+import pstats
+import random
+import re
+import tracemalloc
+
+from data import Data
+
+# трассы самого профилировщика в отчет о памяти не попадают
+_MEMORY_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, pstats.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def target_name(target: Callable) -> str:
+    """Имя цели задачи для отчетов: модуль и полное имя"""
+    while hasattr(target, 'func'):
+        target = target.func  # functools.partial
+    func = getattr(target, '__func__', target)
+    module = getattr(func, '__module__', None) or ''
+    name = getattr(func, '__qualname__', None) or repr(func)
+    return f'{module}.{name}' if module else name
+
+
+class Allocations:
+    """Сводка памяти по цели: число прогонов, наибольший пик
+    и прирост памяти по строкам кода"""
+    def __init__(self):
+        self.runs = 0
+        self.peak = 0
+        self.lines: dict[str, list[int]] = {}
+
+    def add(self, stats: Iterable[tracemalloc.StatisticDiff], peak: int):
+        """Метод добавляет результат прогона"""
+        self.runs += 1
+        self.peak = max(self.peak, peak)
+        for stat in stats:
+            if not stat.size_diff and not stat.count_diff:
+                continue
+            frame = stat.traceback[0]
+            line = self.lines.setdefault(
+                f'{frame.filename}:{frame.lineno}', [0, 0]
+            )
+            line[0] += stat.size_diff
+            line[1] += stat.count_diff
+
+    def top(self, limit: int) -> list[tuple[str, int, int]]:
+        """Строки с наибольшим приростом памяти"""
+        lines = sorted(
+            self.lines.items(), key=lambda item: item[1][0], reverse=True
+        )
+        return [(line, size, count) for line, (size, count) in lines[:limit]]
+
+
+class Profiler:
+    """Профилировщик задач. Профилируются задачи с profile=True,
+    задачи категорий categories и случайная доля sample_rate
+    остальных задач. cpu - профиль времени cProfile,
+    memory - трассировка памяти tracemalloc на время прогона.
+    Профили прогонов одной цели складываются, write_reports
+    пишет в report_dir сводный профиль .prof по каждой цели,
+    отчет о горячих функциях hotspots.txt и о памяти
+    allocations.txt (top строк на цель).
+    Одновременно профилируется один прогон: и cProfile, и tracemalloc
+    не разделяют прогоны параллельных потоков, поэтому прогон,
+    начатый во время другого, выполняется без профиля (skipped).
+    Цель, выполняемая исполнителем process, в профиле времени
+    видна только как ожидание дочернего процесса"""
+    def __init__(
+            self, report_dir: Optional[str] = None, cpu: bool = True,
+            memory: bool = False, sample_rate: float = 0.0,
+            categories: Iterable[str] = (), top: int = 30,
+            frames: int = 1):
+
+        self.report_dir = report_dir or Data().profile_dir
+        self.cpu = cpu
+        self.memory = memory
+        self.sample_rate = sample_rate
+        self.categories = frozenset(categories)
+        self.top = top
+        self.frames = frames
+        self.skipped = 0
+        self.__stats: dict[str, pstats.Stats] = {}
+        self.__runs: dict[str, int] = {}
+        self.__allocations: dict[str, Allocations] = {}
+        self.__busy = Lock()
+        self.__lock = Lock()
+
+    def wants(self, category: str) -> bool:
+        """Профилировать ли задачу категории без явного profile"""
+        return category in self.categories or (
+            self.sample_rate > 0 and random.random() < self.sample_rate
+        )
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        """Профилирование одного прогона цели name"""
+        if not self.__busy.acquire(blocking=False):
+            with self.__lock:
+                self.skipped += 1
+            yield
+            return
+        try:
+            with self.__trace_memory(name), self.__trace_cpu(name):
+                yield
+        finally:
+            self.__busy.release()
+
+    @contextmanager
+    def __trace_cpu(self, name: str) -> Iterator[None]:
+        """Профиль времени прогона"""
+        if not self.cpu:
+            yield
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self.__lock:
+                self.__runs[name] = self.__runs.get(name, 0) + 1
+                stats = self.__stats.get(name)
+                if stats is None:
+                    self.__stats[name] = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+
+    @contextmanager
+    def __trace_memory(self, name: str) -> Iterator[None]:
+        """Трассировка памяти прогона. Если трассировка
+        не была включена, она включается только на время прогона"""
+        if not self.memory:
+            yield
+            return
+        is_started = not tracemalloc.is_tracing()
+        if is_started:
+            tracemalloc.start(self.frames)
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if is_started:
+                tracemalloc.stop()
+            diff = after.filter_traces(_MEMORY_FILTERS).compare_to(
+                before.filter_traces(_MEMORY_FILTERS), 'lineno'
+            )
+            with self.__lock:
+                self.__allocations.setdefault(name, Allocations()).add(
+                    diff, peak
+                )
+
+    def stats(self, name: str) -> Optional[pstats.Stats]:
+        """Сводный профиль времени цели"""
+        with self.__lock:
+            return self.__stats.get(name)
+
+    def allocations(self, name: str) -> Optional[Allocations]:
+        """Сводка памяти цели"""
+        with self.__lock:
+            return self.__allocations.get(name)
+
+    def write_reports(self) -> list[str]:
+        """Метод пишет отчеты в report_dir.
+        Возвращает пути записанных файлов"""
+        paths: list[str] = []
+        with self.__lock:
+            if not self.__stats and not self.__allocations:
+                return paths
+            os.makedirs(self.report_dir, exist_ok=True)
+            hotspots = []
+            for name, stats in sorted(self.__stats.items()):
+                path = os.path.join(
+                    self.report_dir, f'{_file_name(name)}.prof'
+                )
+                stats.dump_stats(path)
+                paths.append(path)
+                hotspots.append(
+                    self.__hotspots(name, self.__runs[name], stats)
+                )
+            allocations = [
+                self.__allocation_report(name, target_allocations)
+                for name, target_allocations
+                in sorted(self.__allocations.items())
+            ]
+        if hotspots:
+            paths.append(self.__write('hotspots.txt', hotspots))
+        if allocations:
+            paths.append(self.__write('allocations.txt', allocations))
+        return paths
+
+    def __write(self, file_name: str, sections: list[str]) -> str:
+        """Запись отчета из разделов по целям"""
+        path = os.path.join(self.report_dir, file_name)
+        with open(path, 'w') as file:
+            file.write('\n'.join(sections))
+        return path
+
+    def __hotspots(self, name: str, runs: int, stats: pstats.Stats) -> str:
+        """Раздел отчета о горячих функциях цели"""
+        stream = io.StringIO()
+        stats.stream = stream  # type: ignore
+        stats.sort_stats('tottime').print_stats(self.top)
+        return f'== {name}: {runs} runs ==\n{stream.getvalue()}'
+
+    def __allocation_report(self, name: str, allocations: Allocations) -> str:
+        """Раздел отчета о памяти цели"""
+        lines = [
+            f'== {name}: {allocations.runs} runs, '
+            f'peak {allocations.peak / 1024:.1f} KiB =='
+        ]
+        for line, size, count in allocations.top(self.top):
+            lines.append(f'{size / 1024:>12.1f} KiB {count:>8} blocks  {line}')
+        return '\n'.join(lines) + '\n'
+
+
+def _file_name(name: str) -> str:
+    """Имя файла отчета из имени цели"""
+    return re.sub(r'[^\w.-]', '_', name)
+
+
+_active: Optional[Profiler] = None
+_active_lock = Lock()
+
+
+def enable(profiler: Optional[Profiler] = None, **options: Any) -> Profiler:
+    """Функция включает профилирование задач.
+    Без profiler создается профилировщик с параметрами options"""
+    global _active
+    with _active_lock:
+        _active = profiler or Profiler(**options)
+        return _active
+
+
+def disable() -> list[str]:
+    """Функция выключает профилирование и пишет отчеты.
+    Возвращает пути записанных файлов"""
+    global _active
+    with _active_lock:
+        profiler, _active = _active, None
+    if profiler is None:
+        return []
+    return profiler.write_reports()
+
+
+def _default() -> Profiler:
+    """Включенный профилировщик, при выключенном профилировании
+    включается профилировщик с настройками по умолчанию"""
+    global _active
+    with _active_lock:
+        if _active is None:
+            _active = Profiler()
+        return _active
+
+
+def active() -> Optional[Profiler]:
+    """Включенный профилировщик или None"""
+    return _active
+
+
+def select(profile: Optional[bool], category: str) -> Optional[Profiler]:
+    """Профилировщик для прогона задачи или None.
+    profile=True - профилировать всегда (при выключенном
+    профилировании включается профилировщик по умолчанию),
+    False - никогда, None - по категории и доле выборки"""
+    if profile is False:
+        return None
+    profiler = _active
+    if profiler is None:
+        return _default() if profile else None
+    if profile or profiler.wants(category):
+        return profiler
+    return None
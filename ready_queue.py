@@ -0,0 +1,94 @@
+"""Очередь готовых к выполнению задач с приоритетами
+и квотами категорий"""
+from collections import Counter, deque
+from typing import Optional
+
+from job import Job
+
+
+class ReadyQueue:
+    """Очередь готовых задач планировщика.
+    Задачи разложены по уровням приоритета (меньшее значение -
+    более высокий приоритет) и внутри уровня по категориям.
+    Сначала обслуживается самый приоритетный уровень,
+    в котором есть задача категории, не выбравшей свою квоту
+    одновременно выполняемых задач (limits).
+    Внутри уровня категории делят потоки пропорционально весам
+    (weights): выбирается категория с наименьшим виртуальным временем,
+    которое растет на 1 / вес при каждой выдаче задачи.
+    Бросает ValueError, если вес категории не положительный"""
+    def __init__(
+            self, limits: Optional[dict[str, int]] = None,
+            weights: Optional[dict[str, float]] = None):
+
+        for category, weight in (weights or {}).items():
+            if not weight > 0:
+                raise ValueError(
+                    f'weight of category {category} must be positive, '
+                    f'got {weight}'
+                )
+        self.__limits = limits or {}
+        self.__weights = weights or {}
+        self.__levels: dict[int, dict[str, deque]] = {}
+        self.__running: Counter[str] = Counter()
+        self.__passes: dict[str, float] = {}
+        self.__virtual_time = 0.0
+        self.__size = 0
+
+    def __len__(self) -> int:
+        """Количество задач в очереди"""
+        return self.__size
+
+    def push(self, job: Job, enqueued_at: float):
+        """Метод добавляет задачу в очередь.
+        Категория, вернувшаяся после простоя, не получает
+        накопленного преимущества в виртуальном времени"""
+        categories = self.__levels.setdefault(job.priority, {})
+        queue = categories.get(job.category)
+        if queue is None:
+            queue = categories[job.category] = deque()
+        if not queue:
+            self.__passes[job.category] = max(
+                self.__passes.get(job.category, 0.0), self.__virtual_time
+            )
+        queue.append((enqueued_at, job))
+        self.__size += 1
+
+    def __is_allowed(self, category: str) -> bool:
+        """Проверка квоты категории"""
+        limit = self.__limits.get(category)
+        return limit is None or self.__running[category] < limit
+
+    def pop(self) -> Optional[tuple[float, Job]]:
+        """Метод выдает задачу и время её постановки в очередь.
+        Возвращает None, если все задачи в очереди упираются в квоты"""
+        for priority in sorted(self.__levels):
+            categories = self.__levels[priority]
+            allowed = [
+                category for category, queue in categories.items()
+                if queue and self.__is_allowed(category)
+            ]
+            if not allowed:
+                continue
+            category = min(allowed, key=self.__passes.__getitem__)
+            queue = categories[category]
+            item = queue.popleft()
+            if not queue:
+                del categories[category]
+                if not categories:
+                    del self.__levels[priority]
+            self.__virtual_time = self.__passes[category]
+            self.__passes[category] += 1 / self.__weights.get(category, 1)
+            self.__running[category] += 1
+            self.__size -= 1
+            return item
+        return None
+
+    def mark_running(self, job: Job):
+        """Метод учитывает задачу, запущенную в обход очереди"""
+        self.__running[job.category] += 1
+
+    def release(self, job: Job):
+        """Метод освобождает место в квоте категории
+        после завершения задачи"""
+        self.__running[job.category] -= 1
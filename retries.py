@@ -0,0 +1,45 @@
+"""Задержки повторных попыток и бюджет повторов"""
+import random
+
+from data import Data
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Задержка перед повтором после attempt-й неудачной попытки:
+    экспоненциальный рост от base до cap с разбросом.
+    Половина задержки гарантирована, вторая половина случайна,
+    чтобы повторы одновременно упавших задач не совпадали"""
+    delay = min(cap, base * 2 ** min(attempt - 1, 64))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class RetryBudget:
+    """Бюджет повторов категории задач.
+    Каждая новая задача пополняет бюджет на ratio, каждый повтор
+    забирает единицу; запас не больше max_tokens и в начале полон.
+    Когда бюджет исчерпан, повтор не выполняется и задача
+    завершается фейлом: во время сбоя повторы не умножают
+    нагрузку больше чем в 1 + ratio раз.
+    Вызывается под условной переменной планировщика"""
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self):
+        """Метод пополняет бюджет за новую задачу"""
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Метод забирает единицу на повтор.
+        Возвращает False, если бюджет исчерпан"""
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def default_budget() -> RetryBudget:
+    """Бюджет с настройками из Data"""
+    data = Data()
+    return RetryBudget(data.retry_budget_ratio, data.retry_budget_tokens)
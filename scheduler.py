@@ -1,85 +1,499 @@
 """Описание класса Scheduler"""
-from queue import Queue
-from threading import Thread
-import queue
-from time import sleep
+from threading import Thread, Condition, current_thread
+from time import monotonic, time
+import heapq
+from typing import Callable, Optional
 import logging
 
-from job import Job
-from settings_store import set_logging, clear_status_file, save_status
+from job import Job, mark_scheduler_worker
+from job_future import JobFuture
+from dag import JobGraph
+from ready_queue import ReadyQueue
+from journal import Journal
+from executors import INLINE, get_executor
+from metrics import MetricsExporter, MetricsRegistry, registry
+from retries import RetryBudget, backoff_delay, default_budget
+from data import Data
+from settings_store import save_status
 
-set_logging()
-clear_status_file()
+logger = logging.getLogger(__name__)
+
+IDLE_TIMEOUT = 2
+MAX_QUEUE_WAIT = 0.1
 
 
 class Scheduler:
     """Класс принимает аргументом
     количество одновременно выполняющихся задач.
+    Пул потоков эластичный: при запуске создается min_workers потоков,
+    новые потоки (до pool_size) добавляются, когда задач в очереди
+    больше, чем свободных потоков, или задача ждала в очереди дольше
+    max_queue_wait секунд. Поток сверх min_workers завершается,
+    если простаивал idle_timeout секунд. Задачи можно добавлять
+    в любой момент работы планировщика.
+    Готовые задачи выдаются по приоритету, внутри приоритета категории
+    делят потоки по весам category_weights, а число одновременно
+    выполняемых задач категории ограничено category_limits.
     Дополнительные поля:
-    очередь задач, потоки, статусы стоп и рестарт"""
-    def __init__(self, pool_size: int = 10):
+    очередь задач, куча таймеров отложенных задач,
+    потоки, статусы стоп и рестарт.
+    Потоки не спят между задачами: ожидание новой задачи,
+    команд стоп и рестарт построено на условной переменной.
+    Задача с будущим start_at лежит в куче таймеров и попадает
+    в очередь только когда наступило время её запуска.
+    Задача с незавершенными зависимостями ждет в графе зависимостей
+    и попадает в очередь по завершении последней из них.
+    Если передан журнал, переходы состояний задач записываются в него,
+    а метод recover восстанавливает незавершенные задачи.
+    executor - исполнитель для задач, у которых он не указан.
+    Планировщик и его задачи пишут время ожидания в очереди,
+    опоздания запуска, ожидания зависимостей, попыток и число
+    повторов в набор метрик metrics (по умолчанию общий), он же
+    доступен как scheduler.metrics. Если задан metrics_file,
+    пока планировщик работает, метрики раз в metrics_interval секунд
+    выгружаются в файл (json для .json, иначе формат Prometheus).
+    Повтор неудачной попытки не занимает поток: задача возвращается
+    в кучу таймеров с задержкой от retry_base_delay, удваивающейся
+    с каждой попыткой до retry_max_delay, со случайным разбросом.
+    Повторы категории ограничены бюджетом retry_budgets
+    (по умолчанию по настройкам Data): без бюджета задача
+    завершается фейлом после первой неудачной попытки"""
+    def __init__(
+            self, pool_size: int = 10,
+            journal: Optional[Journal] = None,
+            executor: str = INLINE,
+            min_workers: int = 1,
+            idle_timeout: float = IDLE_TIMEOUT,
+            max_queue_wait: float = MAX_QUEUE_WAIT,
+            category_limits: Optional[dict[str, int]] = None,
+            category_weights: Optional[dict[str, float]] = None,
+            metrics: Optional[MetricsRegistry] = None,
+            metrics_file: Optional[str] = None,
+            metrics_interval: Optional[float] = None,
+            retry_base_delay: Optional[float] = None,
+            retry_max_delay: Optional[float] = None,
+            retry_budgets: Optional[dict[str, RetryBudget]] = None):
 
         self.__pool_size = pool_size
-        self.__jobs_queue: Queue = Queue()
+        self.__min_workers = min(min_workers, pool_size)
+        self.__idle_timeout = idle_timeout
+        self.__max_queue_wait = max_queue_wait
+        self.__is_running = False
+        self.__idle_workers = 0
+        self.__jobs_queue = ReadyQueue(category_limits, category_weights)
+        self.__timers: list[tuple[float, int, Job]] = []
+        self.__timers_counter = 0
+        self.__graph = JobGraph()
+        self.__condition = Condition()
         self.__threads: list[Thread] = []
         self.__isStop = False
         self.__isRestart = False
+        self.__last_job: Optional[Job] = None
+        self.__helpers: set[Job] = set()
+        self.__in_progress = 0
+        self.__running: set[Job] = set()
+        self.__journal = journal
+        self.__executor = get_executor(executor).name
+        self.__metrics = registry if metrics is None else metrics
+        self.__waiting_since: dict[Job, float] = {}
+        self.__exporter: Optional[MetricsExporter] = None
+        data = Data()
+        self.__retry_base_delay = (
+            data.retry_base_delay if retry_base_delay is None
+            else retry_base_delay
+        )
+        self.__retry_max_delay = (
+            data.retry_max_delay if retry_max_delay is None
+            else retry_max_delay
+        )
+        self.__retry_budgets = dict(retry_budgets or {})
+        self.__retry_at: dict[Thread, list[tuple[float, Job]]] = {}
+        self.__deferred: dict[Job, list[JobFuture]] = {}
+        if metrics_file is not None:
+            self.__exporter = MetricsExporter(
+                self.__metrics, metrics_file,
+                metrics_interval or data.metrics_interval,
+            )
+        if journal is not None:
+            journal.start()
         save_status(
-            f'\n[NEW SCHEDULER: {self}]\n'
-            f'pool size = {self.__pool_size}\n'
+            '\n[NEW SCHEDULER: %s]\npool size = %s\n',
+            self, self.__pool_size,
         )
 
     def schedule(self, job: Job):
-        """Метод добавляет задачу в очередь"""
-        self.__jobs_queue.put(job)
-        save_status(f'add job {job} to scheduler {self}')
+        """Метод добавляет задачу в граф зависимостей.
+        Готовая задача сразу ставится в очередь
+        (или в кучу таймеров, если время запуска еще не наступило).
+        Бросает CycleError, если задача замыкает цикл зависимостей"""
+        if job.executor is None:
+            job.executor = self.__executor
+        job.spawn = self.__spawn
+        job.metrics = self.__metrics
+        job.retry = self.__retry
+        job.defer = self.__defer
+        with self.__condition:
+            self.__budget(job.category).deposit()
+            if self.__graph.add(job):
+                self.__enqueue(job)
+            else:
+                self.__waiting_since[job] = monotonic()
+        if self.__journal is not None:
+            self.__journal.record_add(job)
+        save_status('add job %s to scheduler %s', job, self)
+
+    def __spawn(self, make_helper: Callable[[], Job], count: int):
+        """Метод ставит в очередь помощников map-задачи, не больше,
+        чем потоков в пуле кроме потока самой задачи.
+        Помощники не попадают в граф зависимостей и журнал"""
+        count = min(count, self.__pool_size - 1)
+        helpers = [make_helper() for _ in range(count)]
+        with self.__condition:
+            for helper in helpers:
+                helper.metrics = self.__metrics
+                helper.ready_at = time()
+                self.__helpers.add(helper)
+                self.__push_ready(helper)
+            self.__condition.notify(count)
+
+    def __budget(self, category: str) -> RetryBudget:
+        """Бюджет повторов категории.
+        Вызывается под условной переменной"""
+        budget = self.__retry_budgets.get(category)
+        if budget is None:
+            budget = self.__retry_budgets[category] = default_budget()
+        return budget
+
+    def __retry(self, job: Job, attempt: int) -> bool:
+        """Метод откладывает повтор задачи после attempt-й
+        неудачной попытки, если бюджет категории позволяет.
+        Вызывается из потока планировщика. В кучу таймеров задача
+        попадает, когда поток закончит взятую задачу: так и повтор
+        зависимости, которую перезапустила взятая задача,
+        не начнется, пока поток ее не отпустит.
+        Возвращает False, если бюджет исчерпан"""
+        with self.__condition:
+            if not self.__budget(job.category).withdraw():
+                self.__metrics.for_category(job.category) \
+                    .retries_denied.inc()
+                logger.warning('retry budget of %s is exhausted', job)
+                return False
+            retry_at = time() + backoff_delay(
+                attempt, self.__retry_base_delay, self.__retry_max_delay
+            )
+            self.__retry_at.setdefault(current_thread(), []).append(
+                (retry_at, job)
+            )
+            return True
+
+    def __defer(self, job: Job, futures: list[JobFuture]):
+        """Метод откладывает задачу до завершения выполнений
+        futures (перезапущенных ею зависимостей): поток свободен,
+        а задача вернется в очередь, когда выполнения завершатся"""
+        with self.__condition:
+            self.__deferred[job] = futures
+
+    def __resume(self, job: Job, futures: list[JobFuture]):
+        """Метод возвращает отложенную задачу в очередь,
+        когда все выполнения futures завершатся"""
+        pending = [future for future in futures if not future.done()]
+        if pending:
+            pending[0].add_done_callback(
+                lambda _future: self.__resume(job, pending)
+            )
+            return
+        with self.__condition:
+            job.ready_at = time()
+            self.__push_ready(job)
+            self.__condition.notify()
+
+    def recover(self) -> list[Job]:
+        """Метод восстанавливает из журнала задачи, которые
+        не завершились до остановки, и добавляет их в планировщик"""
+        if self.__journal is None:
+            return []
+        jobs = self.__journal.recover()
+        for job in jobs:
+            self.schedule(job)
+        save_status('scheduler %s recovered %s jobs', self, len(jobs))
+        return jobs
+
+    def __enqueue(self, job: Job):
+        """Метод ставит задачу, у которой выполнены зависимости,
+        в очередь или кучу таймеров и будит один из ожидающих потоков.
+        Вызывается под условной переменной"""
+        job.ready_at = time()
+        start_at = job.start_at.timestamp()
+        if start_at > job.ready_at:
+            self.__push_timer(start_at, job)
+        else:
+            self.__push_ready(job)
+        self.__condition.notify()
+
+    def __push_timer(self, when: float, job: Job):
+        """Метод кладет задачу в кучу таймеров и запускает поток,
+        если ни одного нет: иначе за кучей некому следить.
+        Вызывается под условной переменной"""
+        self.__timers_counter += 1
+        heapq.heappush(self.__timers, (when, self.__timers_counter, job))
+        if not self.__threads:
+            self.__add_worker()
+
+    def __push_ready(self, job: Job):
+        """Метод ставит готовую задачу в очередь и добавляет поток,
+        если задач в очереди больше, чем свободных потоков.
+        Вызывается под условной переменной"""
+        self.__jobs_queue.push(job, monotonic())
+        if len(self.__jobs_queue) > self.__idle_workers:
+            self.__add_worker()
+
+    def __add_worker(self):
+        """Метод запускает новый поток, если планировщик работает
+        и размер пула позволяет. Вызывается под условной переменной"""
+        if not self.__is_running or self.__isStop:
+            return
+        if len(self.__threads) >= self.__pool_size:
+            return
+        thread = Thread(target=self.__get_job_from_queue)
+        self.__threads.append(thread)
+        thread.start()
+
+    def __remove_worker(self):
+        """Метод убирает завершающийся поток из пула.
+        Вызывается под условной переменной"""
+        self.__threads.remove(current_thread())
+
+    def __release_due_timers(self) -> Optional[float]:
+        """Метод переносит в очередь задачи, время запуска
+        которых наступило. Вызывается под условной переменной.
+        Возвращает время до ближайшего таймера или None"""
+        now = time()
+        while self.__timers and self.__timers[0][0] <= now:
+            _, _, job = heapq.heappop(self.__timers)
+            self.__push_ready(job)
+        if self.__timers:
+            return self.__timers[0][0] - now
+        return None
+
+    def __take_job(self) -> Optional[Job]:
+        """Метод ожидает задачу для потока.
+        Команда рестарт имеет приоритет: поток повторно
+        выполняет последнюю завершенную задачу.
+        Возвращает None, если получена команда стоп
+        или поток простаивал дольше idle_timeout секунд"""
+        with self.__condition:
+            idle_since = monotonic()
+            while not self.__isStop:
+                if self.__isRestart and self.__last_job is not None:
+                    self.__isRestart = False
+                    job = self.__last_job
+                    logger.info('restart %s', job)
+                    save_status('scheduler %s restart job %s', self, job)
+                    job.ready_at = time()
+                    self.__jobs_queue.mark_running(job)
+                    self.__in_progress += 1
+                    self.__running.add(job)
+                    return job
+                next_timer = self.__release_due_timers()
+                item = self.__jobs_queue.pop()
+                if item is not None:
+                    enqueued_at, job = item
+                    waited = monotonic() - enqueued_at
+                    self.__metrics.for_category(job.category) \
+                        .queue_wait.observe(waited)
+                    if waited > self.__max_queue_wait:
+                        self.__add_worker()
+                    self.__in_progress += 1
+                    self.__running.add(job)
+                    return job
+
+                timeout = self.__idle_wait(idle_since, next_timer)
+                if timeout is not None and timeout <= 0:
+                    save_status('jobs queue is empty')
+                    break
+                self.__idle_workers += 1
+                self.__condition.wait(timeout)
+                self.__idle_workers -= 1
+            return None
+
+    def __idle_wait(
+            self, idle_since: float,
+            next_timer: Optional[float]) -> Optional[float]:
+        """Метод вычисляет, сколько свободному потоку ждать.
+        Поток может завершиться, если потоков больше min_workers
+        и он не последний, кто следит за кучей таймеров.
+        Неположительное значение означает, что поток завершается,
+        None - ждать без ограничения"""
+        can_shrink = (
+            len(self.__threads) > self.__min_workers
+            and not (next_timer is not None and len(self.__threads) == 1)
+        )
+        if not can_shrink:
+            return next_timer
+        remaining = idle_since + self.__idle_timeout - monotonic()
+        if next_timer is None:
+            return remaining
+        return min(remaining, next_timer)
+
+    def __finish_job(self, job: Job):
+        """Метод отмечает завершение задачи потоком,
+        отдает в очередь задачи, дождавшиеся зависимостей,
+        и будит ожидающих join и рестарт.
+        Незавершенные задачи с повторами, отложенными потоком
+        (взятая задача и перезапущенные ею зависимости), уходят
+        в кучу таймеров. Взятая задача, отложенная до завершения
+        перезапущенных зависимостей, вернется в очередь после них"""
+        with self.__condition:
+            self.__in_progress -= 1
+            self.__running.discard(job)
+            self.__jobs_queue.release(job)
+            for retry_at, parked in self.__retry_at.pop(current_thread(), ()):
+                if not parked.is_end:
+                    self.__push_timer(retry_at, parked)
+            deferred = self.__deferred.pop(job, None)
+            if job.is_end:
+                self.__complete(job)
+            self.__condition.notify_all()
+        if deferred is not None and not job.is_end:
+            self.__resume(job, deferred)
+
+    def __complete(self, job: Job):
+        """Метод отдает в очередь задачи, дождавшиеся
+        завершенной задачи. Вызывается под условной переменной"""
+        if job in self.__helpers:
+            self.__helpers.discard(job)
+        else:
+            self.__last_job = job
+        for dependent in self.__graph.complete(job):
+            self.__observe_dependency_wait(dependent)
+            self.__enqueue(dependent)
+
+    def __observe_dependency_wait(self, job: Job):
+        """Метод записывает в метрики, сколько задача ждала
+        зависимостей в графе. Вызывается под условной переменной"""
+        since = self.__waiting_since.pop(job, None)
+        if since is not None:
+            self.__metrics.for_category(job.category) \
+                .dependency_wait.observe(monotonic() - since)
 
     def __get_job_from_queue(self):
         """Пока не получена команда остановиться
         и не опустела очередь задач метод
-        запускает задачи, все время проверяя состояние
-        статусов стоп и рестарт.
+        запускает задачи.
         В случае рестарта перезапускается последняя выполененная задача
-        и выполнение продолжается"""
-        while not self.__isStop:
-            try:
-                job = self.__jobs_queue.get(timeout=2)
-                job.run()
-                save_status(f'scheduler {self} run job {job}')
-
-                if not self.__isRestart:
-                    sleep(3)
-                if self.__isRestart:
-                    logging.info(f'restart {job}')
-                    save_status(f'scheduler {self} restart job {job}')
-                    job.run()
-                    self.__isRestart = False
+        и выполнение продолжается.
+        Завершающийся по любой причине поток убирается из пула,
+        чтобы на его место мог встать новый"""
+        mark_scheduler_worker()
+        try:
+            while True:
+                job = self.__take_job()
+                if job is None:
+                    break
+                self.__run_job(job)
 
-                if not self.__isStop:
-                    sleep(3)
                 if self.__isStop:
-                    logging.info(f'stoped after {job}')
-                    save_status('scheduler {self} stop job {job}')
+                    logger.info('stoped after %s', job)
+                    save_status('scheduler %s stop job %s', self, job)
+        finally:
+            with self.__condition:
+                self.__remove_worker()
 
-            except queue.Empty:
-                save_status('jobs queue is empty')
-                break
+    def __run_job(self, job: Job):
+        """Метод выполняет взятую задачу. Исключение задачи
+        пишется в лог и не завершает поток"""
+        journal = None if job in self.__helpers else self.__journal
+        if journal is not None:
+            journal.record_start(job)
+        try:
+            job.run()
+            save_status('scheduler %s run job %s', self, job)
+        except Exception:
+            logger.exception('job %s raised an exception', job)
+        finally:
+            if journal is not None and job.is_end \
+                    and not job.cancel_token.is_cancelled:
+                journal.record_end(job)
+            self.__finish_job(job)
 
     def run(self):
         """Метод запуска планировщика.
-        Создается и запускается пул потоков,
-        которые разбирают задачи из очереди"""
-        for _ in range(self.__pool_size):
-            thread = Thread(target=self.__get_job_from_queue)
+        Запускается min_workers потоков и еще столько,
+        сколько нужно для уже стоящих в очереди задач,
+        но не меньше одного, если есть отложенные задачи"""
+        with self.__condition:
+            self.__is_running = True
+            workers = max(
+                self.__min_workers, len(self.__jobs_queue),
+                1 if self.__timers else 0,
+            )
+            for _ in range(min(workers, self.__pool_size)):
+                self.__add_worker()
+        if self.__exporter is not None:
+            self.__exporter.start()
+
+    @property
+    def metrics(self) -> MetricsRegistry:
+        """Набор метрик планировщика и его задач"""
+        return self.__metrics
 
-            self.__threads.append(thread)
-        for thread in self.__threads:
-            thread.start()
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Метод ожидает, пока очередь опустеет
+        и все взятые задачи завершатся.
+        Возвращает False, если истек timeout"""
+        with self.__condition:
+            return self.__condition.wait_for(
+                lambda: (
+                    (not (self.__jobs_queue or self.__timers
+                          or len(self.__graph))
+                     or self.__isStop)
+                    and not self.__in_progress
+                    and not (self.__isRestart and self.__last_job)
+                ),
+                timeout,
+            )
 
     def restart(self):
-        """Метод меняющий статус планировщика на рестарт"""
-        self.__isRestart = True
+        """Метод меняющий статус планировщика на рестарт.
+        Свободный поток сразу повторяет последнюю завершенную задачу"""
+        with self.__condition:
+            self.__isRestart = True
+            if not self.__idle_workers:
+                self.__add_worker()
+            self.__condition.notify()
 
-    def stop(self):
-        """Метод меняющий статус планировщика на стоп"""
-        self.__isStop = True
+    def stop(
+            self, drain: bool = False,
+            deadline: Optional[float] = None) -> bool:
+        """Метод меняющий статус планировщика на стоп.
+        Новые задачи не берутся, ожидающие потоки просыпаются
+        и завершаются сразу. Выполняемые задачи отменяются:
+        сразу или, если drain, когда истекут deadline секунд
+        (по умолчанию stop_deadline из Data), отведенные
+        на их завершение. Отмененные задачи ждутся не дольше
+        stop_grace секунд, так что остановка занимает ограниченное
+        время. Журнал дописывается на диск: невыполненные
+        и отмененные задачи остаются в нем незавершенными
+        и восстанавливаются recover. Метрики выгружаются
+        в файл последний раз.
+        Возвращает False, если задачи не завершились в срок"""
+        data = Data()
+        with self.__condition:
+            self.__isStop = True
+            self.__condition.notify_all()
+            if drain:
+                self.__condition.wait_for(
+                    lambda: not self.__in_progress,
+                    data.stop_deadline if deadline is None else deadline,
+                )
+            for job in self.__running:
+                logger.info('cancel %s', job)
+                job.stop()
+            is_stopped = self.__condition.wait_for(
+                lambda: not self.__in_progress, data.stop_grace
+            )
+        if self.__journal is not None:
+            self.__journal.flush()
+        if self.__exporter is not None:
+            self.__exporter.stop()
+        return is_stopped
@@ -1,28 +1,237 @@
-"""Функции для настройки логировани и сохранения статусов"""
-import logging
-
-from data import Data
-
-STATUS_FILE = Data().status_file
-
-
-def set_logging():
-    """Устанавливает настройки логирования"""
-    logging.basicConfig(
-        level=logging.DEBUG,
-        filename=Data().logging_file,
-        filemode='w',
-        format='%(asctime)s: %(name)s - %(levelname)s - %(message)s'
-    )
-
-
-def clear_status_file():
-    """Очищает хранилище статусов и пишет в него хэдер"""
-    with open(STATUS_FILE, 'w') as file:
-        file.write('\t\t____STATUSES____\t\t')
-
-
-def save_status(status: str):
-    """Сохраняет заданный статус в файл"""
-    with open(STATUS_FILE, 'a') as file:
-        file.write(f'{status}\n')
+"""Функции для настройки логировани и сохранения статусов"""
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from threading import Lock
+from time import monotonic
+from typing import Any, Optional
+import atexit
+import logging
+import os
+
+from batch_writer import BatchWriter
+from data import Data
+
+STATUS_FILE = Data().status_file
+LOG_FORMAT = '%(asctime)s: %(name)s - %(levelname)s - %(message)s'
+# аргументы этих типов не меняются, и сообщение можно собрать позже
+_IMMUTABLE = (str, int, float, bool, bytes, type(None))
+
+
+class StatusWriter(BatchWriter):
+    """Фоновая запись статусов в хранилище статусов.
+    Запись статуса - шаблон и аргументы, строка собирается
+    в фоновом потоке при записи пачки"""
+    def _format(self, record: Any) -> str:
+        status, args = record
+        if args:
+            try:
+                status = status % args
+            except (TypeError, ValueError):
+                status = f'{status} {args}'
+        return f'{status}\n'
+
+
+_status_writer: Optional[StatusWriter] = None
+_status_lock = Lock()
+
+
+def _get_status_writer() -> StatusWriter:
+    """Возвращает запущенный писатель статусов,
+    при первом обращении создает его"""
+    global _status_writer
+    writer = _status_writer
+    if writer is not None:
+        return writer
+    with _status_lock:
+        if _status_writer is None:
+            data = Data()
+            _status_writer = StatusWriter(
+                STATUS_FILE,
+                flush_interval=data.status_flush_interval,
+                batch_size=data.status_batch_size,
+                buffer_size=data.status_buffer_size,
+            )
+            _status_writer.start()
+        return _status_writer
+
+
+def _reset_after_fork():
+    """В дочернем процессе фоновый поток записи не существует,
+    поэтому писатель статусов создается заново"""
+    global _status_writer, _status_lock
+    _status_writer = None
+    _status_lock = Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _is_immutable(arg: Any) -> bool:
+    """Аргумент сообщения, значение которого не изменится
+    до записи: неизменяемый тип или объект со стандартным repr"""
+    if isinstance(arg, _IMMUTABLE):
+        return True
+    arg_type = type(arg)
+    return (
+        arg_type.__repr__ is object.__repr__
+        and arg_type.__str__ is object.__str__
+    )
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Обработчик, который ставит запись в очередь без форматирования:
+    сообщение собирается из шаблона и аргументов в фоновом потоке.
+    Сообщение с изменяемыми аргументами собирается сразу,
+    чтобы в лог попали значения на момент вызова"""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if args and (
+                isinstance(args, dict)
+                or not all(_is_immutable(arg) for arg in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+_log_handlers: list[logging.Handler] = []
+_queue_handler: Optional[DeferredQueueHandler] = None
+_listener: Optional[QueueListener] = None
+_log_lock = Lock()
+
+
+def set_logging(
+        level: Optional[str] = None,
+        levels: Optional[dict[str, str]] = None,
+        append: bool = False):
+    """Устанавливает настройки логирования.
+    Записи ставятся в очередь, в файл их пишет фоновый поток,
+    поэтому потоки задач не ждут файловый обработчик.
+    level - уровень корневого логгера, levels - уровни логгеров
+    модулей по имени (по умолчанию - из Data).
+    append - дописывать файл лога, а не начинать заново
+    (так пишут процессы, запущенные другим процессом).
+    Повторный вызов меняет только уровни"""
+    global _queue_handler, _listener
+    data = Data()
+    with _log_lock:
+        if not _log_handlers:
+            handler = logging.FileHandler(
+                data.logging_file, mode='a' if append else 'w'
+            )
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            _log_handlers.append(handler)
+            log_queue: SimpleQueue = SimpleQueue()
+            _queue_handler = DeferredQueueHandler(log_queue)
+            _listener = QueueListener(
+                log_queue, *_log_handlers, respect_handler_level=True
+            )
+            _listener.start()
+            logging.getLogger().addHandler(_queue_handler)
+        logging.getLogger().setLevel(level or data.logging_level)
+        for name, module_level in {
+                **data.logging_levels, **(levels or {})}.items():
+            logging.getLogger(name).setLevel(module_level)
+
+
+@atexit.register
+def stop_logging():
+    """Дописывает записи из очереди в файл
+    и останавливает фоновый поток логирования"""
+    global _listener
+    with _log_lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def _log_directly_after_fork():
+    """В дочернем процессе фонового потока логирования нет,
+    и процесс может завершиться без atexit, поэтому записи
+    пишутся в файл напрямую"""
+    global _listener
+    if _queue_handler is None or _listener is None:
+        return
+    _listener = None
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    for handler in _log_handlers:
+        root.addHandler(handler)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_log_directly_after_fork)
+
+
+class LogSampler:
+    """Ограничение частоты однотипных сообщений (по элементу,
+    по аргументу задачи): не больше rate сообщений в секунду,
+    подряд - не больше burst. Число пропущенных сообщений
+    добавляется к следующему записанному.
+    Сообщение отключенного уровня не стоит ничего"""
+    def __init__(
+            self, rate: Optional[float] = None,
+            burst: Optional[int] = None):
+
+        data = Data()
+        self.rate = data.log_sample_rate if rate is None else rate
+        self.burst = data.log_sample_burst if burst is None else burst
+        self.__tokens = float(self.burst)
+        self.__updated = monotonic()
+        self.__suppressed = 0
+        self.__lock = Lock()
+
+    def log(
+            self, logger: logging.Logger, level: int, msg: str,
+            *args: Any, **kwargs: Any):
+        """Метод пишет сообщение, если не превышена частота"""
+        if not logger.isEnabledFor(level):
+            return
+        with self.__lock:
+            now = monotonic()
+            self.__tokens = min(
+                self.burst, self.__tokens + (now - self.__updated) * self.rate
+            )
+            self.__updated = now
+            if self.__tokens < 1:
+                self.__suppressed += 1
+                return
+            self.__tokens -= 1
+            suppressed, self.__suppressed = self.__suppressed, 0
+        if suppressed:
+            msg = f'{msg} (%s similar messages suppressed)'
+            args = (*args, suppressed)
+        logger.log(level, msg, *args, **kwargs)
+
+
+def flush_statuses(timeout: Optional[float] = None) -> bool:
+    """Дожидается записи всех сохраненных статусов"""
+    writer = _status_writer
+    if writer is None:
+        return True
+    return writer.flush(timeout)
+
+
+@atexit.register
+def close_status_file():
+    """Дописывает сохраненные статусы и останавливает
+    фоновую запись"""
+    global _status_writer
+    with _status_lock:
+        if _status_writer is not None:
+            _status_writer.close()
+            _status_writer = None
+
+
+def clear_status_file():
+    """Очищает хранилище статусов и пишет в него хэдер"""
+    close_status_file()
+    with open(STATUS_FILE, 'w') as file:
+        file.write('\t\t____STATUSES____\t\t')
+
+
+def save_status(status: str, *args: Any):
+    """Сохраняет заданный статус в файл.
+    Статус ставится в очередь фоновой записи, аргументы
+    подставляются в шаблон через % уже при записи"""
+    _get_status_writer().write((status, args))
@@ -1,14 +1,191 @@
 """Тесты работы задач"""
 import unittest
+from unittest import mock
+import json
+import logging
+from queue import SimpleQueue
 import os.path
+import tempfile
+from time import monotonic, sleep
+from threading import Thread, Lock, current_thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta
+from uuid import uuid4
 
 from job import Job
 from job_types import (
     JobWithFiles,
     JobWithFS,
+    JobWithNet,
+    run_command,
 )
 
-from settings_store import set_logging, clear_status_file
+from scheduler import Scheduler
+from dag import JobGraph, CycleError
+from ready_queue import ReadyQueue
+from journal import Journal
+from job_spec import SpecError, job_from_spec, job_to_spec
+from timeouts import job_deadline
+from http_pool import ConnectionPool
+from http_cache import ResponseCache
+from json_stream import (
+    extract_from_dict,
+    extract_from_stream,
+    extract_paths,
+)
+from artifacts import ArtifactStore
+from memo_cache import MemoCache
+from metrics import MetricsRegistry
+from retries import RetryBudget, backoff_delay
+from job_future import JobFailed
+from job_queue import FileJobQueue, run_workers
+from benchmark import compare, measure
+from profiling import Profiler
+import fs_backend
+import profiling
+from settings_store import (
+    DeferredQueueHandler,
+    LogSampler,
+    set_logging,
+    clear_status_file,
+    save_status,
+    flush_statuses,
+    STATUS_FILE,
+)
+
+
+def noop(_arg):
+    """Пустая задача для тестов планировщика"""
+    return ('success', 0)
+
+
+def failing(_arg):
+    """Задача, которая всегда завершается фейлом"""
+    return ('fail', 1)
+
+
+def flaky(attempts):
+    """Задача, которая завершается успехом с третьей попытки"""
+    attempts.append(monotonic())
+    return ('success', 0) if len(attempts) > 2 else ('fail', 1)
+
+
+def failing_counted(attempts):
+    """Задача, которая всегда завершается фейлом
+    и запоминает свои попытки"""
+    attempts.append(monotonic())
+    return ('fail', 1)
+
+
+def fails_once(calls):
+    """Задача, которая завершается фейлом только при первом вызове"""
+    calls.append(current_thread())
+    sleep(0.05)
+    return ('success', 0) if len(calls) > 1 else ('fail', 1)
+
+
+def raising(_arg):
+    """Задача, которая бросает исключение"""
+    raise RuntimeError('broken job')
+
+
+def sleepy(seconds):
+    """Зависающая задача для тестов таймаутов"""
+    sleep(seconds)
+    return ('success', 0)
+
+
+def slow_items(count):
+    """Задача-генератор, выдающая элементы раз в 0.1 секунды"""
+    for num in range(count):
+        sleep(0.1)
+        yield num
+
+
+def record_pid(path):
+    """Задача записывает номер процесса, в котором выполнилась"""
+    with open(path, 'w') as file:
+        file.write(str(os.getpid()))
+    return ('success', 0)
+
+
+class HangingHandler(BaseHTTPRequestHandler):
+    """Сервер, который отдает заголовки и зависает на теле ответа"""
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '100')
+        self.end_headers()
+        self.wfile.flush()
+        sleep(3)
+
+    def log_message(self, *args):
+        pass
+
+
+class CityHandler(BaseHTTPRequestHandler):
+    """Keep-alive сервер, отдающий json города.
+    Запоминает порты клиентов, чтобы считать соединения"""
+    protocol_version = 'HTTP/1.1'
+    client_ports: set = set()
+    delay = 0.0
+    padding = 0
+
+    def do_GET(self):
+        CityHandler.client_ports.add(self.client_address[1])
+        sleep(self.delay)
+        body = (
+            '{"geo_object": {"locality": {"name": "Testcity"}, '
+            '"country": {"name": "Testland"}}' + ' ' * self.padding + '}'
+        ).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ETagHandler(BaseHTTPRequestHandler):
+    """Сервер с ETag: на совпадающий If-None-Match отвечает 304"""
+    protocol_version = 'HTTP/1.1'
+    statuses: list = []
+
+    def do_GET(self):
+        etag = f'"{self.path}"'
+        if self.headers.get('If-None-Match') == etag:
+            ETagHandler.statuses.append(304)
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        ETagHandler.statuses.append(200)
+        body = self.path.encode() * 100
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(handler):
+    """Запуск локального HTTP-сервера в фоновом потоке.
+    Возвращает сервер и его базовый URL"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def stop_server(server):
+    """Остановка локального HTTP-сервера"""
+    server.shutdown()
+    server.server_close()
 
 
 class AppTest(unittest.TestCase):
@@ -39,6 +216,38 @@ class AppTest(unittest.TestCase):
             text = file.read()
         self.assertEqual(data, text)
 
+    def test_job_with_files_chunked_write_and_read(self):
+        """Тест: потоковая запись частями и чтение файла
+        двоичными частями и срезами mmap"""
+        job_with_files = JobWithFiles()
+        chunks = [bytes([i]) * 1000 for i in range(100)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'chunks.bin')
+            self.assertEqual(
+                job_with_files.write_file(
+                    file_name, iter(chunks), 'wb', 4096
+                ),
+                ('success', 0),
+            )
+            binary = list(
+                job_with_files.read_file(file_name, 'binary', 4096)
+            )
+            self.assertEqual(len(binary), 25)
+            self.assertEqual(b''.join(binary), b''.join(chunks))
+
+            mapped = b''
+            for view in job_with_files.read_file(file_name, 'mmap', 4096):
+                self.assertIsInstance(view, memoryview)
+                mapped += view
+            self.assertEqual(mapped, b''.join(chunks))
+
+            read = Job(
+                target=job_with_files.read_file,
+                args=((file_name, 'mmap', 4096),),
+            )
+            read.run()
+            self.assertTrue(read.is_successful)
+
     def test_job_with_fs_create_file(self):
         """Тест для проверки ФС-задачи создания файла"""
         file_name = 'fs_job_file.txt'
@@ -69,6 +278,1264 @@ class AppTest(unittest.TestCase):
         delete_job.run()
         self.assertFalse(os.path.exists(file))
 
+    def test_job_with_fs_bulk_create_and_delete(self):
+        """Тест: пакетное создание 10 тысяч файлов и удаление
+        директории выполняются в процессе, без запуска команд"""
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch('subprocess.Popen') as popen:
+            root = os.path.join(tmp_dir, 'bulk')
+            dirs = [root] + [os.path.join(root, str(i)) for i in range(10)]
+            files = [
+                os.path.join(dirs[1 + i % 10], f'{i}.txt')
+                for i in range(10000)
+            ]
+            job_with_fs = JobWithFS()
+            self.assertEqual(job_with_fs.create_dirs(dirs), ('success', 0))
+            self.assertEqual(job_with_fs.create_files(files), ('success', 0))
+            self.assertEqual(
+                sum(len(os.listdir(dirname)) for dirname in dirs[1:]), 10000
+            )
+
+            output, ret_code = job_with_fs.create_files(files[:1] + [root])
+            self.assertEqual(ret_code, 1)
+            self.assertEqual(output.count('is already exist'), 2)
+
+            self.assertEqual(job_with_fs.delete_many([root]), ('success', 0))
+            self.assertFalse(os.path.exists(root))
+            popen.assert_not_called()
+
+    def test_job_with_fs_delete_without_rmtree_dir_fd(self):
+        """Тест: если rmtree не принимает dir_fd (Python 3.9 и 3.10),
+        директория удаляется по полному пути"""
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(fs_backend, '_RMTREE_DIR_FD', False):
+            root = os.path.join(tmp_dir, 'tree')
+            os.makedirs(os.path.join(root, 'nested'))
+            open(os.path.join(root, 'nested', 'file.txt'), 'w').close()
+            self.assertEqual(JobWithFS().delete_many([root]), ('success', 0))
+            self.assertFalse(os.path.exists(root))
+
+
+class SchedulerTest(unittest.TestCase):
+    """Тесты планировщика"""
+    def test_scheduler_runs_short_jobs_without_pauses(self):
+        """Тест: короткие задачи выполняются без пауз между ними"""
+        scheduler = Scheduler(pool_size=4)
+        jobs = [Job(target=noop, args=(i,)) for i in range(200)]
+        for job in jobs:
+            scheduler.schedule(job)
+        scheduler.run()
+        self.assertTrue(scheduler.join(timeout=5))
+        scheduler.stop()
+        self.assertTrue(all(job.is_end for job in jobs))
+
+    def test_scheduler_stop_wakes_workers(self):
+        """Тест: команда стоп сразу будит ожидающие потоки"""
+        scheduler = Scheduler(pool_size=3)
+        scheduler.run()
+        start = monotonic()
+        scheduler.stop()
+        for thread in list(scheduler._Scheduler__threads):
+            thread.join()
+        self.assertLess(monotonic() - start, 1)
+
+    def test_scheduler_future_jobs_do_not_hold_workers(self):
+        """Тест: отложенные задачи не занимают потоки,
+        а срочная задача выполняется сразу"""
+        scheduler = Scheduler(pool_size=1)
+        later = datetime.now() + timedelta(hours=1)
+        future_jobs = [
+            Job(target=noop, args=(i,), start_at=later) for i in range(1000)
+        ]
+        for job in future_jobs:
+            scheduler.schedule(job)
+        soon = Job(
+            target=noop, args=(0,),
+            start_at=datetime.now() + timedelta(milliseconds=200),
+        )
+        scheduler.schedule(soon)
+        urgent = Job(target=noop, args=(0,))
+        scheduler.schedule(urgent)
+        scheduler.run()
+        start = monotonic()
+        while not soon.is_end and monotonic() - start < 5:
+            sleep(0.01)
+        scheduler.stop()
+        self.assertTrue(urgent.is_end)
+        self.assertTrue(soon.is_end)
+        self.assertFalse(any(job.is_end for job in future_jobs))
+
+    def test_scheduler_deep_chain_does_not_block_pool(self):
+        """Тест: цепочка зависимостей длиннее пула потоков
+        выполняется, даже если добавлена в обратном порядке"""
+        chain = [Job(target=noop, args=(0,))]
+        for i in range(1, 300):
+            chain.append(
+                Job(target=noop, args=(i,), dependencies=(chain[-1],))
+            )
+        scheduler = Scheduler(pool_size=2)
+        for job in reversed(chain):
+            scheduler.schedule(job)
+        scheduler.run()
+        self.assertTrue(scheduler.join(timeout=10))
+        scheduler.stop()
+        self.assertTrue(all(job.is_successful for job in chain))
+
+    def test_graph_detects_cycle(self):
+        """Тест: граф зависимостей не принимает задачу,
+        замыкающую цикл"""
+        first = Job(target=noop, args=(0,))
+        second = Job(target=noop, args=(1,), dependencies=(first,))
+        first._Job__dependencies = (second,)
+        graph = JobGraph()
+        self.assertFalse(graph.add(second))
+        with self.assertRaises(CycleError):
+            graph.add(first)
+
+    def test_scheduler_pool_grows_and_shrinks(self):
+        """Тест: пул растет под нагрузкой, сжимается при простое
+        и принимает задачи после простоя"""
+        scheduler = Scheduler(pool_size=4, min_workers=0, idle_timeout=0.1)
+        threads = scheduler._Scheduler__threads
+        scheduler.run()
+        self.assertEqual(len(threads), 0)
+
+        burst = [Job(target=sleepy, args=(0.1,)) for _ in range(8)]
+        for job in burst:
+            scheduler.schedule(job)
+        self.assertEqual(len(threads), 4)
+        self.assertTrue(scheduler.join(timeout=5))
+        sleep(0.5)
+        self.assertEqual(len(threads), 0)
+
+        late = Job(target=noop, args=(0,))
+        scheduler.schedule(late)
+        self.assertTrue(late.wait_end(timeout=5))
+        scheduler.stop()
+
+    def test_delayed_job_runs_with_no_idle_workers(self):
+        """Тест: отложенная задача запускается в срок и при пуле
+        без постоянных потоков - и поставленная до run, и после"""
+        scheduler = Scheduler(pool_size=2, min_workers=0, idle_timeout=0.1)
+        start_at = datetime.now() + timedelta(seconds=0.3)
+        early = Job(target=noop, args=(0,), start_at=start_at)
+        scheduler.schedule(early)
+        scheduler.run()
+        late = Job(target=noop, args=(0,), start_at=start_at)
+        scheduler.schedule(late)
+        self.assertTrue(early.wait_end(timeout=5))
+        self.assertTrue(late.wait_end(timeout=5))
+        scheduler.stop()
+
+    def test_raising_job_does_not_kill_worker(self):
+        """Тест: исключение задачи не завершает поток,
+        следующие задачи выполняются"""
+        broken = [Job(target=raising, args=(1,)) for _ in range(2)]
+        normal = Job(target=noop, args=(1,), dependencies=tuple(broken))
+        scheduler = Scheduler(pool_size=2, min_workers=2)
+        for job in broken:
+            scheduler.schedule(job)
+        scheduler.run()
+        sleep(0.1)
+        later = Job(target=noop, args=(1,))
+        scheduler.schedule(later)
+        scheduler.schedule(normal)
+        self.assertTrue(scheduler.join(timeout=2))
+        scheduler.stop()
+        self.assertTrue(later.is_successful)
+        self.assertTrue(all(
+            job.is_end and not job.is_successful for job in broken
+        ))
+        self.assertFalse(normal.is_successful)
+
+    def test_scheduler_respects_category_limit(self):
+        """Тест: задачи категории не превышают её квоту"""
+        lock = Lock()
+        running = [0, 0]
+
+        def tracked(_arg):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            sleep(0.02)
+            with lock:
+                running[0] -= 1
+            return ('success', 0)
+
+        scheduler = Scheduler(pool_size=6, category_limits={'net': 2})
+        for i in range(12):
+            scheduler.schedule(Job(target=tracked, args=(i,), category='net'))
+        scheduler.run()
+        self.assertTrue(scheduler.join(timeout=5))
+        scheduler.stop()
+        self.assertEqual(running[1], 2)
+
+    def test_map_job_runs_chunks_in_parallel(self):
+        """Тест: части аргументов map-задачи выполняются
+        на нескольких потоках, статус собирается по аргументам"""
+        threads = set()
+
+        def step(num):
+            threads.add(current_thread())
+            sleep(0.01)
+            return ('success', 0 if num != 7 else 1)
+
+        job = Job(target=step, args=tuple(range(60)), chunk_size=5)
+        scheduler = Scheduler(pool_size=6)
+        scheduler.schedule(job)
+        started = monotonic()
+        scheduler.run()
+        self.assertTrue(scheduler.join(timeout=5))
+        scheduler.stop()
+        self.assertLess(monotonic() - started, 0.4)
+        self.assertGreater(len(threads), 1)
+        self.assertFalse(job.is_successful)
+        self.assertEqual(
+            [i for i, (_, code) in enumerate(job.arg_results) if code], [7]
+        )
+
+    def test_batched_map_job(self):
+        """Тест: в пакетном режиме цель получает часть целиком"""
+        sizes = []
+
+        def batch(nums):
+            sizes.append(len(nums))
+            return [('success', 0) for _ in nums]
+
+        job = Job(target=batch, args=tuple(range(25)), chunk_size=10,
+                  batched=True)
+        job.run()
+        self.assertTrue(job.is_successful)
+        self.assertEqual(sorted(sizes), [5, 10, 10])
+        self.assertEqual(len(job.arg_results), 25)
+
+
+class ReadyQueueTest(unittest.TestCase):
+    """Тесты очереди готовых задач"""
+    def test_priority_and_limits(self):
+        """Тест: сначала выдается более приоритетная задача,
+        категория с выбранной квотой пропускается"""
+        queue = ReadyQueue(limits={'net': 1})
+        low = Job(target=noop, args=(0,), priority=5)
+        net_first = Job(target=noop, args=(0,), category='net')
+        net_second = Job(target=noop, args=(0,), category='net')
+        for job in (low, net_first, net_second):
+            queue.push(job, 0)
+        self.assertIs(queue.pop()[1], net_first)
+        self.assertIs(queue.pop()[1], low)
+        self.assertIsNone(queue.pop())
+        queue.release(net_first)
+        self.assertIs(queue.pop()[1], net_second)
+
+    def test_weighted_fair_share(self):
+        """Тест: внутри приоритета категории делят выдачу по весам"""
+        queue = ReadyQueue(weights={'fs': 3, 'net': 1})
+        for category in ('net', 'fs'):
+            for i in range(40):
+                queue.push(Job(target=noop, args=(i,), category=category), 0)
+        categories = [queue.pop()[1].category for _ in range(40)]
+        self.assertEqual(categories.count('fs'), 30)
+        self.assertEqual(categories.count('net'), 10)
+
+    def test_weight_must_be_positive(self):
+        """Тест: нулевой вес категории отклоняется сразу"""
+        with self.assertRaises(ValueError):
+            ReadyQueue(weights={'net': 0})
+
+
+class JournalTest(unittest.TestCase):
+    """Тесты журнала задач"""
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'journal.log')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_scheduler_recovers_pending_jobs(self):
+        """Тест: после остановки невыполненные задачи
+        восстанавливаются из журнала вместе с зависимостями"""
+        later = datetime.now() + timedelta(hours=1)
+        done = Job(target=noop, args=(0,))
+        first = Job(target=JobWithFS().create_dir, args=('x',), start_at=later)
+        second = Job(
+            target=noop, args=((1, 'a'),), dependencies=(first, done),
+        )
+        scheduler = Scheduler(pool_size=2, journal=Journal(self.path))
+        for job in (done, first, second):
+            scheduler.schedule(job)
+        scheduler.run()
+        done.wait_end(timeout=5)
+        scheduler.join(timeout=0.2)
+        scheduler.stop()
+
+        recovered = Scheduler(pool_size=2, journal=Journal(self.path))
+        jobs = {job.uid: job for job in recovered.recover()}
+        recovered.stop()
+        self.assertEqual(set(jobs), {first.uid, second.uid})
+        self.assertEqual(jobs[first.uid].start_at, later)
+        self.assertEqual(jobs[second.uid].args, ((1, 'a'),))
+        self.assertEqual(
+            jobs[second.uid].dependencies, (jobs[first.uid],)
+        )
+
+    def test_journal_compacts_into_snapshot(self):
+        """Тест: журнал сжимается в снимок,
+        оборванная строка журнала пропускается"""
+        journal = Journal(self.path, snapshot_every=10, fsync=False)
+        journal.start()
+        jobs = [Job(target=noop, args=(i,)) for i in range(20)]
+        for job in jobs:
+            journal.record_add(job)
+            journal.flush()
+        for job in jobs[:15]:
+            journal.record_end(job)
+        journal.close()
+        self.assertTrue(os.path.isfile(journal.snapshot_path))
+        with open(self.path, 'a') as file:
+            file.write('{"uid": "torn')
+
+        live = Journal(self.path).load()
+        self.assertEqual(set(live), {job.uid for job in jobs[15:]})
+
+
+class TimeoutTest(unittest.TestCase):
+    """Тесты жестких таймаутов"""
+    def test_subprocess_is_killed_at_deadline(self):
+        """Тест: зависший процесс убивается по сроку"""
+        start = monotonic()
+        with job_deadline(0.2):
+            output, ret_code = run_command('sleep 5')
+        self.assertLess(monotonic() - start, 1)
+        self.assertNotEqual(ret_code, 0)
+        self.assertTrue(output.startswith('TIMEOUT'))
+
+    def test_callable_is_killed_at_deadline(self):
+        """Тест: произвольная функция с таймаутом и исполнителем
+        process выполняется в процессе, который убивается по сроку"""
+        job = Job(
+            target=sleepy, args=(5,), max_working_time=0.3,
+            executor='process',
+        )
+        start = monotonic()
+        job.run()
+        self.assertLess(monotonic() - start, 2)
+        self.assertFalse(job.is_successful)
+
+    def test_inline_callable_with_timeout_keeps_side_effects(self):
+        """Тест: без исполнителя process функция с таймаутом
+        выполняется в текущем процессе, и ее изменения сохраняются"""
+        calls = []
+        job = Job(
+            target=lambda arg: calls.append(arg) or ('success', 0),
+            args=(1, 2), max_working_time=5,
+        )
+        job.run()
+        self.assertTrue(job.is_successful)
+        self.assertEqual(calls, [1, 2])
+
+    def test_generator_is_stopped_at_deadline(self):
+        """Тест: генератор задачи закрывается по сроку,
+        и попытка завершается фейлом"""
+        job = Job(target=slow_items, args=(30,), max_working_time=0.3)
+        start = monotonic()
+        job.run()
+        self.assertLess(monotonic() - start, 1)
+        self.assertFalse(job.is_successful)
+
+    def test_socket_is_aborted_at_deadline(self):
+        """Тест: чтение зависшего ответа прерывается по сроку"""
+        server, url = start_server(HangingHandler)
+        job = Job(
+            target=JobWithNet().read_url, args=(url,), max_working_time=0.3
+        )
+        start = monotonic()
+        job.run()
+        stop_server(server)
+        self.assertLess(monotonic() - start, 2)
+        self.assertFalse(job.is_successful)
+
+
+class ExecutorTest(unittest.TestCase):
+    """Тесты исполнителей задач"""
+    def test_process_executor_runs_target_in_other_process(self):
+        """Тест: задача с исполнителем process
+        выполняется в процессе пула"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = [os.path.join(tmp_dir, f'{i}.pid') for i in range(4)]
+            scheduler = Scheduler(pool_size=4, executor='process')
+            jobs = [Job(target=record_pid, args=(path,)) for path in paths]
+            for job in jobs:
+                scheduler.schedule(job)
+            scheduler.run()
+            self.assertTrue(scheduler.join(timeout=10))
+            scheduler.stop()
+            self.assertTrue(all(job.is_successful for job in jobs))
+            for path in paths:
+                with open(path) as file:
+                    self.assertNotEqual(int(file.read()), os.getpid())
+
+    def test_unpicklable_target_fails_job(self):
+        """Тест: цель, которую нельзя передать в процесс,
+        завершает задачу фейлом"""
+        job = Job(
+            target=lambda arg: ('success', 0), args=(1,), executor='process'
+        )
+        job.run()
+        self.assertTrue(job.is_end)
+        self.assertFalse(job.is_successful)
+
+    def test_job_executor_overrides_scheduler_executor(self):
+        """Тест: исполнитель задачи важнее исполнителя планировщика"""
+        job = Job(target=noop, args=(1,), executor='inline')
+        scheduler = Scheduler(pool_size=1, executor='process')
+        scheduler.schedule(job)
+        scheduler.stop()
+        self.assertEqual(job.executor, 'inline')
+        job.run()
+        self.assertTrue(job.is_successful)
+
+    def test_unknown_executor_is_rejected(self):
+        """Тест: неизвестный исполнитель отклоняется при создании
+        задачи и при восстановлении ее описания"""
+        with self.assertRaises(ValueError):
+            Job(target=noop, args=(1,), executor='thread')
+        spec = job_to_spec(Job(target=noop, args=(1,)))
+        spec['executor'] = 'thread'
+        with self.assertRaises(SpecError):
+            job_from_spec(spec)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    """Тесты пула HTTP-соединений"""
+    def setUp(self):
+        CityHandler.client_ports = set()
+        CityHandler.delay = 0.0
+        CityHandler.padding = 0
+        self.server, self.url = start_server(CityHandler)
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.close()
+        stop_server(self.server)
+
+    def test_connection_is_reused(self):
+        """Тест: последовательные запросы идут по одному соединению"""
+        for _ in range(5):
+            result = self.pool.request(f'{self.url}/city')
+            self.assertEqual(result.status, 200)
+        self.assertEqual(len(CityHandler.client_ports), 1)
+
+    def test_connection_is_reused_after_early_stop(self):
+        """Тест: после извлечения, остановленного до конца тела,
+        небольшой остаток дочитывается и соединение переиспользуется"""
+        CityHandler.padding = 10000
+        for _ in range(3):
+            with self.pool.stream(f'{self.url}/city') as result:
+                city = extract_from_stream(
+                    result.stream, {'name': 'geo_object.locality.name'},
+                    chunk_size=1024,
+                )
+            self.assertEqual(city, {'name': 'Testcity'})
+        self.assertEqual(len(CityHandler.client_ports), 1)
+
+    def test_fetch_many_runs_concurrently(self):
+        """Тест: пакетная загрузка выполняет запросы параллельно"""
+        CityHandler.delay = 0.1
+        urls = [f'{self.url}/city/{i}' for i in range(20)]
+        start = monotonic()
+        results = self.pool.fetch_many(urls, max_in_flight=10)
+        self.assertLess(monotonic() - start, 1)
+        self.assertTrue(all(result.status == 200 for result in results))
+
+    def test_read_timeout(self):
+        """Тест: зависший ответ прерывается по таймауту чтения"""
+        server, url = start_server(HangingHandler)
+        pool = ConnectionPool(read_timeout=0.2)
+        start = monotonic()
+        with self.assertRaises(OSError):
+            pool.request(url)
+        elapsed = monotonic() - start
+        stop_server(server)
+        self.assertLess(elapsed, 1)
+
+    def test_job_with_net_read_urls(self):
+        """Тест: пакетная сетевая задача сохраняет данные городов"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            try:
+                job = Job(
+                    target=JobWithNet().read_urls,
+                    args=([f'{self.url}/city/{i}' for i in range(3)],),
+                )
+                job.run()
+                with open('TESTCITY_data.txt') as file:
+                    self.assertEqual(file.read(), 'Testland\n')
+            finally:
+                os.chdir(cwd)
+        self.assertTrue(job.is_successful)
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """Тесты дискового кэша HTTP-ответов"""
+    def setUp(self):
+        ETagHandler.statuses = []
+        self.server, self.url = start_server(ETagHandler)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        stop_server(self.server)
+        self.tmp_dir.cleanup()
+
+    def test_revalidation_and_freshness(self):
+        """Тест: устаревшая запись перепроверяется ответом 304,
+        свежая запись отдается без сети"""
+        url = f'{self.url}/a'
+        stale_pool = ConnectionPool(cache=ResponseCache(self.tmp_dir.name, 0))
+        first = stale_pool.request(url)
+        second = stale_pool.request(url)
+        self.assertEqual(first.body, second.body)
+        self.assertEqual(second.headers['X-Cache'], 'REVALIDATED')
+        self.assertEqual(ETagHandler.statuses, [200, 304])
+
+        fresh_pool = ConnectionPool(cache=ResponseCache(self.tmp_dir.name))
+        third = fresh_pool.request(url)
+        self.assertEqual(third.headers['X-Cache'], 'HIT')
+        self.assertEqual(third.body, first.body)
+        self.assertEqual(ETagHandler.statuses, [200, 304])
+
+    def test_lru_eviction(self):
+        """Тест: при превышении размера вытесняется
+        давно не использованная запись"""
+        cache = ResponseCache(self.tmp_dir.name, max_bytes=500)
+        pool = ConnectionPool(cache=cache)
+        pool.request(f'{self.url}/a')
+        pool.request(f'{self.url}/b')
+        pool.request(f'{self.url}/a')
+        pool.request(f'{self.url}/c')
+        ETagHandler.statuses = []
+        pool.request(f'{self.url}/a')
+        pool.request(f'{self.url}/b')
+        self.assertEqual(ETagHandler.statuses, [200])
+
+    def test_miss_is_streamed_and_partial_body_is_not_cached(self):
+        """Тест: тело промаха читается из сети по частям,
+        недочитанное тело не сохраняется, дочитанное - сохраняется"""
+        url = f'{self.url}/a'
+        pool = ConnectionPool(cache=ResponseCache(self.tmp_dir.name))
+        with pool.stream(url) as result:
+            self.assertEqual(result.headers['X-Cache'], 'MISS')
+            self.assertEqual(result.stream.read(4), b'/a/a')
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+        self.assertEqual(pool.request(url).body, b'/a' * 100)
+        self.assertEqual(pool.request(url).headers['X-Cache'], 'HIT')
+        self.assertEqual(ETagHandler.statuses, [200, 200])
+
+    def test_concurrent_misses_for_same_url(self):
+        """Тест: одновременные промахи по одному URL
+        не мешают друг другу сохранять ответ"""
+        url = f'{self.url}/a'
+        pool = ConnectionPool(cache=ResponseCache(self.tmp_dir.name))
+        results = pool.fetch_many([url] * 8, max_in_flight=8)
+        for result in results:
+            self.assertEqual(result.status, 200)
+            self.assertEqual(result.body, b'/a' * 100)
+        self.assertEqual(
+            [name for name in os.listdir(self.tmp_dir.name)
+             if name.endswith('.tmp')],
+            [],
+        )
+
+
+class StatusWriterTest(unittest.TestCase):
+    """Тесты фоновой записи статусов"""
+    def test_statuses_are_written_whole_and_in_order(self):
+        """Тест: статусы из многих потоков записываются
+        целыми строками и в порядке сохранения в каждом потоке"""
+        marker = f'status-writer-{uuid4().hex}'
+
+        def worker(num):
+            for i in range(500):
+                save_status('%s %s %s', marker, num, i)
+
+        threads = [Thread(target=worker, args=(num,)) for num in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(flush_statuses(timeout=5))
+
+        seen: dict[str, list[int]] = {}
+        with open(STATUS_FILE) as file:
+            for line in file:
+                if line.startswith(marker):
+                    _, num, i = line.split()
+                    seen.setdefault(num, []).append(int(i))
+        self.assertEqual(len(seen), 8)
+        for numbers in seen.values():
+            self.assertEqual(numbers, list(range(500)))
+
+
+class JsonStreamTest(unittest.TestCase):
+    """Тесты потокового извлечения значений из json"""
+    def test_paths_across_chunk_boundaries(self):
+        """Тест: значения находятся при любом разбиении на части,
+        лишние поддеревья пропускаются"""
+        data = {
+            'skip': [1, {'x': 'a\\"}]'}, [], None],
+            'geo_object': {
+                'locality': {'name': 'Город'},
+                'country': {'name': 'Страна', 'extra': {}},
+            },
+            'list': [{'v': 1.5}, {'v': True}],
+        }
+        spec = {
+            'city': 'geo_object.locality.name',
+            'country': 'geo_object.country',
+            'value': 'list.1.v',
+            'missing': 'geo_object.region.name',
+        }
+        body = json.dumps(data, ensure_ascii=False).encode()
+        for size in (1, 3, 64):
+            chunks = [body[i:i + size] for i in range(0, len(body), size)]
+            self.assertEqual(
+                extract_paths(chunks, spec), extract_from_dict(data, spec)
+            )
+
+    def test_stops_after_all_paths_found(self):
+        """Тест: части после найденных путей не читаются"""
+        read = []
+
+        def chunks():
+            yield b'{"geo_object": {"locality": {"name": "A"}}, '
+            read.append('tail')
+            yield b'"rest": [' + b'0, ' * 1000 + b'0]}'
+
+        result = extract_paths(chunks(), {'city': 'geo_object.locality.name'})
+        self.assertEqual(result, {'city': 'A'})
+        self.assertEqual(read, [])
+
+
+class ArtifactStoreTest(unittest.TestCase):
+    """Тесты передачи результатов между задачами"""
+    def test_large_and_old_values_spill_to_disk(self):
+        """Тест: большое значение сразу выгружается на диск,
+        при превышении памяти выгружается давно не использованное"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = ArtifactStore(
+                tmp_dir, memory_limit=3000, spill_threshold=2000
+            )
+            store.put('big', b'x' * 5000)
+            self.assertEqual(len(os.listdir(tmp_dir)), 1)
+            store.put('a', 'a' * 1600)
+            store.put('b', 'b' * 1600)
+            self.assertEqual(len(os.listdir(tmp_dir)), 2)
+            self.assertEqual(store.get('a'), 'a' * 1600)
+            self.assertEqual(store.get('big'), b'x' * 5000)
+            store.clear()
+            self.assertNotIn('a', store)
+            self.assertEqual(os.listdir(tmp_dir), [])
+
+    def test_old_spilled_values_are_evicted_over_disk_limit(self):
+        """Тест: при превышении объема выгрузки удаляется
+        давно не использованное выгруженное значение"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = ArtifactStore(
+                tmp_dir, spill_threshold=100, disk_limit=2500
+            )
+            for key in ('a', 'b'):
+                store.put(key, key * 1000)
+            self.assertEqual(store.get('a'), 'a' * 1000)
+            store.put('c', 'c' * 1000)
+            self.assertNotIn('b', store)
+            self.assertEqual(store.get('a'), 'a' * 1000)
+            self.assertEqual(store.get('c'), 'c' * 1000)
+            self.assertEqual(len(os.listdir(tmp_dir)), 2)
+
+    def test_dependents_receive_results(self):
+        """Тест: зависимая задача получает результаты
+        зависимостей после своих аргументов"""
+        received = []
+
+        def produce(num):
+            return ('success', 0, num * 10)
+
+        def consume(prefix, first, second):
+            received.append((prefix, first, second))
+            return ('success', 0, f'{prefix}{first}+{sum(second)}')
+
+        first = Job(target=produce, args=(1,))
+        second = Job(target=produce, args=(2, 3))
+        final = Job(
+            target=consume, args=('sum=',),
+            dependencies=(first, second), receive_results=True,
+        )
+        scheduler = Scheduler(pool_size=3)
+        for job in (first, second, final):
+            scheduler.schedule(job)
+        scheduler.run()
+        self.assertTrue(scheduler.join(timeout=5))
+        scheduler.stop()
+        self.assertEqual(received, [('sum=', 10, [20, 30])])
+        self.assertEqual(final.result, 'sum=10+50')
+
+    def test_rerun_of_successful_job_keeps_result(self):
+        """Тест: повторный запуск и рестарт успешной задачи
+        выполняют ее заново и не стирают результат"""
+        calls = []
+
+        def produce(num):
+            calls.append(num)
+            return ('success', 0, {'v': num})
+
+        job = Job(target=produce, args=(5,))
+        job.run()
+        job.run()
+        self.assertEqual(calls, [5, 5])
+        self.assertEqual(job.result, {'v': 5})
+
+        job = Job(target=produce, args=(7,))
+        scheduler = Scheduler(pool_size=1)
+        scheduler.schedule(job)
+        scheduler.run()
+        self.assertTrue(scheduler.join(timeout=5))
+        scheduler.restart()
+        self.assertTrue(scheduler.join(timeout=5))
+        scheduler.stop()
+        self.assertEqual(calls, [5, 5, 7, 7])
+        self.assertEqual(job.result, {'v': 7})
+
+
+def scaled(num, *inputs):
+    """Задача для тестов кэша результатов: считает вызовы"""
+    scaled.calls += 1
+    return ('success', 0, num * 10 + sum(inputs))
+
+
+scaled.calls = 0
+
+
+class MemoCacheTest(unittest.TestCase):
+    """Тесты кэша результатов задач"""
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'memo.log')
+        scaled.calls = 0
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_graph(self, cache, root_arg):
+        """Запуск цепочки из трех задач с кэшем"""
+        jobs = []
+        for num in (root_arg, 2, 3):
+            jobs.append(Job(
+                target=scaled, args=(num,), dependencies=tuple(jobs[-1:]),
+                receive_results=True, memoize=True, memo_cache=cache,
+            ))
+        for job in jobs:
+            job.run()
+        return jobs
+
+    def test_unchanged_jobs_are_skipped(self):
+        """Тест: повторный запуск берет результаты из кэша,
+        изменение корня перезапускает зависимые задачи"""
+        cache = MemoCache(self.path)
+        first = self.run_graph(cache, 1)
+        self.assertEqual(scaled.calls, 3)
+        second = self.run_graph(cache, 1)
+        self.assertEqual(scaled.calls, 3)
+        self.assertTrue(all(job.is_successful for job in second))
+        self.assertEqual(second[-1].result, first[-1].result)
+        changed = self.run_graph(cache, 5)
+        self.assertEqual(scaled.calls, 6)
+        self.assertEqual(changed[-1].result, 50 + 20 + 30)
+        cache.close()
+
+    def test_persistence_eviction_and_invalidation(self):
+        """Тест: записи переживают перезапуск, вытесняются
+        по размеру и сбрасываются по цели"""
+        cache = MemoCache(self.path, max_entries=2)
+        self.run_graph(cache, 1)
+        self.assertEqual(len(cache), 2)
+        cache.close()
+
+        reopened = MemoCache(self.path, max_entries=2)
+        self.assertEqual(len(reopened), 2)
+        self.assertEqual(reopened.invalidate_target(scaled), 2)
+        self.run_graph(reopened, 1)
+        self.assertEqual(scaled.calls, 6)
+        reopened.close()
+
+
+class MetricsTest(unittest.TestCase):
+    """Тесты метрик задач"""
+    def test_scheduler_records_and_exports_metrics(self):
+        """Тест: планировщик и задачи пишут метрики,
+        метрики доступны из планировщика и выгружаются в файл"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'metrics.json')
+            scheduler = Scheduler(
+                pool_size=2, metrics=MetricsRegistry(),
+                metrics_file=path, metrics_interval=60,
+            )
+            root = Job(target=sleepy, args=(0.05,), category='slow')
+            scheduler.schedule(root)
+            scheduler.schedule(
+                Job(target=noop, args=(1,), dependencies=(root,))
+            )
+            scheduler.schedule(Job(target=failing, args=(1,), tries=3))
+            scheduler.run()
+            self.assertTrue(scheduler.join(timeout=5))
+            scheduler.stop()
+
+            registry = scheduler.metrics
+            default = registry.for_category('default')
+            self.assertEqual(default.retries.value, 2)
+            self.assertEqual(default.failed.value, 1)
+            self.assertEqual(default.succeeded.value, 1)
+            self.assertEqual(default.try_seconds.snapshot()['count'], 4)
+            self.assertEqual(default.queue_wait.snapshot()['count'], 4)
+            self.assertGreaterEqual(
+                default.dependency_wait.quantile(0.5), 0.05
+            )
+            slow = registry.for_category('slow').try_seconds.snapshot()
+            self.assertGreaterEqual(slow['sum'], 0.05)
+            self.assertIn(
+                'job_retries_total{category="default"} 2',
+                registry.to_prometheus(),
+            )
+            with open(path) as file:
+                exported = json.load(file)
+            self.assertIn('job_try_seconds', exported)
+
+    def test_start_delay_is_measured_from_scheduling(self):
+        """Тест: опоздание запуска задачи, созданной заранее,
+        считается от постановки в планировщик"""
+        job = Job(target=noop, args=(1,))
+        sleep(0.3)
+        scheduler = Scheduler(pool_size=1, metrics=MetricsRegistry())
+        scheduler.schedule(job)
+        scheduler.run()
+        self.assertTrue(scheduler.join(timeout=5))
+        scheduler.stop()
+        delay = scheduler.metrics.for_category('default').start_delay
+        self.assertEqual(delay.snapshot()['count'], 1)
+        self.assertLess(delay.snapshot()['sum'], 0.2)
+
+    def test_metrics_are_cheap_and_thread_safe(self):
+        """Тест: событие обходится в единицы микросекунд,
+        счетчики не теряют событий из разных потоков"""
+        job_metrics = MetricsRegistry().for_category('default')
+        events = 100000
+        start = monotonic()
+        for _ in range(events):
+            job_metrics.try_seconds.observe(0.001)
+        self.assertLess((monotonic() - start) / events, 5e-6)
+
+        def count():
+            for _ in range(events):
+                job_metrics.retries.inc()
+        threads = [Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(job_metrics.retries.value, 4 * events)
+        self.assertEqual(job_metrics.try_seconds.snapshot()['count'], events)
+
+
+class BenchmarkTest(unittest.TestCase):
+    """Тесты нагрузочного прогона"""
+    def test_measure_and_compare(self):
+        """Тест: прогон нагрузки считает метрики,
+        сравнение находит падение пропускной способности"""
+        with tempfile.TemporaryDirectory() as workdir:
+            result = measure('fs', 0.02, 4, workdir)
+            self.assertEqual(os.listdir(workdir), [])
+        self.assertEqual(result['jobs'], 12)
+        self.assertEqual(result['failed'], 0)
+        self.assertGreater(result['throughput'], 0)
+        self.assertLessEqual(result['latency_p50'], result['latency_p99'])
+
+        slower = dict(result, throughput=result['throughput'] / 2)
+        regressions = compare(
+            {'results': {'fs': result}}, {'results': {'fs': slower}}, 0.2
+        )
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('fs throughput', regressions[0])
+
+
+def allocate(size):
+    """Задача, которая удерживает выделенную память"""
+    allocate.kept.append(bytearray(size))
+    return ('success', 0)
+
+
+allocate.kept = []
+
+
+class ProfilingTest(unittest.TestCase):
+    """Тесты профилирования задач"""
+    def tearDown(self):
+        profiling.disable()
+        allocate.kept.clear()
+
+    def test_profiled_jobs_are_merged_into_reports(self):
+        """Тест: прогоны цели складываются в один профиль,
+        задачи вне категории и с profile=False не профилируются"""
+        with tempfile.TemporaryDirectory() as report_dir:
+            profiler = profiling.enable(Profiler(
+                report_dir, memory=True, categories=('heavy',)
+            ))
+            for category in ('heavy', 'heavy', 'default'):
+                Job(target=allocate, args=(500000,), category=category).run()
+            Job(
+                target=allocate, args=(500000,), category='heavy',
+                profile=False,
+            ).run()
+            name = profiling.target_name(allocate)
+            calls = [
+                call_stats[1]
+                for (_, _, function), call_stats
+                in profiler.stats(name).stats.items()
+                if function == 'allocate'
+            ]
+            self.assertEqual(calls, [2])
+            self.assertEqual(profiler.allocations(name).runs, 2)
+
+            paths = profiling.disable()
+            self.assertIsNone(profiling.active())
+            self.assertEqual(len(paths), 3)
+            with open(os.path.join(report_dir, 'hotspots.txt')) as file:
+                self.assertIn(f'== {name}: 2 runs ==', file.read())
+            with open(os.path.join(report_dir, 'allocations.txt')) as file:
+                self.assertIn('tests.py', file.read())
+
+    def test_selection(self):
+        """Тест: без профилировщика задача профилируется только
+        с profile=True, доля выборки 1 выбирает все задачи"""
+        self.assertIsNone(profiling.select(None, 'default'))
+        self.assertIsNone(profiling.select(False, 'default'))
+        self.assertIsNotNone(profiling.select(True, 'default'))
+        profiling.enable(Profiler(sample_rate=1.0))
+        self.assertIsNotNone(profiling.select(None, 'default'))
+        self.assertIsNone(profiling.select(False, 'default'))
+
+
+class ListHandler(logging.Handler):
+    """Обработчик, собирающий сообщения в список"""
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class LoggingTest(unittest.TestCase):
+    """Тесты логирования"""
+    def test_sampler_limits_and_counts_suppressed(self):
+        """Тест: сверх серии сообщения пропускаются,
+        число пропущенных попадает в следующее сообщение"""
+        logger = logging.getLogger('tests.sampler')
+        handler = ListHandler()
+        logger.addHandler(handler)
+        logger.propagate = False
+        set_logging(levels={'tests.sampler': 'INFO'})
+        sampler = LogSampler(rate=0, burst=2)
+        for item in range(5):
+            sampler.log(logger, logging.INFO, 'item %s', item)
+        sampler.log(logger, logging.DEBUG, 'disabled %s', 0)
+        self.assertEqual(handler.messages, ['item 0', 'item 1'])
+        sampler.rate = 1e9
+        sampler.log(logger, logging.INFO, 'item %s', 5)
+        self.assertEqual(
+            handler.messages[-1], 'item 5 (3 similar messages suppressed)'
+        )
+
+    def test_queue_handler_defers_only_immutable_args(self):
+        """Тест: сообщение с неизменяемыми аргументами собирается
+        при записи, с изменяемыми - сразу при вызове"""
+        log_queue = SimpleQueue()
+        logger = logging.getLogger('tests.queue')
+        logger.addHandler(DeferredQueueHandler(log_queue))
+        logger.propagate = False
+        items = [1]
+        logger.warning('number %s', 1)
+        logger.warning('items %s', items)
+        items.append(2)
+        deferred, formatted = log_queue.get(), log_queue.get()
+        self.assertEqual(deferred.args, (1,))
+        self.assertEqual(formatted.args, None)
+        self.assertEqual(formatted.getMessage(), 'items [1]')
+
+
+class RetryTest(unittest.TestCase):
+    """Тесты отложенных повторов"""
+    def test_retry_waits_on_timer_without_holding_worker(self):
+        """Тест: повтор ждет задержку в куче таймеров,
+        единственный поток тем временем выполняет другую задачу"""
+        self.assertLessEqual(backoff_delay(3, 0.1, 1.0), 0.4)
+        self.assertGreaterEqual(backoff_delay(3, 0.1, 1.0), 0.2)
+        self.assertLessEqual(backoff_delay(100, 0.1, 1.0), 1.0)
+        attempts = []
+        scheduler = Scheduler(
+            pool_size=1, metrics=MetricsRegistry(),
+            retry_base_delay=0.2, retry_max_delay=0.2,
+        )
+        scheduler.schedule(Job(target=flaky, args=(attempts,), tries=3))
+        other = Job(
+            target=noop, args=(1,),
+            start_at=datetime.now() + timedelta(seconds=0.05),
+        )
+        scheduler.schedule(other)
+        scheduler.run()
+        self.assertTrue(scheduler.join(timeout=5))
+        scheduler.stop()
+        self.assertEqual(len(attempts), 3)
+        self.assertGreaterEqual(attempts[1] - attempts[0], 0.1)
+        self.assertTrue(other.is_successful)
+        self.assertEqual(
+            scheduler.metrics.for_category('default').retries.value, 2
+        )
+
+    def test_exhausted_budget_fails_without_retry(self):
+        """Тест: без бюджета повторов задача завершается
+        фейлом после первой попытки"""
+        attempts = []
+        scheduler = Scheduler(
+            metrics=MetricsRegistry(),
+            retry_budgets={'default': RetryBudget(ratio=0, max_tokens=0)},
+        )
+        job = Job(target=flaky, args=(attempts,), tries=3)
+        scheduler.schedule(job)
+        scheduler.run()
+        self.assertTrue(scheduler.join(timeout=5))
+        scheduler.stop()
+        self.assertEqual(len(attempts), 1)
+        self.assertFalse(job.is_successful)
+        self.assertEqual(
+            scheduler.metrics.for_category('default')
+            .retries_denied.value, 1
+        )
+
+    def test_dependency_rerun_retries_on_timer(self):
+        """Тест: повтор зависимости, которую перезапускает зависимая
+        задача, ждет в куче таймеров, а единственный поток
+        тем временем выполняет другую задачу"""
+        attempts = []
+        scheduler = Scheduler(
+            pool_size=1, retry_base_delay=0.6, retry_max_delay=0.6,
+            retry_budgets={'default': RetryBudget(ratio=1, max_tokens=10)},
+        )
+        dependency = Job(target=failing_counted, args=(attempts,), tries=2)
+        dependent = Job(target=noop, args=(1,), dependencies=(dependency,))
+        scheduler.schedule(dependency)
+        scheduler.schedule(dependent)
+        scheduler.run()
+        waited_until = monotonic() + 5
+        while len(attempts) < 3 and monotonic() < waited_until:
+            sleep(0.01)
+        other = Job(target=noop, args=(1,))
+        scheduler.schedule(other)
+        self.assertTrue(other.wait_end(timeout=0.25))
+        self.assertEqual(len(attempts), 3)
+        self.assertTrue(scheduler.join(timeout=5))
+        scheduler.stop()
+        self.assertEqual(len(attempts), 4)
+        self.assertTrue(dependency.future.done())
+        self.assertFalse(dependency.is_successful)
+        self.assertTrue(dependent.is_end)
+        self.assertFalse(dependent.is_successful)
+
+
+class JobFutureTest(unittest.TestCase):
+    """Тесты единственного выполнения задачи"""
+    def test_concurrent_runs_join_one_execution(self):
+        """Тест: одновременные запуски дожидаются одного выполнения,
+        функции завершения вызываются один раз"""
+        calls = []
+        job = Job(target=fails_once, args=(calls,))
+        done = []
+        futures = []
+        threads = [
+            Thread(target=lambda: futures.append(job.run()))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len({id(future) for future in futures}), 1)
+        futures[0].add_done_callback(done.append)
+        self.assertEqual(done, futures[:1])
+        self.assertTrue(job.future.done())
+        with self.assertRaises(JobFailed):
+            job.future.result(timeout=1)
+
+    def test_failed_dependency_is_rerun_once(self):
+        """Тест: зависимые задачи перезапускают упавшую
+        зависимость один раз на всех"""
+        calls = []
+        dependency = Job(target=fails_once, args=(calls,))
+        failed = dependency.run()
+        dependents = [
+            Job(target=noop, args=(1,), dependencies=(dependency,))
+            for _ in range(4)
+        ]
+        threads = [Thread(target=job.run) for job in dependents]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 2)
+        self.assertIsNot(dependency.future, failed)
+        self.assertIsNone(dependency.future.result(timeout=1))
+        self.assertTrue(all(job.is_successful for job in dependents))
+
+
+class StopTest(unittest.TestCase):
+    """Тесты остановки планировщика"""
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'journal.log')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def recover_uids(self) -> set:
+        """Идентификаторы задач, восстановленных из журнала"""
+        recovered = Scheduler(journal=Journal(self.path))
+        jobs = recovered.recover()
+        recovered.stop()
+        return {job.uid for job in jobs}
+
+    def test_stop_cancels_blocking_io(self):
+        """Тест: остановка прерывает зависшее чтение из сети,
+        отмененная задача остается в журнале незавершенной"""
+        server, url = start_server(HangingHandler)
+        job = Job(target=JobWithNet().read_url, args=(url,))
+        scheduler = Scheduler(journal=Journal(self.path))
+        scheduler.schedule(job)
+        scheduler.run()
+        sleep(0.3)
+        start = monotonic()
+        self.assertTrue(scheduler.stop())
+        self.assertLess(monotonic() - start, 1)
+        stop_server(server)
+        self.assertFalse(job.is_successful)
+        self.assertEqual(self.recover_uids(), {job.uid})
+
+    def test_stop_cancels_generator_job(self):
+        """Тест: остановка прерывает задачу-генератор
+        между элементами"""
+        job = Job(target=slow_items, args=(30,))
+        scheduler = Scheduler()
+        scheduler.schedule(job)
+        scheduler.run()
+        sleep(0.3)
+        start = monotonic()
+        self.assertTrue(scheduler.stop())
+        self.assertLess(monotonic() - start, 0.5)
+        self.assertTrue(job.is_end)
+        self.assertFalse(job.is_successful)
+
+    def test_drain_finishes_running_and_keeps_queued(self):
+        """Тест: остановка с drain дает выполняемой задаче
+        завершиться, задачи из очереди остаются в журнале"""
+        running = Job(target=sleepy, args=(0.3,))
+        queued = Job(target=noop, args=(1,), dependencies=(running,))
+        scheduler = Scheduler(journal=Journal(self.path))
+        scheduler.schedule(running)
+        scheduler.schedule(queued)
+        scheduler.run()
+        sleep(0.1)
+        self.assertTrue(scheduler.stop(drain=True, deadline=2))
+        self.assertTrue(running.is_successful)
+        self.assertFalse(queued.is_end)
+        self.assertEqual(self.recover_uids(), {queued.uid})
+
+
+class FileJobQueueTest(unittest.TestCase):
+    """Тесты общей очереди задач в файлах"""
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, 'queue')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_expired_lease_is_reclaimed(self):
+        """Тест: задачу берет один процесс, после истечения
+        аренды она возвращается в очередь, и прежний владелец
+        уже не может отметить ее выполненной"""
+        first = FileJobQueue(self.root, lease_ttl=0.2, owner='first')
+        second = FileJobQueue(self.root, lease_ttl=0.2, owner='second')
+        first.put(Job(target=noop, args=(1,)))
+        [job] = first.claim(10)
+        self.assertEqual(second.claim(10), [])
+        self.assertEqual(second.reclaim(), 0)
+        sleep(0.3)
+        self.assertEqual(second.reclaim(), 1)
+        self.assertEqual(first.heartbeat([job.uid]), [job.uid])
+        [again] = second.claim(10)
+        again.run()
+        self.assertTrue(second.complete(again))
+        self.assertFalse(first.complete(job))
+        self.assertTrue(second.result(job.uid))
+
+    def test_missing_dependency_does_not_block_job(self):
+        """Тест: задача, зависимости которой нет в очереди,
+        берется и выполняется, а с зависимостью в очереди - ждет"""
+        queue = FileJobQueue(self.root)
+        queued = Job(target=noop, args=(1,))
+        queue.put(queued)
+        orphan = Job(target=noop, args=(1,), dependencies=(Job(noop),))
+        queue.put(orphan)
+        waiting = Job(target=noop, args=(1,), dependencies=(queued,))
+        queue.put(waiting)
+        claimed = {job.uid for job in queue.claim(10)}
+        self.assertEqual(claimed, {queued.uid, orphan.uid})
+
+    def test_processes_share_queue(self):
+        """Тест: несколько процессов вместе выполняют очередь,
+        каждая задача выполняется один раз и после зависимостей,
+        процессы не стирают статусы родителя"""
+        queue = FileJobQueue(self.root)
+        paths = [
+            os.path.join(self.tmp_dir.name, f'{num}.pid') for num in range(20)
+        ]
+        first = Job(target=record_pid, args=(paths[0],))
+        queue.put(first)
+        for path in paths[1:]:
+            queue.put(
+                Job(target=record_pid, args=(path,), dependencies=(first,))
+            )
+        failing_job = Job(target=failing, args=(1,))
+        queue.put(failing_job)
+        blocked = Job(target=noop, args=(1,), dependencies=(failing_job,))
+        queue.put(blocked)
+
+        save_status('before workers %s', self.root)
+        self.assertTrue(flush_statuses(timeout=1))
+        completed = run_workers(self.root, processes=2, prefetch=4)
+        self.assertTrue(flush_statuses(timeout=1))
+        with open(STATUS_FILE) as file:
+            self.assertIn(f'before workers {self.root}', file.read())
+        self.assertEqual(sum(completed), 21)
+        self.assertEqual(
+            queue.counts(), {'pending': 0, 'claimed': 0, 'done': 22}
+        )
+        self.assertTrue(all(os.path.isfile(path) for path in paths))
+        self.assertLessEqual(
+            os.path.getmtime(paths[0]),
+            min(os.path.getmtime(path) for path in paths[1:]),
+        )
+        self.assertFalse(queue.result(blocked.uid))
+
 
 if __name__ == "__main__":
     set_logging()
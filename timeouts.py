@@ -0,0 +1,247 @@
+"""Жесткие сроки выполнения задач и их принудительное прерывание"""
+from contextlib import contextmanager
+from threading import Condition, Lock, Thread, local
+from math import inf
+from time import monotonic
+from typing import Any, Callable, Iterator, Optional
+import heapq
+import logging
+import multiprocessing
+
+import settings_store
+
+logger = logging.getLogger(__name__)
+
+_local = local()
+if 'fork' in multiprocessing.get_all_start_methods():
+    _context = multiprocessing.get_context('fork')
+else:
+    _context = multiprocessing.get_context()
+
+
+class CancelToken:
+    """Токен отмены работы. Работа регистрирует в токене
+    функции прерывания (убить процесс, закрыть сокет),
+    отмена вызывает их"""
+    def __init__(self):
+        self.is_cancelled = False
+        self.is_closed = False
+        self.__callbacks: list[Callable] = []
+        self.__lock = Lock()
+
+    def register(self, callback: Callable):
+        """Метод регистрирует функцию прерывания.
+        Если токен уже отменен, она вызывается сразу"""
+        with self.__lock:
+            if not self.is_cancelled:
+                self.__callbacks.append(callback)
+                return
+        self.__call(callback)
+
+    def unregister(self, callback: Callable):
+        """Метод снимает функцию прерывания"""
+        with self.__lock:
+            if callback in self.__callbacks:
+                self.__callbacks.remove(callback)
+
+    def cancel(self):
+        """Метод отменяет работу и вызывает функции прерывания"""
+        with self.__lock:
+            if self.is_cancelled or self.is_closed:
+                return
+            self.is_cancelled = True
+            callbacks, self.__callbacks = self.__callbacks, []
+        for callback in callbacks:
+            self.__call(callback)
+
+    def close(self):
+        """Метод отмечает, что работа завершилась
+        и больше не отменяется"""
+        with self.__lock:
+            self.is_closed = True
+            self.__callbacks = []
+
+    def __call(self, callback: Callable):
+        """Вызов функции прерывания с перехватом ошибок"""
+        try:
+            callback()
+        except Exception:
+            logger.exception('cancel callback %s failed', callback)
+
+
+class Deadline(CancelToken):
+    """Срок выполнения попытки задачи.
+    Задачи регистрируют в сроке функции прерывания своей работы
+    (убить процесс, закрыть сокет), по истечении срока
+    сторожевой поток вызывает их. Отрицательное значение seconds -
+    срока нет, но попытка прерывается отменой токена задачи token.
+    reason - причина прерывания: TIMEOUT или CANCELLED"""
+    def __init__(self, seconds: float, token: Optional[CancelToken] = None):
+        super().__init__()
+        self.expires_at = monotonic() + seconds if seconds >= 0 else inf
+        self.reason = 'TIMEOUT'
+        self.__token = token
+        if token is not None:
+            token.register(self.__cancel)
+
+    @property
+    def is_expired(self) -> bool:
+        """Прервана ли попытка"""
+        return self.is_cancelled
+
+    def time_left(self) -> float:
+        """Оставшееся время в секундах"""
+        if self.is_cancelled:
+            return 0.0
+        return max(0.0, self.expires_at - monotonic())
+
+    def expire(self):
+        """Метод отмечает истечение срока
+        и вызывает функции прерывания"""
+        self.cancel()
+
+    def __cancel(self):
+        """Прерывание попытки отменой задачи"""
+        if not self.is_cancelled:
+            self.reason = 'CANCELLED'
+        self.cancel()
+
+    def close(self):
+        """Метод отмечает, что попытка завершилась"""
+        super().close()
+        if self.__token is not None:
+            self.__token.unregister(self.__cancel)
+
+
+class _Watchdog:
+    """Один сторожевой поток на все сроки:
+    куча сроков и ожидание на условной переменной
+    до ближайшего из них"""
+    def __init__(self):
+        self.__heap: list[tuple[float, int, Deadline]] = []
+        self.__counter = 0
+        self.__condition = Condition()
+        self.__thread: Optional[Thread] = None
+
+    def add(self, deadline: Deadline):
+        """Метод добавляет срок под наблюдение"""
+        with self.__condition:
+            self.__counter += 1
+            heapq.heappush(
+                self.__heap, (deadline.expires_at, self.__counter, deadline)
+            )
+            if self.__thread is None or not self.__thread.is_alive():
+                self.__thread = Thread(
+                    target=self.__loop, name='deadline-watchdog', daemon=True
+                )
+                self.__thread.start()
+            self.__condition.notify()
+
+    def __loop(self):
+        """Цикл сторожевого потока"""
+        while True:
+            with self.__condition:
+                while self.__heap and self.__heap[0][2].is_closed:
+                    heapq.heappop(self.__heap)
+                if not self.__heap:
+                    self.__condition.wait()
+                    continue
+                expires_at, _, deadline = self.__heap[0]
+                delay = expires_at - monotonic()
+                if delay > 0:
+                    self.__condition.wait(delay)
+                    continue
+                heapq.heappop(self.__heap)
+            deadline.expire()
+
+
+_watchdog = _Watchdog()
+
+
+@contextmanager
+def job_deadline(
+        seconds: float,
+        token: Optional[CancelToken] = None) -> Iterator[Optional[Deadline]]:
+    """Контекст жесткого срока для текущего потока.
+    Отрицательное значение означает отсутствие срока:
+    попытку прерывает только отмена token"""
+    if seconds < 0 and token is None:
+        yield None
+        return
+    deadline = Deadline(seconds, token)
+    previous = current_deadline()
+    _local.deadline = deadline
+    if seconds >= 0:
+        _watchdog.add(deadline)
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+        deadline.close()
+
+
+@contextmanager
+def shared_deadline(
+        deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """Контекст чужого срока для текущего потока: работа,
+    которую поток делает за задачу, прерывается по ее сроку.
+    Срок не закрывается при выходе из контекста"""
+    previous = current_deadline()
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Срок выполнения текущей попытки задачи в этом потоке"""
+    return getattr(_local, 'deadline', None)
+
+
+def _killable_entry(conn: Any, func: Callable, args: tuple):
+    """Точка входа дочернего процесса: выполняет функцию
+    и отправляет результат родителю"""
+    try:
+        conn.send((True, func(*args)))
+    except Exception as error:
+        conn.send((False, repr(error)))
+    finally:
+        conn.close()
+        settings_store.close_status_file()
+
+
+def run_killable(func: Callable, *args: Any) -> Any:
+    """Функция выполняет func(*args) в отдельном процессе.
+    Если текущий срок истекает или задачу отменяют раньше,
+    процесс убивается, а функция возвращает статус таймаута
+    или отмены"""
+    deadline = current_deadline()
+    parent_conn, child_conn = _context.Pipe(duplex=False)
+    process = _context.Process(
+        target=_killable_entry, args=(child_conn, func, args), daemon=True
+    )
+    process.start()
+    child_conn.close()
+    if deadline is not None:
+        deadline.register(process.kill)
+    try:
+        timeout = None if deadline is None else deadline.time_left()
+        if not parent_conn.poll(None if timeout == inf else timeout) \
+                or deadline is not None and deadline.is_expired:
+            process.kill()
+            reason = 'TIMEOUT' if deadline is None else deadline.reason
+            logger.error('%s: %s is killed', reason, func)
+            return (f'{reason}: {func}', 1)
+        try:
+            is_ok, result = parent_conn.recv()
+        except EOFError:
+            return (f'ERROR: process of {func} died', 1)
+        if not is_ok:
+            return (f'ERROR: {result}', 1)
+        return result
+    finally:
+        if deadline is not None:
+            deadline.unregister(process.kill)
+        process.join()
+        parent_conn.close()
@@ -13,9 +13,12 @@ from job_types import (
 
 )
 from scheduler import Scheduler
-from settings_store import clear_status_file
+from journal import Journal
+from settings_store import clear_status_file, set_logging
 from data import Data
 
+logger = logging.getLogger(__name__)
+
 data = Data()
 DATA_DIR = data.data_dir
 CITIES = data.cities
@@ -46,41 +49,54 @@ python3 using_example.py
 """
 
 
-def read_data_from_file():
-    """Заключительный этап конвейера: считываем результаты
-    из файла и выводим их в консоль"""
-    job_with_files = JobWithFiles()
+def print_city_data(outputs: list):
+    """Вывод городов и стран из результата задачи загрузки"""
+    for output in outputs:
+        if output is not None:
+            logger.info(
+                'READ RESULT: %s: %s', output['city'], output['country']
+            )
+    return ('success', 0)
+
+
+def read_data_from_results():
+    """Заключительный этап конвейера: получаем результаты
+    задачи загрузки из памяти, без чтения файлов,
+    и выводим их в консоль"""
     try:
         while True:
-            data_chunk = (yield)
-
-            read_file_job = Job(
-                target=job_with_files.read_file,
-                args=(f'{DATA_DIR}{data_chunk}_data.txt',),
-                tries=3,
+            read_urls_job = (yield)
+            print_job = Job(
+                target=print_city_data,
+                dependencies=(read_urls_job,),
+                receive_results=True,
             )
-            read_file_job.run()
+            print_job.run()
     except GeneratorExit:
-        logging.info('all data is read')
+        logger.info('all data is read')
 
 
 def get_data_and_analyze():
-    """Третий этап конвейера: получаем данные по URL
-    и заносим их в файл"""
-    coro = read_data_from_file()
+    """Третий этап конвейера: собираем города, получаем данные
+    по всем URL одной пакетной задачей с параллельными запросами
+    и заносим их в файлы. Результат задачи передается
+    следующему этапу через хранилище результатов"""
+    coro = read_data_from_results()
     coro.send(None)
     job_with_net = JobWithNet()
+    data_chunks = []
     try:
         while True:
-            data_chunck = (yield)
-            read_url_job = Job(
-                target=job_with_net.read_url,
-                args=(CITIES[data_chunck],)
-            )
-            read_url_job.run()
-            coro.send(data_chunck)
+            data_chunks.append((yield))
     except GeneratorExit:
-        logging.info('all data is ready')
+        read_urls_job = Job(
+            target=job_with_net.read_urls,
+            args=([CITIES[data_chunk] for data_chunk in data_chunks],)
+        )
+        read_urls_job.run()
+        coro.send(read_urls_job)
+        coro.close()
+        logger.info('all data is ready')
 
 
 def create_file():
@@ -109,7 +125,8 @@ def create_file():
 
             coro.send(data_chunk)
     except GeneratorExit:
-        logging.info('all files are created')
+        logger.info('all files are created')
+        coro.close()
 
 
 def sent_data_to_pipeline(data: Iterable):
@@ -120,7 +137,7 @@ def sent_data_to_pipeline(data: Iterable):
     coro.send(None)
 
     for data_chunck in data:
-        logging.debug(f'sent_data_to_pipeline: {data_chunck}')
+        logger.debug('sent_data_to_pipeline: %s', data_chunck)
         coro.send(data_chunck)
     coro.close()
     return ('success', 0)
@@ -214,22 +231,25 @@ def run_jobs_with_files():
 
 def run_instruction(scheduler: Scheduler):
     """Пример инструкций для планировщика:
-    запуск, рестарт, стоп"""
+    запуск, рестарт, ожидание выполнения задач, стоп"""
     scheduler.run()
     scheduler.restart()
+    scheduler.join()
     scheduler.stop()
 
 
 def run_scheduler():
     """Запуск планировщика:
-    создается объект планировщика,
-    в который добавляются задачи."""
-    scheduler = Scheduler(pool_size=5)
+    создается объект планировщика с журналом задач,
+    восстанавливаются задачи, не завершенные при прошлом запуске,
+    и добавляются новые задачи."""
+    scheduler = Scheduler(pool_size=5, journal=Journal())
+    scheduler.recover()
 
     try:
         while True:
             job = (yield)
-            logging.info(f'add job {job}')
+            logger.info('add job %s', job)
             scheduler.schedule(job)
     except GeneratorExit:
         run_instruction(scheduler)
@@ -281,6 +301,7 @@ def run_scheduler_test():
 
 
 if __name__ == '__main__':
+    set_logging()
     clear_status_file()
     run_jobs_with_files()
     run_jobs_with_fs()